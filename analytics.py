@@ -0,0 +1,138 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Коды ячеек матрицы посещаемости
+PRESENT = 1
+ABSENT = -1
+NO_ANSWER = 0
+
+
+class AttendanceMatrix:
+    """Посещаемость группы: матрица студенты × голосования (int8, коды PRESENT/ABSENT/NO_ANSWER).
+
+    Строки — студенты из списка группы, затем ответившие аккаунты, которых
+    в списке нет; столбцы — голосования по времени создания. Все агрегаты
+    считаются по столбцам/строкам целиком, без обхода ответов в Python.
+    """
+
+    def __init__(self, students: List[Dict], polls: List[Dict], codes: np.ndarray):
+        self.students = students
+        self.polls = polls
+        self.codes = codes
+
+    def counts(self, axis: int) -> Dict[str, np.ndarray]:
+        """Число отметок каждого вида по строкам (axis=1) или столбцам (axis=0)"""
+        return {
+            "present": np.count_nonzero(self.codes == PRESENT, axis=axis),
+            "absent": np.count_nonzero(self.codes == ABSENT, axis=axis),
+            "no_answer": np.count_nonzero(self.codes == NO_ANSWER, axis=axis),
+        }
+
+    def attendance_rate(self) -> np.ndarray:
+        """Доля занятий, на которых студент отметился присутствующим"""
+        if not self.polls:
+            return np.zeros(len(self.students))
+        return np.count_nonzero(self.codes == PRESENT, axis=1) / len(self.polls)
+
+    def turnout(self) -> np.ndarray:
+        """Доля присутствующих студентов на каждом занятии"""
+        if not self.students:
+            return np.zeros(len(self.polls))
+        return np.count_nonzero(self.codes == PRESENT, axis=0) / len(self.students)
+
+    def absence_streaks(self):
+        """Самая длинная и текущая серии пропусков (отсутствие или нет ответа) подряд"""
+        missed = (self.codes != PRESENT).astype(np.int32)
+        if missed.size == 0:
+            empty = np.zeros(len(self.students), dtype=np.int32)
+            return empty, empty
+        # Длина серии в каждой ячейке: накопленная сумма минус её значение на последнем посещении
+        total = np.cumsum(missed, axis=1)
+        reset = np.maximum.accumulate(np.where(missed == 0, total, 0), axis=1)
+        runs = total - reset
+        return runs.max(axis=1), runs[:, -1]
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка для экрана куратора и API"""
+        per_student = self.counts(axis=1)
+        per_poll = self.counts(axis=0)
+        rates = self.attendance_rate()
+        longest, current = self.absence_streaks()
+        turnout = self.turnout()
+        return {
+            "polls_count": len(self.polls),
+            "students_count": len(self.students),
+            "overall_rate": round(float(rates.mean()), 3) if len(rates) else 0.0,
+            "students": [
+                {
+                    "full_name": student.get("full_name", ""),
+                    "username": student.get("username", ""),
+                    "user_id": student.get("user_id"),
+                    "present": int(per_student["present"][i]),
+                    "absent": int(per_student["absent"][i]),
+                    "no_answer": int(per_student["no_answer"][i]),
+                    "rate": round(float(rates[i]), 3),
+                    "longest_absence": int(longest[i]),
+                    "current_absence": int(current[i]),
+                }
+                for i, student in enumerate(self.students)
+            ],
+            "polls": [
+                {
+                    "id": poll["id"],
+                    "created_at": poll.get("created_at", ""),
+                    "present": int(per_poll["present"][j]),
+                    "absent": int(per_poll["absent"][j]),
+                    "no_answer": int(per_poll["no_answer"][j]),
+                    "turnout": round(float(turnout[j]), 3),
+                }
+                for j, poll in enumerate(self.polls)
+            ],
+        }
+
+
+def build_attendance(db, group: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     snapshot: Optional[Dict] = None) -> AttendanceMatrix:
+    """Собирает матрицу посещаемости группы из текущих и архивных голосований.
+
+    snapshot — db.attendance_snapshot(), снятый в цикле событий, если матрица
+    строится в рабочем потоке: тогда из db читается только архив.
+    """
+    if snapshot is None:
+        live, group_students, index, users = None, db.get_group_students_data(group), db.student_index.get(group, {}), db.users
+    else:
+        live, group_students, index, users = snapshot["live"], snapshot["students"], snapshot["index"], snapshot["users"]
+    history = db.get_poll_history(group, since, until, live)
+    students = [dict(student) for student in group_students]
+    rows = {id(student): i for i, student in enumerate(group_students)}
+
+    # Строка для каждого ответившего аккаунта: через индекс студентов, иначе отдельная строка
+    row_of: Dict[str, int] = {}
+    for _, poll in history:
+        for user_key in poll.get("responses", {}):
+            if user_key in row_of:
+                continue
+            username = users.get(user_key, {}).get("username")
+            student = index.get(user_key)
+            if student is None and username:
+                student = index.get(f"@{username}")
+            row = rows.get(id(student)) if student is not None else None
+            if row is None:
+                row = len(students)
+                students.append({"full_name": users.get(user_key, {}).get("full_name", ""),
+                                 "username": username or "", "user_id": int(user_key)})
+            row_of[user_key] = row
+
+    codes = np.zeros((len(students), len(history)), dtype=np.int8)
+    for j, (_, poll) in enumerate(history):
+        responses = poll.get("responses", {})
+        if not responses:
+            continue
+        student_rows = np.fromiter((row_of[user_key] for user_key in responses), dtype=np.intp, count=len(responses))
+        values = np.fromiter((PRESENT if r.get("status") == "present" else ABSENT for r in responses.values()),
+                             dtype=np.int8, count=len(responses))
+        codes[student_rows, j] = values
+    polls = [{"id": poll_id, **{k: v for k, v in poll.items() if k != "responses"}} for poll_id, poll in history]
+    return AttendanceMatrix(students, polls, codes)
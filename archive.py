@@ -0,0 +1,93 @@
+import gzip
+import json
+import logging
+import os
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PollArchive:
+    """Архив закрытых голосований: сжатые сегменты по группам, только дописывание.
+
+    Каталог группы содержит сегменты <номер>.jsonl.gz; в каждом строки
+    {"id": ..., "poll": {...}}. Каждое архивирование дописывает к
+    последнему сегменту отдельный gzip-член (gzip допускает склейку
+    членов), поэтому уже записанные данные не перезаписываются. Когда
+    сегмент вырастает больше segment_bytes, начинается следующий.
+
+    Сначала голосование пишется в архив, потом удаляется из polls, так
+    что при падении между шагами запись может оказаться и там, и там
+    (или дважды в архиве) — чтение оставляет последнюю копию по id.
+    Оборванный при падении хвост сегмента при чтении пропускается.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 256 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+
+    def _group_dir(self, group: str) -> str:
+        return os.path.join(self.directory, group)
+
+    def _segments(self, group: str) -> List[str]:
+        """Пути сегментов группы по порядку записи"""
+        directory = self._group_dir(group)
+        if not os.path.isdir(directory):
+            return []
+        names = [name for name in os.listdir(directory) if name.endswith(".jsonl.gz")]
+        names.sort(key=lambda name: int(name.split(".", 1)[0]))
+        return [os.path.join(directory, name) for name in names]
+
+    def groups(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(self._group_dir(name)))
+
+    def append(self, group: str, polls: List[Tuple[str, Dict]]) -> None:
+        """Дописывает голосования группы одним gzip-членом"""
+        if not polls:
+            return
+        segments = self._segments(group)
+        if segments and os.path.getsize(segments[-1]) < self.segment_bytes:
+            path = segments[-1]
+        else:
+            number = int(os.path.basename(segments[-1]).split(".", 1)[0]) + 1 if segments else 1
+            os.makedirs(self._group_dir(group), exist_ok=True)
+            path = os.path.join(self._group_dir(group), f"{number:04d}.jsonl.gz")
+        lines = "".join(json.dumps({"id": poll_id, "poll": poll}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                        for poll_id, poll in polls)
+        data = gzip.compress(lines.encode("utf-8"))
+        with open(path, "ab") as f:
+            start = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError:
+                # Не оставляем оборванный член: за ним следующие записи было бы не прочитать
+                f.truncate(start)
+                raise
+
+    def _read_segment(self, path: str) -> Iterator[Tuple[str, Dict]]:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    yield record["id"], record["poll"]
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            logger.warning(f"Повреждённый хвост сегмента архива {path}: {e}")
+
+    def iter_polls(self, group: str, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """Голосования группы из архива по времени создания; since/until — строки в формате created_at"""
+        polls: Dict[str, Dict] = {}
+        for path in self._segments(group):
+            for poll_id, poll in self._read_segment(path):
+                polls[poll_id] = poll
+        for poll_id, poll in sorted(polls.items(), key=lambda item: item[1].get("created_at", "")):
+            created = poll.get("created_at", "")
+            if since and created < since:
+                continue
+            if until and created >= until:
+                continue
+            yield poll_id, poll
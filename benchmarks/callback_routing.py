@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Стоимость маршрутизации одного нажатия кнопки: прежние ~50 CallbackQueryHandler
+с регулярными выражениями (проверяются по порядку до первого совпадения)
+против CallbackRouter (разбор callback_data и спуск по префиксному дереву).
+
+Запуск из корня проекта: python benchmarks/callback_routing.py
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dispatcher import CallbackRouter
+
+# Шаблоны в порядке прежней регистрации в main()
+PATTERNS = [
+    "^join_", "^schedule_", "^announce_", "^stats_", "^change_group$", "^back_to_menu_", "^webapp_",
+    "^view_schedule_", "^view_announce_", "^ask_question_", "^view_questions_", "^answer_question_",
+    "^select_question_", "^cancel_question_", "^cancel_answer_", "^today_schedule_",
+    "^students_menu_[^_]+$", "^students_import_[^_]+$", "^students_list_[^_]+$", "^students_delete_[^_]+$",
+    "^students_delete_pick_", "^students_delete_do_", "^students_edit_[^_]+$", "^students_edit_pick_",
+    "^polls_menu_[^_]+$", "^polls_create_[^_]+$", "^polls_results_[^_]+$", "^polls_attendance_[^_]+$",
+    "^polls_export_[^_]+$", "^poll_view_", "^poll_export_", "^student_polls_[^_]+$", "^poll_(present|absent)_",
+    "^admin_panel$", "^admin_faculties$", "^admin_groups$", "^admin_curators$", "^admin_change_student_group$",
+    "^admin_change_group_select_", "^admin_change_group_confirm_", "^admin_stats$", "^admin_users$",
+    "^admin_questions$", "^admin_messages$", "^admin_clear_announcements$", "^admin_clear_all_announcements$",
+    "^admin_clear_announcements_by_group$", "^admin_clear_group_", "^admin_main_menu$",
+]
+
+# Типичные нажатия: голосования и меню студентов чаще всего, админка редко
+SAMPLES = [
+    "poll_present_ж1_1756928002", "poll_absent_ж1_1756928002", "view_schedule_ж1", "back_to_menu_ж1",
+    "view_announce_ж2", "today_schedule_р1", "students_delete_pick_ж1_12", "polls_results_ж3",
+    "poll_view_ж1_1756928002", "admin_main_menu", "join_р2", "admin_clear_group_ж1",
+]
+
+
+def regex_routes():
+    return [(re.compile(pattern), pattern) for pattern in PATTERNS]
+
+
+def regex_resolve(routes, data):
+    for pattern, handler in routes:
+        if pattern.match(data):
+            return handler
+    return None
+
+
+def trie_router():
+    router = CallbackRouter()
+    for pattern in PATTERNS:
+        body = pattern[1:]
+        if body == "poll_(present|absent)_":
+            router.add("poll_present", pattern)
+            router.add("poll_absent", pattern)
+        elif body.endswith("_[^_]+$"):
+            router.add(body[:-len("_[^_]+$")], pattern, nargs=1)
+        elif body.endswith("$"):
+            router.add(body[:-1], pattern, nargs=0)
+        else:
+            router.add(body.rstrip("_"), pattern)
+    return router
+
+
+def main():
+    routes = regex_routes()
+    router = trie_router()
+    for data in SAMPLES:
+        assert regex_resolve(routes, data) == router.resolve(data)[0], data
+
+    number = 20000
+    print(f"{'callback_data':34} {'regex, нс':>10} {'дерево, нс':>11}")
+    totals = [0.0, 0.0]
+    for data in SAMPLES:
+        regex_ns = min(timeit.repeat(lambda: regex_resolve(routes, data), number=number, repeat=5)) / number * 1e9
+        trie_ns = min(timeit.repeat(lambda: router.resolve(data), number=number, repeat=5)) / number * 1e9
+        totals[0] += regex_ns
+        totals[1] += trie_ns
+        print(f"{data:34} {regex_ns:10.0f} {trie_ns:11.0f}")
+    print(f"{'в среднем':34} {totals[0] / len(SAMPLES):10.0f} {totals[1] / len(SAMPLES):11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,27 @@
+import asyncio
 import logging
 import os
+import tempfile
+import time
 import httpx
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from config import BOT_TOKEN, GROUPS, CURATORS, GROUPS_LEGACY, ADMIN_ID, load_faculties, load_groups, load_curators, save_faculties, save_groups, save_curators
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes
+from config import BOT_TOKEN, ADMIN_ID, faculty_registry, group_registry, curator_registry, FLUSH_INTERVAL, FLUSH_MAX_DIRTY, BROADCAST_RATE, BROADCAST_CONCURRENCY, OUTBOX_DIR, SCHEDULER_FILE, QUESTION_REMINDER_HOURS, QUESTION_REMINDER_SWEEP, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, PORT, UPDATE_CONCURRENCY, CONVERSATION_TTL, REGISTRATION_TTL, LOOP_WATCHDOG_INTERVAL, LOOP_LAG_THRESHOLD, load_faculties, load_groups, load_curators, save_faculties, save_groups, save_curators
 from webapp_config import get_webapp_url, get_webapp_info
 from database import Database
-from datetime import datetime
+from broadcast import BroadcastEngine
+from outbox import Outbox
+from scheduler import PersistentScheduler
+from concurrency import PerUserUpdateProcessor
+from dispatcher import CallbackRouter
+from screens import ScreenCache
+from metrics import Metrics, MeteredRequest
+from watchdog import LoopWatchdog
+from conversation import ConversationStore, set_state, get_state, clear_state, FULL_NAME, INPUT, IMPORT_STUDENTS, EDIT_STUDENT, POLL_DURATION, ABSENCE_REASON, EXPIRED
+from timetable import WEEKDAYS, format_lesson
+from analytics import build_attendance
+from export import write_attendance_csv, ExportCache
+from datetime import datetime, timedelta
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,30 +32,29 @@ logger = logging.getLogger(__name__)
 
 # Инициализация базы данных
 db = Database()
+# Общий движок рассылок (лимиты Telegram действуют на весь бот)
+broadcaster = BroadcastEngine(rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY)
+# Очередь рассылок на диске: недоставленное продолжается после перезапуска
+outbox = Outbox(OUTBOX_DIR)
+# Отложенные задачи (закрытие голосований, напоминания) хранятся на диске
+scheduler = PersistentScheduler(SCHEDULER_FILE)
+# file_id отправленных выгрузок посещаемости: повторный запрос без изменений не загружает файл заново
+export_cache = ExportCache()
+# Готовые экраны меню и просмотра; пересобираются, только когда меняются их данные
+screen_cache = ScreenCache()
+# Время обработчиков, вызовы Bot API и записи на диск (/metrics и экран администратора)
+metrics = Metrics()
+# Сторож цикла событий: задержка в метрики, стек блокирующего кода — в лог
+loop_watchdog = LoopWatchdog(metrics, LOOP_WATCHDOG_INTERVAL, LOOP_LAG_THRESHOLD)
+scheduler.load()
 
 def get_group_name(group_id: str) -> str:
     """Получает название группы по ID"""
-    groups = load_groups()
-    return groups.get(group_id, {}).get("name", group_id)
+    return group_registry.name(group_id)
 
 def clear_conversation_state(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Очищает возможные конфликтующие состояния диалога."""
-    for key in (
-        "waiting_for",
-        "target_group",
-        "target_question",
-        "import_group",
-        "edit_student_group",
-        "edit_student_old",
-        "poll_absent_id",
-        "poll_absent_user",
-        "poll_group",
-        "poll_curator",
-    ):
-        try:
-            context.user_data.pop(key, None)
-        except Exception:
-            pass
+    """Сбрасывает ожидание ввода от пользователя"""
+    clear_state(context.user_data)
 
 def with_home_button(keyboard, group: str):
     """Добавляет кнопку '🏠 Главное меню' в клавиатуру, если её нет"""
@@ -126,8 +140,7 @@ async def handle_webapp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    groups = load_groups()
-    group_name = groups.get(group, {}).get("name", group)
+    group_name = get_group_name(group)
     is_curator = db.is_curator(user_id, group)
     
     role_text = "куратора" if is_curator else "студента"
@@ -161,8 +174,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if user_group:
         # Пользователь уже зарегистрирован — отправляем одно сообщение с меню
-        groups = load_groups()
-        group_name = groups.get(user_group, {}).get("name", user_group)
+        group_name = get_group_name(user_group)
 
         # Сохраняем последний экран
         try:
@@ -215,11 +227,7 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Проверяем, является ли пользователь куратором какой-либо группы
-    curators = load_curators()
-    curator_groups = []
-    for group, curator_ids in curators.items():
-        if user_id in curator_ids:
-            curator_groups.append(group)
+    curator_groups = curator_registry.groups_of(user_id)
     
     if curator_groups:
         # Пользователь является куратором
@@ -245,9 +253,7 @@ async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сброс регистрации пользователя"""
     user_id = update.effective_user.id
     
-    if str(user_id) in db.users:
-        del db.users[str(user_id)]
-        db.save_users()
+    if db.remove_user(user_id):
         await update.message.reply_text(
             "✅ Ваша регистрация сброшена! Используйте /start для повторной регистрации."
         )
@@ -264,6 +270,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/reset` - сбросить регистрацию
 • `/help` - показать эту справку
 • `/today` - расписание на сегодня
+• `/export <группа> [с] [по]` - выгрузка посещаемости в CSV (для кураторов)
 
 🎯 **Для студентов:**
 • 📅 Расписание - просмотр расписания группы
@@ -298,7 +305,7 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Если пользователь не зарегистрирован, проверим роль куратора
-    curator_groups = [g for g, ids in CURATORS.items() if user_id in ids]
+    curator_groups = curator_registry.groups_of(user_id)
     if len(curator_groups) == 1:
         group = curator_groups[0]
         db.update_user_rights(user_id, username, group, True)
@@ -369,16 +376,28 @@ async def today_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
     
     # Получаем расписание группы
+    group_name = get_group_name(user_group)
     group_messages = db.messages.get(user_group, [])
     schedule_messages = [m for m in group_messages if m['type'] == 'schedule']
+    today_lessons = db.get_today_lessons(user_group)
     
-    if not schedule_messages:
-        groups = load_groups()
-        group_name = groups.get(user_group, {}).get("name", user_group)
+    if db.timetable.get(user_group):
+        # Расписание разобрано по дням недели — показываем сегодняшние занятия
+        text = f"📅 **Расписание на сегодня ({WEEKDAYS[datetime.now().weekday()]})**\n"
+        text += f"Группа: {group_name}\n\n"
+        if today_lessons:
+            text += "\n".join(format_lesson(lesson) for lesson in today_lessons)
+        else:
+            text += "Сегодня занятий нет 🎉"
+        upcoming = db.get_next_lesson(user_group)
+        if upcoming:
+            day = WEEKDAYS[datetime.fromisoformat(upcoming['date']).weekday()]
+            text += f"\n\n⏭ Следующее занятие: {day}, {format_lesson(upcoming)}"
+    elif not schedule_messages:
         text = f"📅 **Расписание на сегодня для группы {group_name} пока не добавлено.**\n\n"
         text += "💡 Куратор группы добавит расписание в ближайшее время."
     else:
-        # Показываем последнее расписание (самое актуальное)
+        # Расписание не удалось разобрать — показываем последнее сообщение как есть
         latest_schedule = schedule_messages[-1]
         text = f"📅 **Расписание на сегодня**\n"
         text += f"Группа: {group_name}\n\n"
@@ -398,6 +417,13 @@ async def today_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_group_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает выбор группы для регистрации"""
+    welcome_text, reply_markup = screen_cache.get(("group_selection", None, None),
+                                                  (group_registry.version, faculty_registry.version),
+                                                  render_group_selection)
+    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def render_group_selection():
+    """Собирает экран выбора группы: приветствие и группы по факультетам"""
     welcome_text = """🎓 **Добро пожаловать в бота "УМЦ"!**
 
 📚 **УМЦ** - это Университет Мировых Цивилизаций, который помогает кураторам и студентам эффективно обучаться в университете.
@@ -434,8 +460,7 @@ async def show_group_selection(update: Update, context: ContextTypes.DEFAULT_TYP
         group_name = group_data.get("name", group_key)
         keyboard.append([InlineKeyboardButton(f"{group_name} ({faculty_name})", callback_data=f"join_{group_key}")])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+    return welcome_text, InlineKeyboardMarkup(keyboard)
 
 async def handle_group_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает выбор группы"""
@@ -447,8 +472,7 @@ async def handle_group_selection(update: Update, context: ContextTypes.DEFAULT_T
     
     if query.data.startswith("join_"):
         group = query.data.replace("join_", "")
-        groups = load_groups()
-        group_name = groups.get(group, {}).get("name", group)
+        group_name = get_group_name(group)
         
         # Проверяем, является ли пользователь куратором
         if db.is_curator(user_id, group):
@@ -469,9 +493,7 @@ async def handle_group_selection(update: Update, context: ContextTypes.DEFAULT_T
             await show_main_menu(update, context, group)
         else:
             # Для всех студентов запрашиваем ФИО при регистрации
-            context.user_data['waiting_for_full_name'] = True
-            context.user_data['full_name_group'] = group
-            context.user_data['registration_username'] = username
+            set_state(context.user_data, FULL_NAME, REGISTRATION_TTL, group=group, username=username)
             await query.edit_message_text(
                 f"👋 Добро пожаловать в группу {group_name}!\n\n"
                 "📝 Укажите ваше ФИО для регистрации (например: Иванов Иван Иванович):"
@@ -498,6 +520,7 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("👨‍🏫 Назначение кураторов", callback_data="admin_curators")],
         [InlineKeyboardButton("🔄 Смена группы студента", callback_data="admin_change_student_group")],
         [InlineKeyboardButton("📊 Общая статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton("⏱ Производительность", callback_data="admin_metrics")],
         [InlineKeyboardButton("👤 Все пользователи", callback_data="admin_users")],
         [InlineKeyboardButton("❓ Все вопросы", callback_data="admin_questions")],
         [InlineKeyboardButton("📢 Все сообщения", callback_data="admin_messages")],
@@ -512,24 +535,8 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, group: str):
-    """Показывает главное меню для группы"""
-    user_id = update.effective_user.id if update.effective_user else update.callback_query.from_user.id
-    
-    # Очищаем залипшие состояния при входе в меню
-    context.user_data.pop("waiting_for", None)
-    context.user_data.pop("target_group", None)
-    context.user_data.pop("target_question", None)
-
-    # Сохраняем последний экран
-    try:
-        db.set_last_screen(user_id, f"menu_{group}")
-    except Exception:
-        pass
-    
-    # Проверяем, является ли пользователь куратором
-    is_curator = db.is_curator(user_id, group)
-    
+def render_main_menu(group: str, is_curator: bool):
+    """Собирает главное меню группы (текст и клавиатура)"""
     if is_curator:
         # Меню для куратора
         keyboard = [
@@ -541,8 +548,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, gro
             [InlineKeyboardButton("📊 Статистика группы", callback_data=f"stats_{group}")],
             [InlineKeyboardButton("🚀 Веб-приложение", callback_data=f"webapp_{group}")]
         ]
-        groups = load_groups()
-        group_name = groups.get(group, {}).get("name", group)
+        group_name = get_group_name(group)
         title = f"👨‍🏫 Меню куратора группы {group_name}"
     else:
         # Меню для студента
@@ -553,15 +559,33 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, gro
             [InlineKeyboardButton("❓ Задать вопрос", callback_data=f"ask_question_{group}")],
             [InlineKeyboardButton("🚀 Веб-приложение", callback_data=f"webapp_{group}")]
         ]
-        groups = load_groups()
-        group_name = groups.get(group, {}).get("name", group)
+        group_name = get_group_name(group)
         title = f"👨‍🎓 Меню группы {group_name}"
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return title, InlineKeyboardMarkup(keyboard)
+
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, group: str):
+    """Показывает главное меню для группы"""
+    user_id = update.effective_user.id if update.effective_user else update.callback_query.from_user.id
+    
+    # Очищаем залипшие состояния при входе в меню
+    clear_conversation_state(context)
+
+    # Сохраняем последний экран
+    try:
+        db.set_last_screen(user_id, f"menu_{group}")
+    except Exception:
+        pass
+    
+    # Проверяем, является ли пользователь куратором
+    is_curator = db.is_curator(user_id, group)
+    role = "curator" if is_curator else "student"
+    title, reply_markup = screen_cache.get(("menu", group, role), group_registry.version,
+                                           lambda: render_main_menu(group, is_curator))
     
     if update.callback_query:
         try:
-        await update.callback_query.edit_message_text(title, reply_markup=reply_markup)
+            await update.callback_query.edit_message_text(title, reply_markup=reply_markup)
         except Exception:
             # Если не удается отредактировать (например, сообщение уже удалено), отправляем новое
             await context.bot.send_message(
@@ -571,7 +595,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, gro
             )
     else:
         try:
-        await update.message.reply_text(title, reply_markup=reply_markup)
+            await update.message.reply_text(title, reply_markup=reply_markup)
         except Exception:
             # Резервный канал на случай таймаута
             await context.bot.send_message(
@@ -587,8 +611,7 @@ async def handle_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     group = query.data.replace("schedule_", "")
     user_id = query.from_user.id
-    groups = load_groups()
-    group_name = groups.get(group, {}).get("name", group)
+    group_name = get_group_name(group)
     
     # Проверяем права куратора
     if not db.is_curator(user_id, group):
@@ -596,9 +619,7 @@ async def handle_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Сохраняем состояние для ожидания расписания
-    clear_conversation_state(context)
-    context.user_data["waiting_for"] = f"schedule_{group}"
-    context.user_data["target_group"] = group
+    set_state(context.user_data, INPUT, CONVERSATION_TTL, waiting_for=f"schedule_{group}", target_group=group)
     
     await query.edit_message_text(
         f"📅 **Отправка расписания для группы {group_name}**\n\n"
@@ -616,8 +637,7 @@ async def handle_announcement(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     group = query.data.replace("announce_", "")
     user_id = query.from_user.id
-    groups = load_groups()
-    group_name = groups.get(group, {}).get("name", group)
+    group_name = get_group_name(group)
     
     # Проверяем права куратора
     if not db.is_curator(user_id, group):
@@ -625,9 +645,7 @@ async def handle_announcement(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # Сохраняем состояние для ожидания объявления
-    clear_conversation_state(context)
-    context.user_data["waiting_for"] = f"announce_{group}"
-    context.user_data["target_group"] = group
+    set_state(context.user_data, INPUT, CONVERSATION_TTL, waiting_for=f"announce_{group}", target_group=group)
     
     await query.edit_message_text(
         f"Отправьте объявление для группы {group_name}.\n"
@@ -636,7 +654,8 @@ async def handle_announcement(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает входящие сообщения"""
-    if not context.user_data.get("waiting_for"):
+    state, state_data = get_state(context.user_data)
+    if state != INPUT:
         # Если нет ожидаемого состояния, автоматически открываем главное меню
         user_id = update.effective_user.id
         username = update.effective_user.username or "Unknown"
@@ -649,8 +668,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         # Если пользователь не зарегистрирован, проверим, является ли он куратором
-        curators = load_curators()
-        curator_groups = [g for g, ids in curators.items() if user_id in ids]
+        curator_groups = curator_registry.groups_of(user_id)
         if len(curator_groups) == 1:
             # Автозапись куратора в свою группу и открытие меню куратора
             group = curator_groups[0]
@@ -669,10 +687,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = update.effective_user.id
-    waiting_for = context.user_data["waiting_for"]
-    target_group = context.user_data["target_group"]
-    groups = load_groups()
-    group_name = groups.get(target_group, {}).get("name", target_group)
+    waiting_for = state_data["waiting_for"]
+    target_group = state_data["target_group"]
+    group_name = get_group_name(target_group)
 
     # Поддержка медиа
     has_photo = bool(update.message.photo)
@@ -699,8 +716,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             content_type = "текст"
         
         # Очищаем состояние
-        context.user_data.pop("waiting_for", None)
-        context.user_data.pop("target_group", None)
+        clear_conversation_state(context)
         
         await update.message.reply_text(
             f"✅ **Расписание успешно сохранено!**\n\n"
@@ -715,21 +731,29 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ У вас нет прав для отправки объявлений в эту группу!")
             return
         
+        # Объявление попадает в историю и на диск до рассылки: если бот перезапустится
+        # посреди неё, очередь дошлёт рассылку, а запись в «📢 Последние объявления» уже есть
         if has_photo:
-            file_id = update.message.photo[-1].file_id
-            sent_count = await send_to_group_media(context, target_group, media_type="photo", file_id=file_id, caption=(text or ""), title_prefix="📢 НОВОЕ ОБЪЯВЛЕНИЕ")
             db.add_message(target_group, "announcement", text or "[фото]", user_id)
         elif has_document:
-            file_id = update.message.document.file_id
-            sent_count = await send_to_group_media(context, target_group, media_type="document", file_id=file_id, caption=(text or ""), title_prefix="📢 НОВОЕ ОБЪЯВЛЕНИЕ")
             db.add_message(target_group, "announcement", text or "[документ]", user_id)
         else:
-            sent_count = await send_to_group(update, context, target_group, "📢 НОВОЕ ОБЪЯВЛЕНИЕ", text or "")
             db.add_message(target_group, "announcement", text or "", user_id)
+        await db.persist()
+        
+        status = await update.message.reply_text(f"📤 Отправка объявления: 0/{len(db.get_group_users(target_group))}")
+        progress = progress_reporter(status, "📤 Отправка объявления")
+        if has_photo:
+            file_id = update.message.photo[-1].file_id
+            sent_count = await send_to_group_media(context, target_group, media_type="photo", file_id=file_id, caption=(text or ""), title_prefix="📢 НОВОЕ ОБЪЯВЛЕНИЕ", progress=progress)
+        elif has_document:
+            file_id = update.message.document.file_id
+            sent_count = await send_to_group_media(context, target_group, media_type="document", file_id=file_id, caption=(text or ""), title_prefix="📢 НОВОЕ ОБЪЯВЛЕНИЕ", progress=progress)
+        else:
+            sent_count = await send_to_group(update, context, target_group, "📢 НОВОЕ ОБЪЯВЛЕНИЕ", text or "", progress=progress)
         
         # Очищаем состояние
-        context.user_data.pop("waiting_for", None)
-        context.user_data.pop("target_group", None)
+        clear_conversation_state(context)
         
         await update.message.reply_text(
             f"✅ Объявление успешно отправлено всем участникам группы {group_name}!\n\n"
@@ -744,8 +768,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         question_id = db.add_question(user_id, target_group, text or "")
         
         # Очищаем состояние
-        context.user_data.pop("waiting_for", None)
-        context.user_data.pop("target_group", None)
+        clear_conversation_state(context)
         
         await update.message.reply_text(
             f"✅ Вопрос #{question_id} успешно отправлен куратору группы {group_name}!\n\n"
@@ -754,12 +777,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Уведомляем кураторов группы
         try:
-            from config import CURATORS
-            curator_ids = CURATORS.get(target_group, [])
+            curator_ids = curator_registry.curators_of(target_group)
             if curator_ids:
                 preview = ((text or "")[:120] + '...') if (text and len(text) > 120) else (text or "")
                 notify_text = (
-                    f"❓ Новый вопрос от студента в группе {GROUPS[target_group]}\n\n"
+                    f"❓ Новый вопрос от студента в группе {get_group_name(target_group)}\n\n"
                     f"🧑‍🎓 ID студента: {user_id}\n"
                     f"#ID{question_id}\n\n"
                     f"Текст: {preview}"
@@ -767,25 +789,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup = InlineKeyboardMarkup([
                     [InlineKeyboardButton("📝 Ответить", callback_data=f"answer_question_{target_group}")]
                 ])
-                for curator_id in curator_ids:
-                    try:
-                        await context.bot.send_message(chat_id=curator_id, text=notify_text, reply_markup=reply_markup)
-                    except Exception as e:
-                        logger.error(f"Не удалось уведомить куратора {curator_id}: {e}")
+                async def notify(curator_id):
+                    await context.bot.send_message(chat_id=curator_id, text=notify_text, reply_markup=reply_markup)
+                await broadcaster.broadcast(curator_ids, notify)
         except Exception as e:
             logger.error(f"Ошибка при уведомлении кураторов: {e}")
 
-        # Планируем напоминания кураторам через 2/6/24 часа, если вопрос не отвечен
-        try:
-            if context.job_queue:
-                for seconds in (2*60*60, 6*60*60, 24*60*60):
-                    context.job_queue.run_once(
-                        remind_pending_question,
-                        when=seconds,
-                        data={"group": target_group, "question_id": question_id}
-                    )
-        except Exception as e:
-            logger.error(f"Не удалось запланировать напоминания: {e}")
+        # Напоминания кураторам отправляет периодический обход (remind_pending_questions)
         
     elif waiting_for.startswith("answer_"):
         # Куратор отвечает на вопрос
@@ -803,7 +813,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Отвечаем на вопрос
         if db.answer_question(target_group, question_id, text or "", user_id):
             # Уведомляем студента об ответе
-            question = context.user_data.get("target_question", {})
+            question = state_data.get("target_question", {})
             if question and "user_id" in question:
                 try:
                     await context.bot.send_message(
@@ -812,16 +822,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             f"💬 **Ответ на ваш вопрос #{question_id}:**\n\n"
                              f"❓ **Вопрос:** {question['question']}\n\n"
                             f"✅ **Ответ:** {text or ''}\n\n"
-                             f"👨‍🏫 Группа: {GROUPS[target_group]}"
+                             f"👨‍🏫 Группа: {get_group_name(target_group)}"
                         )
                     )
                 except Exception as e:
                     logger.error(f"Не удалось отправить ответ студенту {question['user_id']}: {e}")
             
             # Очищаем состояние
-            context.user_data.pop("waiting_for", None)
-            context.user_data.pop("target_group", None)
-            context.user_data.pop("target_question", None)
+            clear_conversation_state(context)
             
             await update.message.reply_text(
                 f"✅ **Ответ на вопрос #{question_id} успешно отправлен студенту!**\n\n"
@@ -830,39 +838,54 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text("❌ Не удалось ответить на вопрос. Возможно, он уже отвечен.")
 
-async def send_to_group(update: Update, context: ContextTypes.DEFAULT_TYPE, group: str, title: str, content: str):
+def make_outbox_sender(bot, record: dict):
+    """Функция отправки одного сообщения рассылки из очереди"""
+    kind = record.get("kind")
+    text = record.get("text") or ""
+    parse_mode = record.get("parse_mode")
+    reply_markup = InlineKeyboardMarkup.de_json(record["reply_markup"], bot) if record.get("reply_markup") else None
+    
+    async def send(user_id):
+        if kind == "photo":
+            await bot.send_photo(chat_id=user_id, photo=record["file_id"], caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif kind == "document":
+            await bot.send_document(chat_id=user_id, document=record["file_id"], caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        else:
+            await bot.send_message(chat_id=user_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+    
+    return send
+
+async def send_to_group(update: Update, context: ContextTypes.DEFAULT_TYPE, group: str, title: str, content: str, progress=None):
     """Отправляет сообщение всем пользователям группы"""
     users = db.get_group_users(group)
     
     message = f"{title}\n\n{content}\n\n👥 Группа: {get_group_name(group)}"
     
-    sent_count = 0
-    for user_id in users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message, parse_mode='Markdown')
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-    
-    return sent_count
+    broadcast_id = outbox.enqueue(group, users, "text", message, parse_mode='Markdown')
+    return await outbox.deliver(broadcast_id, progress)
 
-async def send_to_group_media(context: ContextTypes.DEFAULT_TYPE, group: str, media_type: str, file_id: str, caption: str, title_prefix: str):
+async def send_to_group_media(context: ContextTypes.DEFAULT_TYPE, group: str, media_type: str, file_id: str, caption: str, title_prefix: str, progress=None):
     """Отправляет фото/документ всем пользователям группы с общей подписью"""
+    if media_type not in ("photo", "document"):
+        return 0
     users = db.get_group_users(group)
     full_caption = f"{title_prefix}\n\n{caption}\n\n👥 Группа: {get_group_name(group)}" if caption else f"{title_prefix}\n\n👥 Группа: {get_group_name(group)}"
-    sent_count = 0
-    for user_id in users:
-        try:
-            if media_type == "photo":
-                await context.bot.send_photo(chat_id=user_id, photo=file_id, caption=full_caption)
-            elif media_type == "document":
-                await context.bot.send_document(chat_id=user_id, document=file_id, caption=full_caption)
-            else:
-                continue
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Не удалось отправить {media_type} пользователю {user_id}: {e}")
-    return sent_count
+    
+    broadcast_id = outbox.enqueue(group, users, media_type, full_caption, file_id=file_id)
+    return await outbox.deliver(broadcast_id, progress)
+
+def progress_reporter(message, title: str):
+    """Колбэк прогресса рассылки: обновляет сообщение куратору не чаще раза в 2 секунды"""
+    last_edit = {"at": time.monotonic()}
+    
+    async def report(done: int, sent: int, total: int):
+        now = time.monotonic()
+        if done < total and now - last_edit["at"] < 2:
+            return
+        last_edit["at"] = now
+        await message.edit_text(f"{title}: {done}/{total} (доставлено {sent})")
+    
+    return report
 
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает статистику группы"""
@@ -902,9 +925,7 @@ async def change_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Удаляем пользователя из текущей группы
     user_id = query.from_user.id
-    if str(user_id) in db.users:
-        del db.users[str(user_id)]
-        db.save_users()
+    db.remove_user(user_id)
     
     # Показываем выбор новой группы
     await show_group_selection(update, context)
@@ -923,11 +944,11 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not current_group or current_group != group:
         # Пользователь сменил группу или не зарегистрирован
         try:
-        await query.edit_message_text(
-            "❌ **Ошибка навигации**\n\n"
-            "Ваша группа изменилась или вы не зарегистрированы.\n"
-            "Используйте /start для повторной регистрации."
-        )
+            await query.edit_message_text(
+                "❌ **Ошибка навигации**\n\n"
+                "Ваша группа изменилась или вы не зарегистрированы.\n"
+                "Используйте /start для повторной регистрации."
+            )
         except Exception:
             # Если не удается отредактировать, отправляем новое сообщение
             await context.bot.send_message(
@@ -942,6 +963,33 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
+def render_schedule(group: str):
+    """Собирает экран расписания группы: текст (или подпись), клавиатура и медиа (тип, file_id) либо None"""
+    schedule_messages = [m for m in db.messages.get(group, []) if m['type'] == 'schedule']
+    
+    if not schedule_messages:
+        text = f"📅 **Расписание для группы {get_group_name(group)} пока не добавлено.**\n\n"
+        text += "💡 Куратор группы добавит расписание в ближайшее время."
+        return text, with_home_button([], group), None
+    
+    # Показываем последнее расписание
+    latest_schedule = schedule_messages[-1]
+    keyboard = [
+        [InlineKeyboardButton("🔄 Обновить", callback_data=f"view_schedule_{group}")]
+    ]
+    reply_markup = with_home_button(keyboard, group)
+    
+    # Проверяем, есть ли медиа
+    if latest_schedule.get('file_id') and latest_schedule.get('media_type'):
+        caption = f"📅 **Расписание группы {get_group_name(group)}**\n\n{latest_schedule['content']}\n\n📅 Обновлено: {latest_schedule.get('timestamp', 'Неизвестно')}"
+        return caption, reply_markup, (latest_schedule['media_type'], latest_schedule['file_id'])
+    
+    # Обычное текстовое расписание
+    text = f"📅 **Расписание группы {get_group_name(group)}**\n\n"
+    text += f"{latest_schedule['content']}\n\n"
+    text += f"📅 Обновлено: {latest_schedule.get('timestamp', 'Неизвестно')}"
+    return text, reply_markup, None
+
 async def view_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает расписание группы"""
     query = update.callback_query
@@ -949,7 +997,6 @@ async def view_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     group = query.data.replace("view_schedule_", "")
     user_id = query.from_user.id
-    group_messages = db.messages.get(group, [])
     
     # Сохраняем последний экран
     try:
@@ -957,49 +1004,19 @@ async def view_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
     
-    schedule_messages = [m for m in group_messages if m['type'] == 'schedule']
-    
-    if not schedule_messages:
-        text = f"📅 **Расписание для группы {get_group_name(group)} пока не добавлено.**\n\n"
-        text += "💡 Куратор группы добавит расписание в ближайшее время."
+    text, reply_markup, media = screen_cache.get(("schedule", group, None),
+                                                 (db.version("messages", group), group_registry.version),
+                                                 lambda: render_schedule(group))
+    if media:
+        media_type, file_id = media
+        if media_type == "photo":
+            await context.bot.send_photo(chat_id=query.from_user.id, photo=file_id, caption=text, reply_markup=reply_markup, parse_mode='Markdown')
+        elif media_type == "document":
+            await context.bot.send_document(chat_id=query.from_user.id, document=file_id, caption=text, reply_markup=reply_markup, parse_mode='Markdown')
         
-        keyboard = []
-        reply_markup = with_home_button(keyboard, group)
-    else:
-        # Показываем последнее расписание
-        latest_schedule = schedule_messages[-1]
-        
-        # Проверяем, есть ли медиа
-        if latest_schedule.get('file_id') and latest_schedule.get('media_type'):
-            file_id = latest_schedule['file_id']
-            media_type = latest_schedule['media_type']
-            caption = f"📅 **Расписание группы {get_group_name(group)}**\n\n{latest_schedule['content']}\n\n📅 Обновлено: {latest_schedule.get('timestamp', 'Неизвестно')}"
-    
-    keyboard = [
-                [InlineKeyboardButton("🔄 Обновить", callback_data=f"view_schedule_{group}")]
-            ]
-            reply_markup = with_home_button(keyboard, group)
-            
-            if media_type == "photo":
-                await context.bot.send_photo(chat_id=query.from_user.id, photo=file_id, caption=caption, reply_markup=reply_markup, parse_mode='Markdown')
-            elif media_type == "document":
-                await context.bot.send_document(chat_id=query.from_user.id, document=file_id, caption=caption, reply_markup=reply_markup, parse_mode='Markdown')
-            
-            # Удаляем старое сообщение
-            await query.delete_message()
-            return
-        else:
-            # Обычное текстовое расписание
-            text = f"📅 **Расписание группы {get_group_name(group)}**\n\n"
-            text += f"{latest_schedule['content']}\n\n"
-            text += f"📅 Обновлено: {latest_schedule.get('timestamp', 'Неизвестно')}"
-    
-            keyboard = [
-                [InlineKeyboardButton("🔄 Обновить", callback_data=f"view_schedule_{group}")]
-            ]
-            reply_markup = with_home_button(keyboard, group)
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-            return
+        # Удаляем старое сообщение
+        await query.delete_message()
+        return
 
     # Единая точка отправки ответа
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
@@ -1011,7 +1028,6 @@ async def view_announcements(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     group = query.data.replace("view_announce_", "")
     user_id = query.from_user.id
-    group_messages = db.messages.get(group, [])
     
     # Сохраняем последний экран
     try:
@@ -1019,7 +1035,14 @@ async def view_announcements(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception:
         pass
     
-    announce_messages = [m for m in group_messages if m['type'] == 'announcement']
+    text, reply_markup = screen_cache.get(("announcements", group, None),
+                                          (db.version("messages", group), group_registry.version),
+                                          lambda: render_announcements(group))
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def render_announcements(group: str):
+    """Собирает экран последних объявлений группы"""
+    announce_messages = [m for m in db.messages.get(group, []) if m['type'] == 'announcement']
     
     if not announce_messages:
         text = f"📢 **Объявления для группы {get_group_name(group)} пока нет.**\n\n"
@@ -1033,9 +1056,7 @@ async def view_announcements(update: Update, context: ContextTypes.DEFAULT_TYPE)
     keyboard = [
         [InlineKeyboardButton("📢 Последние объявления", callback_data=f"view_announce_{group}")]
     ]
-    reply_markup = with_home_button(keyboard, group)
-    
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    return text, with_home_button(keyboard, group)
 
 async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает запрос на задание вопроса"""
@@ -1046,9 +1067,7 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     # Сохраняем состояние для ожидания вопроса
-    clear_conversation_state(context)
-    context.user_data["waiting_for"] = f"question_{group}"
-    context.user_data["target_group"] = group
+    set_state(context.user_data, INPUT, CONVERSATION_TTL, waiting_for=f"question_{group}", target_group=group)
 
     # Сохраняем последний экран
     try:
@@ -1190,10 +1209,8 @@ async def select_question_for_answer(update: Update, context: ContextTypes.DEFAU
         return
     
     # Сохраняем состояние для ожидания ответа
-    clear_conversation_state(context)
-    context.user_data["waiting_for"] = f"answer_{group}_{question_id}"
-    context.user_data["target_group"] = group
-    context.user_data["target_question"] = question
+    set_state(context.user_data, INPUT, CONVERSATION_TTL, waiting_for=f"answer_{group}_{question_id}",
+              target_group=group, target_question=question)
     
     # Добавляем кнопку отмены
     keyboard = [[InlineKeyboardButton("❌ Отменить ответ", callback_data=f"cancel_answer_{group}")]]
@@ -1221,8 +1238,7 @@ async def cancel_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group = query.data.replace("cancel_question_", "")
     
     # Очищаем состояние
-    context.user_data.pop("waiting_for", None)
-    context.user_data.pop("target_group", None)
+    clear_conversation_state(context)
     
     await query.edit_message_text(
         f"❌ **Вопрос отменен**\n\n"
@@ -1239,9 +1255,7 @@ async def cancel_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group = query.data.replace("cancel_answer_", "")
     
     # Очищаем состояние
-    context.user_data.pop("waiting_for", None)
-    context.user_data.pop("target_group", None)
-    context.user_data.pop("target_question", None)
+    clear_conversation_state(context)
     
     await query.edit_message_text(
         f"❌ **Ответ отменен**\n\n"
@@ -1250,35 +1264,42 @@ async def cancel_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-async def remind_pending_question(context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет напоминание кураторам, если вопрос не отвечен"""
+def format_age(seconds: float) -> str:
+    """Возраст вопроса для напоминания: «3 ч» или «2 дн»"""
+    hours = int(seconds // 3600)
+    return f"{hours // 24} дн" if hours >= 48 else f"{hours} ч"
+
+async def remind_pending_questions(context: ContextTypes.DEFAULT_TYPE):
+    """Периодический обход неотвеченных вопросов: одна сводка каждому куратору"""
     try:
-        data = context.job.data or {}
-        group = data.get("group")
-        question_id = data.get("question_id")
-        if not group or not question_id:
-            return
-        question = db.get_question(group, question_id)
-        if not question or question.get("status") != "pending":
+        due = db.collect_due_reminders([hours * 60 * 60 for hours in QUESTION_REMINDER_HOURS])
+        if not due:
             return
-        from config import CURATORS
-        curator_ids = CURATORS.get(group, [])
-        if not curator_ids:
-            return
-        preview = (question.get("question", "")[:120] + '...') if len(question.get("question", "")) > 120 else question.get("question", "")
-        notify_text = (
-            f"⏰ Напоминание: вопрос #{question_id} все еще без ответа\n\n"
-            f"Группа: {get_group_name(group)}\n"
-            f"Текст: {preview}"
-        )
-        reply_markup = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📝 Ответить", callback_data=f"answer_question_{group}")]
-        ])
-        for curator_id in curator_ids:
-            try:
-                await context.bot.send_message(chat_id=curator_id, text=notify_text, reply_markup=reply_markup)
-            except Exception as e:
-                logger.error(f"Не удалось отправить напоминание куратору {curator_id}: {e}")
+        # Куратор → его просроченные вопросы (по всем курируемым группам)
+        digests = {}
+        for group, question, age in due:
+            for curator_id in curator_registry.curators_of(group):
+                digests.setdefault(curator_id, []).append((group, question, age))
+        
+        for curator_id, items in digests.items():
+            lines = [f"⏰ Вопросы без ответа: {len(items)}\n"]
+            for group, question, age in items[:20]:
+                text = question.get("question", "")
+                preview = (text[:80] + '...') if len(text) > 80 else text
+                lines.append(f"• {get_group_name(group)} #{question['id']} ({format_age(age)}): {preview}")
+            if len(items) > 20:
+                lines.append(f"…и ещё {len(items) - 20}")
+            groups = list(dict.fromkeys(group for group, _, _ in items))
+            reply_markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton(f"📝 Ответить ({get_group_name(group)})", callback_data=f"answer_question_{group}")]
+                for group in groups
+            ])
+            digest_text = "\n".join(lines)
+            await broadcaster.send_one(
+                curator_id,
+                lambda chat_id: context.bot.send_message(chat_id=chat_id, text=digest_text, reply_markup=reply_markup)
+            )
+        logger.info(f"Напоминания о вопросах: {len(due)} вопросов, {len(digests)} кураторов")
     except Exception as e:
         logger.error(f"Ошибка в напоминании: {e}")
 
@@ -1290,35 +1311,32 @@ async def import_students_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Использование: /import_students <группа>\nНапример: /import_students ж1")
         return
     group = args[0].lower()
-    if group not in GROUPS:
-        await update.message.reply_text("Неизвестная группа. Доступные: " + ", ".join(GROUPS.keys()))
+    if group not in group_registry:
+        await update.message.reply_text("Неизвестная группа. Доступные: " + ", ".join(load_groups().keys()))
         return
     # Проверяем, что пользователь куратор этой группы
     if not db.is_curator(user_id, group):
         await update.message.reply_text("❌ У вас нет прав импортировать студентов для этой группы")
         return
-    context.user_data["import_group"] = group
+    set_state(context.user_data, IMPORT_STUDENTS, CONVERSATION_TTL, group=group)
     await update.message.reply_text(
         f"Отправьте текстовый список студентов для группы {get_group_name(group)} одной последующей сообщением.\n"
         "Каждая строка – один студент. Номера в начале строк можно не удалять."
     )
 
-async def handle_import_students_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_import_students_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state_data: dict):
     """Принимает текст после /import_students и сохраняет студентов"""
-    group = context.user_data.get("import_group")
-    if not group:
-        return False
+    group = state_data["group"]
     text = update.message.text or ""
     added = db.import_students_text(group, text)
-    context.user_data.pop("import_group", None)
+    clear_conversation_state(context)
     await update.message.reply_text(f"✅ Импортировано студентов: {added}\nГруппа: {get_group_name(group)}")
-    return True
 
 async def students_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает количество студентов группы и первые 15 ФИО: /students ж1"""
     args = context.args if hasattr(context, 'args') else []
     group = (args[0].lower() if args else db.get_user_group(update.effective_user.id))
-    if not group or group not in GROUPS:
+    if not group or group not in group_registry:
         await update.message.reply_text("Использование: /students <группа>")
         return
     students = db.get_students(group)
@@ -1353,8 +1371,7 @@ async def students_import_start(update: Update, context: ContextTypes.DEFAULT_TY
     if not db.is_curator(user_id, group):
         await query.edit_message_text("❌ Нет прав")
         return
-    clear_conversation_state(context)
-    context.user_data["import_group"] = group
+    set_state(context.user_data, IMPORT_STUDENTS, CONVERSATION_TTL, group=group)
     await query.edit_message_text(
         f"Отправьте текстовый список студентов для {get_group_name(group)} одной последующей сообщением.\n"
         "Каждая строка — один студент. Номера можно оставлять.")
@@ -1469,28 +1486,22 @@ async def students_edit_ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not db.is_curator(user_id, group):
         await query.edit_message_text("❌ Нет прав")
         return
-    clear_conversation_state(context)
-    context.user_data['edit_student_group'] = group
-    context.user_data['edit_student_old'] = old_name
+    set_state(context.user_data, EDIT_STUDENT, CONVERSATION_TTL, group=group, old_name=old_name)
     await query.edit_message_text(f"Введите новое ФИО для:\n{old_name}")
 
-async def handle_edit_student_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    group = context.user_data.get('edit_student_group')
-    old_name = context.user_data.get('edit_student_old')
-    if not group or not old_name:
-        return False
+async def handle_edit_student_text(update: Update, context: ContextTypes.DEFAULT_TYPE, state_data: dict):
+    group = state_data["group"]
+    old_name = state_data["old_name"]
     new_name = (update.message.text or '').strip()
     if not new_name:
         await update.message.reply_text("ФИО не может быть пустым. Отправьте снова.")
-        return True
+        return
     ok = db.update_student_name(group, old_name, new_name)
-    context.user_data.pop('edit_student_group', None)
-    context.user_data.pop('edit_student_old', None)
+    clear_conversation_state(context)
     if ok:
         await update.message.reply_text(f"✅ Обновлено:\n{old_name}\n→ {new_name}")
     else:
         await update.message.reply_text("❌ Не удалось обновить (возможно, не найдено)")
-    return True
 
 # --- Polls ---
 async def polls_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1504,7 +1515,9 @@ async def polls_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     keyboard = [
         [InlineKeyboardButton("➕ Создать голосование", callback_data=f"polls_create_{group}")],
-        [InlineKeyboardButton("📊 Результаты голосований", callback_data=f"polls_results_{group}")]
+        [InlineKeyboardButton("📊 Результаты голосований", callback_data=f"polls_results_{group}")],
+        [InlineKeyboardButton("📈 Посещаемость за семестр", callback_data=f"polls_attendance_{group}")],
+        [InlineKeyboardButton("📥 Выгрузить посещаемость (CSV)", callback_data=f"polls_export_{group}")]
     ]
     reply_markup = with_home_button(keyboard, group)
     await query.edit_message_text(f"🗳 Голосования группы {get_group_name(group)}", reply_markup=reply_markup)
@@ -1518,40 +1531,34 @@ async def polls_create_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not db.is_curator(user_id, group):
         await query.edit_message_text("❌ Нет прав")
         return
-    clear_conversation_state(context)
-    context.user_data["poll_group"] = group
-    context.user_data["poll_curator"] = user_id
+    set_state(context.user_data, POLL_DURATION, CONVERSATION_TTL, group=group, curator_id=user_id)
     await query.edit_message_text(
         f"Создание голосования для группы {get_group_name(group)}\n\n"
         "Введите длительность голосования в минутах (по умолчанию 10):"
     )
 
-async def handle_poll_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_poll_duration(update: Update, context: ContextTypes.DEFAULT_TYPE, state_data: dict):
     """Обработка ввода длительности голосования"""
-    group = context.user_data.get("poll_group")
-    curator_id = context.user_data.get("poll_curator")
-    if not group or not curator_id:
-        return False
+    group = state_data["group"]
+    curator_id = state_data["curator_id"]
     
     duration_text = (update.message.text or "").strip()
     try:
         duration = int(duration_text) if duration_text else 10
         if duration < 1 or duration > 60:
             await update.message.reply_text("Длительность должна быть от 1 до 60 минут. Попробуйте снова:")
-            return True
+            return
     except ValueError:
         await update.message.reply_text("Введите число минут (1-60) или отправьте пустое сообщение для 10 минут:")
-        return True
+        return
     
-    # Удаляем старые голосования группы перед созданием нового
-    old_polls = db.get_group_polls(group, limit=100)  # Получаем все голосования
-    for old_poll_id, old_poll in old_polls:
-        if old_poll_id in db.polls:
-            del db.polls[old_poll_id]
-    db.save_polls()
+    # Прошлые голосования группы уходят в архив — история посещаемости сохраняется
+    for old_poll_id in await db.archive_group_polls(group):
+        scheduler.cancel(f"close_poll:{old_poll_id}")
     
-    # Создаем голосование
+    # Создаем голосование и сразу планируем его закрытие
     poll_id = db.create_poll(group, curator_id, duration)
+    scheduler.schedule("close_poll", duration * 60, {"poll_id": poll_id}, job_id=f"close_poll:{poll_id}")
     
     # Уведомляем студентов
     users = db.get_group_users(group)
@@ -1563,21 +1570,12 @@ async def handle_poll_duration(update: Update, context: ContextTypes.DEFAULT_TYP
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    sent_count = 0
-    for user_id in users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=poll_text, reply_markup=reply_markup, parse_mode='Markdown')
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Не удалось отправить голосование пользователю {user_id}: {e}")
-    
-    # Планируем закрытие голосования
-    if context.job_queue:
-        context.job_queue.run_once(close_poll_job, when=duration*60, data={"poll_id": poll_id})
+    broadcast_id = outbox.enqueue(group, users, "text", poll_text, parse_mode='Markdown', reply_markup=reply_markup.to_dict())
+    status = await update.message.reply_text(f"📤 Отправка голосования: 0/{len(users)}")
+    sent_count = await outbox.deliver(broadcast_id, progress_reporter(status, "📤 Отправка голосования"))
     
     # Очищаем состояние
-    context.user_data.pop("poll_group", None)
-    context.user_data.pop("poll_curator", None)
+    clear_conversation_state(context)
     
     await update.message.reply_text(
         f"✅ Голосование создано!\n\n"
@@ -1585,18 +1583,22 @@ async def handle_poll_duration(update: Update, context: ContextTypes.DEFAULT_TYP
         f"⏰ Длительность: {duration} минут\n"
         f"🆔 ID голосования: {poll_id}"
     )
-    return True
 
-async def close_poll_job(context: ContextTypes.DEFAULT_TYPE):
+async def close_poll_job(bot, data: dict):
     """Автоматическое закрытие голосования"""
     try:
-        poll_id = context.job.data.get("poll_id")
+        poll_id = data.get("poll_id")
         if poll_id:
             db.close_poll(poll_id)
             logger.info(f"Голосование {poll_id} автоматически закрыто")
     except Exception as e:
         logger.error(f"Ошибка при закрытии голосования: {e}")
 
+async def remind_question_job(bot, data: dict):
+    """Задачи "remind_question" прежних версий, уже сохранённые в очереди планировщика.
+    Напоминание теперь отправляет обход remind_pending_questions, поэтому задача просто снимается"""
+    logger.info(f"Напоминание о вопросе #{data.get('question_id')} ({data.get('group')}) отправит общий обход")
+
 async def poll_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ответа студента в голосовании"""
     query = update.callback_query
@@ -1636,46 +1638,47 @@ async def poll_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if status == "present":
-        # Просто отмечаем присутствие
-        db.add_poll_response(poll_id, user_id, "present")
+        # Голос учитывается в памяти сразу, на диск уходит пачкой
+        if not db.record_vote(poll_id, user_id, "present"):
+            await query.edit_message_text("🗳 Ваш ответ уже учтён")
+            return
         await query.edit_message_text("✅ Отмечено: Я на месте")
     else:
         # Запрашиваем причину отсутствия
-        context.user_data["poll_absent_id"] = poll_id
-        context.user_data["poll_absent_user"] = user_id
+        set_state(context.user_data, ABSENCE_REASON, CONVERSATION_TTL, poll_id=poll_id, user_id=user_id)
         await query.edit_message_text("Укажите причину отсутствия:")
 
-async def handle_absence_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_absence_reason(update: Update, context: ContextTypes.DEFAULT_TYPE, state_data: dict):
     """Обработка причины отсутствия"""
-    poll_id = context.user_data.get("poll_absent_id")
-    user_id = context.user_data.get("poll_absent_user")
-    if not poll_id or not user_id:
-        return False
+    poll_id = state_data["poll_id"]
+    user_id = state_data["user_id"]
     
     reason = (update.message.text or "").strip()
     if not reason:
         await update.message.reply_text("Пожалуйста, укажите причину отсутствия:")
-        return True
+        return
     
-    db.add_poll_response(poll_id, user_id, "absent", reason)
-    context.user_data.pop("poll_absent_id", None)
-    context.user_data.pop("poll_absent_user", None)
+    recorded = db.record_vote(poll_id, user_id, "absent", reason)
+    clear_conversation_state(context)
     
+    if not recorded:
+        # Голосование могли закрыть новым или удалить, пока студент писал причину
+        if db.has_voted(poll_id, user_id):
+            await update.message.reply_text("🗳 Ваш ответ уже учтён")
+        else:
+            await update.message.reply_text("❌ Голосование закрыто или больше недоступно, ответ не учтён")
+        return
     await update.message.reply_text(f"✅ Отмечено отсутствие\nПричина: {reason}")
-    return True
 
-async def handle_full_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_full_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state_data: dict):
     """Обработка ввода ФИО студента"""
-    if not context.user_data.get('waiting_for_full_name'):
-        return False
-    
     full_name = (update.message.text or '').strip()
     if not full_name:
         await update.message.reply_text("Пожалуйста, укажите ваше ФИО (например: Иванов Иван Иванович):")
-        return True
+        return
     
-    group = context.user_data.get('full_name_group')
-    username = context.user_data.get('registration_username', 'Unknown')
+    group = state_data.get('group')
+    username = state_data.get('username', 'Unknown')
     user_id = update.effective_user.id
     
     if group:
@@ -1683,17 +1686,13 @@ async def handle_full_name_input(update: Update, context: ContextTypes.DEFAULT_T
         db.add_user(user_id, username, group)
         
         # Обновляем ФИО пользователя
-        if str(user_id) in db.users:
-            db.users[str(user_id)]['full_name'] = full_name
-            db.save_users()
+        db.set_user_full_name(user_id, full_name)
         
         # Добавляем студента в список группы
         db.add_student(group, user_id, username, full_name)
         
         # Очищаем состояние
-        context.user_data.pop('waiting_for_full_name', None)
-        context.user_data.pop('full_name_group', None)
-        context.user_data.pop('registration_username', None)
+        clear_conversation_state(context)
         
         await update.message.reply_text(
             f"🎉 **Круто! Теперь ты часть цивилизации!** 🎉\n\n"
@@ -1707,8 +1706,6 @@ async def handle_full_name_input(update: Update, context: ContextTypes.DEFAULT_T
             f"**Выбери действие в меню ниже:** ⬇️"
         )
         await show_main_menu(update, context, group)
-    
-    return True
 
 async def student_polls_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню голосований для студентов"""
@@ -1830,10 +1827,11 @@ async def poll_view_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     duration = poll.get("duration_minutes", 0)
     responses = poll.get("responses", {})
     
-    # Статистика
-    present_count = sum(1 for r in responses.values() if r.get("status") == "present")
-    absent_count = sum(1 for r in responses.values() if r.get("status") == "absent")
-    total_responses = len(responses)
+    # Статистика (счётчики ведутся при записи ответов)
+    tally = db.get_poll_tally(poll_id)
+    present_count = tally["present"]
+    absent_count = tally["absent"]
+    total_responses = tally["total"]
     
     # Получаем список студентов группы для сравнения
     students = db.get_group_students_data(group)
@@ -1860,20 +1858,9 @@ async def poll_view_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user_info = db.users.get(user_id_str, {})
                 username = user_info.get("username", f"ID{user_id_int}")
                 
-                # Ищем ФИО студента в списке группы
-                full_name = ""
-                students = db.get_group_students_data(group)
-                for student in students:
-                    if student.get("username") == username:
-                        full_name = student.get("full_name", "")
-                        break
-                
-                # Если не нашли по username, пробуем найти по user_id
-                if not full_name:
-                    for student in students:
-                        if str(student.get("user_id", "")) == user_id_str:
-                            full_name = student.get("full_name", "")
-                            break
+                # Ищем ФИО студента в списке группы по индексу (id аккаунта, затем username)
+                student = db.find_student(group, user_id_str, username)
+                full_name = student.get("full_name", "") if student else ""
                 
                 # Формируем отображаемое имя
                 display_name = full_name if full_name else f"@{username}"
@@ -1904,6 +1891,128 @@ async def poll_view_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+async def polls_attendance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка посещаемости группы по всем голосованиям (включая архив)"""
+    query = update.callback_query
+    await query.answer()
+    group = query.data.replace("polls_attendance_", "")
+    user_id = query.from_user.id
+    if not db.is_curator(user_id, group):
+        await query.edit_message_text("❌ У вас нет прав для этой группы")
+        return
+    
+    # Архив разжимается и матрица строится в рабочем потоке — по копиям данных группы
+    snapshot = db.attendance_snapshot(group)
+    summary = await asyncio.to_thread(lambda: build_attendance(db, group, snapshot=snapshot).summary())
+    keyboard = [[InlineKeyboardButton("🔙 К голосованиям", callback_data=f"polls_menu_{group}")]]
+    reply_markup = with_home_button(keyboard, group)
+    if not summary["polls_count"]:
+        await query.edit_message_text(f"📈 Посещаемость группы {get_group_name(group)}\n\nПока нет голосований", reply_markup=reply_markup)
+        return
+    
+    text = f"📈 Посещаемость группы {get_group_name(group)}\n\n"
+    text += f"🗳 Занятий с голосованием: {summary['polls_count']}\n"
+    text += f"📊 Средняя посещаемость: {summary['overall_rate']:.0%}\n\n"
+    
+    text += "Студенты (от низкой посещаемости):\n"
+    students = sorted(summary["students"], key=lambda s: (s["rate"], -s["current_absence"]))
+    for student in students[:30]:
+        name = student["full_name"] or (f"@{student['username']}" if student["username"] else f"ID{student['user_id']}")
+        line = f"• {name}: {student['rate']:.0%} ({student['present']}/{summary['polls_count']})"
+        if student["current_absence"] >= 3:
+            line += f" ⚠️ пропускает {student['current_absence']} подряд"
+        elif student["longest_absence"] >= 3:
+            line += f", макс. пропусков подряд: {student['longest_absence']}"
+        text += line + "\n"
+    if len(students) > 30:
+        text += f"… и ещё {len(students) - 30}\n"
+    
+    text += "\nПоследние занятия:\n"
+    for poll in summary["polls"][-5:]:
+        try:
+            date_str = datetime.fromisoformat(poll["created_at"]).strftime("%d.%m %H:%M")
+        except ValueError:
+            date_str = poll["created_at"][:16]
+        text += f"• {date_str}: {poll['turnout']:.0%} ({poll['present']} из {summary['students_count']})\n"
+    
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def send_attendance_export(bot, chat_id: int, groups, title: str, since=None, until=None):
+    """Отправляет выгрузку посещаемости; файл строится в рабочем потоке, готовый переиспользуется по file_id"""
+    key = (tuple(groups), since, until, db.versions["polls"], db.versions["students"], db.versions["users"])
+    period = f"{since:%d.%m.%Y}–{(until - timedelta(days=1)):%d.%m.%Y}" if since and until else "весь период"
+    caption = f"📥 Посещаемость: {title}\nПериод: {period}"
+    file_id = export_cache.get(key)
+    if file_id:
+        await bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+        return
+    
+    # Голосования, студенты и пользователи копируются здесь, в цикле событий; архив читается уже в потоке
+    snapshots = {group: db.attendance_snapshot(group, since, until) for group in groups}
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(write_attendance_csv, path, db, groups, since, until, snapshots)
+        with open(path, "rb") as f:
+            message = await bot.send_document(chat_id=chat_id, document=f, caption=caption,
+                                              filename=f"attendance_{'_'.join(groups)}.csv")
+        export_cache.put(key, message.document.file_id)
+    finally:
+        os.remove(path)
+
+async def polls_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка посещаемости группы за весь период"""
+    query = update.callback_query
+    await query.answer()
+    group = query.data.replace("polls_export_", "")
+    user_id = query.from_user.id
+    if not db.is_curator(user_id, group):
+        await query.edit_message_text("❌ У вас нет прав для этой группы")
+        return
+    try:
+        await send_attendance_export(context.bot, user_id, [group], get_group_name(group))
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки посещаемости группы {group}: {e}")
+        await context.bot.send_message(chat_id=user_id, text="❌ Не удалось сформировать выгрузку")
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка посещаемости группы или факультета за период: /export ж1 01.09.2025 31.12.2025"""
+    user_id = update.effective_user.id
+    args = context.args if hasattr(context, 'args') else []
+    usage = "Использование: /export <группа или факультет> [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]\nНапример: /export ж1 01.09.2025 31.12.2025"
+    if not args:
+        await update.message.reply_text(usage)
+        return
+    target = args[0].lower()
+    if target in group_registry:
+        groups, title = [target], get_group_name(target)
+    elif target in faculty_registry:
+        groups = list(group_registry.of_faculty(target))
+        title = faculty_registry.get(target, {}).get("name", target)
+    else:
+        await update.message.reply_text("Неизвестная группа или факультет.\n" + usage)
+        return
+    if not groups or not all(db.is_curator(user_id, group) for group in groups):
+        await update.message.reply_text("❌ У вас нет прав для выгрузки по этим группам")
+        return
+    try:
+        since = datetime.strptime(args[1], "%d.%m.%Y") if len(args) > 1 else None
+        # Дата окончания включительно
+        until = datetime.strptime(args[2], "%d.%m.%Y") + timedelta(days=1) if len(args) > 2 else None
+    except ValueError:
+        await update.message.reply_text("Даты указываются в формате ДД.ММ.ГГГГ.\n" + usage)
+        return
+    if since and not until:
+        until = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    
+    status = await update.message.reply_text("⏳ Формируем выгрузку...")
+    try:
+        await send_attendance_export(context.bot, update.effective_chat.id, groups, title, since, until)
+        await status.delete()
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки посещаемости {target}: {e}")
+        await status.edit_text("❌ Не удалось сформировать выгрузку")
+
 async def poll_export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Экспорт результатов голосования в CSV"""
     query = update.callback_query
@@ -1935,19 +2044,14 @@ async def poll_export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
     students = db.get_group_students_data(group)
     responses = poll.get("responses", {})
     
-    # Создаем словарь ответов для быстрого поиска по user_id
-    responses_by_user_id = {}
-    for user_id_str, response in responses.items():
-        responses_by_user_id[user_id_str] = response
-    
     # Записываем данные
     for student in students:
         full_name = student.get("full_name", "")
         username = student.get("username", "")
         student_user_id = str(student.get("user_id", ""))
         
-        if student_user_id in responses_by_user_id:
-            response = responses_by_user_id[student_user_id]
+        if student_user_id in responses:
+            response = responses[student_user_id]
             status = "Присутствует" if response.get("status") == "present" else "Отсутствует"
             reason = response.get("reason", "")
             timestamp = response.get("timestamp", "")
@@ -2013,6 +2117,13 @@ async def admin_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("У вас нет прав администратора.")
         return
     
+    text, reply_markup = screen_cache.get(("admin_groups", None, "admin"),
+                                          (group_registry.version, faculty_registry.version),
+                                          render_admin_groups)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def render_admin_groups():
+    """Собирает экран управления группами"""
     groups = load_groups()
     faculties = load_faculties()
     
@@ -2028,9 +2139,7 @@ async def admin_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("➕ Добавить группу", callback_data="admin_add_group")],
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
     ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    return text, InlineKeyboardMarkup(keyboard)
 
 async def admin_change_student_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Смена группы студента"""
@@ -2136,25 +2245,8 @@ async def admin_change_group_confirm(update: Update, context: ContextTypes.DEFAU
     old_group_name = groups.get(old_group, {}).get("name", old_group)
     new_group_name = groups.get(new_group, {}).get("name", new_group)
     
-    # Обновляем группу студента
-    db.users[student_id]["group"] = new_group
-    db.save_users()
-    
-    # Обновляем в списке студентов
-    if old_group in db.students:
-        students = db.students[old_group]
-        for i, student in enumerate(students):
-            if str(student.get("user_id")) == student_id:
-                # Перемещаем студента в новую группу
-                student_copy = student.copy()
-                del students[i]
-                db.save_students()
-                
-                if new_group not in db.students:
-                    db.students[new_group] = []
-                db.students[new_group].append(student_copy)
-                db.save_students()
-                break
+    # Обновляем группу студента (и переносим его в списке студентов)
+    db.change_user_group(int(student_id), new_group)
     
     text = f"✅ **Группа студента изменена!**\n\n"
     full_name = student_data.get('full_name', '')
@@ -2214,7 +2306,14 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("У вас нет прав администратора.")
         return
     
-    # Собираем статистику
+    version = tuple(db.version(collection) for collection in ("users", "students", "messages", "questions", "polls"))
+    text, reply_markup = screen_cache.get(("admin_stats", None, "admin"),
+                                          (version, group_registry.version, faculty_registry.version),
+                                          render_admin_stats)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def render_admin_stats():
+    """Собирает экран общей статистики"""
     users = db.get_all_users()
     students = db.get_all_students()
     messages = db.get_all_messages()
@@ -2246,7 +2345,36 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
     ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def admin_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Производительность обработчиков: p50/p95/p99 с момента запуска"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        await query.edit_message_text("У вас нет прав администратора.")
+        return
+    
+    rows = metrics.summary()
+    totals = metrics.totals()
+    text = "⏱ **Производительность** (с момента запуска, мс)\n\n"
+    if rows:
+        lines = [f"{'обработчик':<24} {'вызовов':>7} {'p50':>6} {'p95':>6} {'p99':>6} {'ошибок':>6}"]
+        for row in rows:
+            lines.append(f"{row['handler'][:24]:<24} {row['count']:>7} {row['p50']:>6.0f} {row['p95']:>6.0f} "
+                         f"{row['p99']:>6.0f} {row['errors']:>6}")
+        text += "```\n" + "\n".join(lines) + "\n```\n"
+    else:
+        text += "Пока нет данных.\n\n"
+    text += f"📡 **Bot API:** {totals['api_calls']} вызовов, {totals['api_seconds']:.1f} с\n"
+    text += f"💾 **Диск:** {totals['disk_writes']} записей, {totals['disk_bytes'] / 1024:.0f} КБ\n"
+    text += f"🐢 **Цикл событий:** задержка p99 {totals['loop_lag_p99']:.0f} мс, блокировок: {totals['stalls']}"
     
+    keyboard = [
+        [InlineKeyboardButton("🔄 Обновить", callback_data="admin_metrics")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
@@ -2457,24 +2585,58 @@ async def admin_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Показываем выбор группы для админа
     await show_group_selection(update, context)
 
+# Обработчики текста для состояний ожидания ввода; без состояния (и для INPUT) — handle_message
+TEXT_HANDLERS = {
+    FULL_NAME: handle_full_name_input,
+    EDIT_STUDENT: handle_edit_student_text,
+    IMPORT_STUDENTS: handle_import_students_text,
+    POLL_DURATION: handle_poll_duration,
+    ABSENCE_REASON: handle_absence_reason,
+}
+
 async def text_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Маршрутизирует текст: ФИО -> редактирование студентов -> импорт студентов -> голосования -> прочее"""
-    handled = await handle_full_name_input(update, context)
-    if handled:
-        return
-    handled = await handle_edit_student_text(update, context)
-    if handled:
-        return
-    handled = await handle_import_students_text(update, context)
-    if handled:
-        return
-    handled = await handle_poll_duration(update, context)
-    if handled:
-        return
-    handled = await handle_absence_reason(update, context)
-    if handled:
-        return
-    await handle_message(update, context)
+    """Маршрутизирует текст по текущему состоянию пользователя (один поиск в таблице)"""
+    state, state_data = get_state(context.user_data)
+    if state == EXPIRED:
+        await update.message.reply_text("⌛ Время ожидания ввода истекло. Начните действие заново через меню.")
+        return
+    handler = TEXT_HANDLERS.get(state)
+    if handler is None:
+        await handle_message(update, context)
+        return
+    await handler(update, context, state_data)
+
+def schedule_missing_poll_closes():
+    """Планирует закрытие активных голосований, созданных до появления постоянного планировщика"""
+    now = datetime.now()
+    for poll_id, poll in db.polls.items():
+        if poll.get("status") != "active" or scheduler.has_job(f"close_poll:{poll_id}"):
+            continue
+        try:
+            closes_at = datetime.fromisoformat(poll["created_at"]) + timedelta(minutes=poll.get("duration_minutes", 10))
+        except (KeyError, ValueError):
+            closes_at = now
+        scheduler.schedule("close_poll", max(0, (closes_at - now).total_seconds()), {"poll_id": poll_id}, job_id=f"close_poll:{poll_id}")
+
+async def on_startup(application: Application):
+    """Запускает фоновую пакетную запись базы, доставку очереди рассылок и сторожа цикла событий"""
+    loop_watchdog.start()
+    db.start_write_behind(FLUSH_INTERVAL, FLUSH_MAX_DIRTY)
+    pending = outbox.pending_ids()
+    if pending:
+        logger.info(f"Незавершённых рассылок в очереди: {len(pending)}")
+    outbox.start(broadcaster, lambda record: make_outbox_sender(application.bot, record))
+    scheduler.register("close_poll", close_poll_job)
+    scheduler.register("remind_question", remind_question_job)
+    schedule_missing_poll_closes()
+    scheduler.start(application.bot)
+
+async def on_shutdown(application: Application):
+    """Останавливает доставку рассылок и записывает накопленные изменения"""
+    await scheduler.stop()
+    await outbox.stop()
+    await db.stop_write_behind()
+    await loop_watchdog.stop()
 
 def main():
     """Запуск бота"""
@@ -2483,12 +2645,18 @@ def main():
     application = (
         Application.builder()
         .token(BOT_TOKEN)
-        .read_timeout(30)
-        .write_timeout(30)
-        .connect_timeout(30)
-        .pool_timeout(30)
-        .build()
+        # Запросы к Bot API учитываются в замерах по методам
+        .request(MeteredRequest(metrics, connection_pool_size=256, read_timeout=30, write_timeout=30,
+                                connect_timeout=30, pool_timeout=30))
+        # Разные пользователи обслуживаются параллельно, обновления одного — по порядку
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if BOT_MODE == "webhook":
+        # Обновления принимает наш ASGI-сервер, Updater для polling не нужен
+        application = application.updater(None)
+    application = application.build()
     
     # Keepalive для Render free (не даём сервису заснуть)
     async def keepalive_job(context: ContextTypes.DEFAULT_TYPE):
@@ -2506,6 +2674,15 @@ def main():
     # Глобальный обработчик ошибок
     application.add_error_handler(on_error)
     
+    # Состояние диалога: восстанавливается до обработчиков при первом обновлении после перезапуска,
+    # сохраняется после них (на диск — пачкой вместе с базой)
+    conversations = ConversationStore(db.conversations)
+    expired = conversations.prune()
+    if expired:
+        logger.info(f"Удалено истёкших состояний диалога: {expired}")
+    application.add_handler(TypeHandler(Update, conversations.restore_handler), group=-1)
+    application.add_handler(TypeHandler(Update, conversations.save_handler), group=1)
+    
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin))
@@ -2516,86 +2693,110 @@ def main():
     application.add_handler(CommandHandler("resume", resume))
     application.add_handler(CommandHandler("import_students", import_students_cmd))
     application.add_handler(CommandHandler("students", students_cmd))
-    
-    # Добавляем обработчики callback'ов
-    application.add_handler(CallbackQueryHandler(handle_group_selection, pattern="^join_"))
-    application.add_handler(CallbackQueryHandler(handle_schedule, pattern="^schedule_"))
-    application.add_handler(CallbackQueryHandler(handle_announcement, pattern="^announce_"))
-    application.add_handler(CallbackQueryHandler(show_stats, pattern="^stats_"))
-    application.add_handler(CallbackQueryHandler(change_group, pattern="^change_group$"))
-    application.add_handler(CallbackQueryHandler(back_to_menu, pattern="^back_to_menu_"))
-    application.add_handler(CallbackQueryHandler(handle_webapp, pattern="^webapp_"))
-    application.add_handler(CallbackQueryHandler(view_schedule, pattern="^view_schedule_"))
-    application.add_handler(CallbackQueryHandler(view_announcements, pattern="^view_announce_"))
-    application.add_handler(CallbackQueryHandler(ask_question, pattern="^ask_question_"))
-    application.add_handler(CallbackQueryHandler(view_questions, pattern="^view_questions_"))
-    application.add_handler(CallbackQueryHandler(answer_question_menu, pattern="^answer_question_"))
-    application.add_handler(CallbackQueryHandler(select_question_for_answer, pattern="^select_question_"))
-    application.add_handler(CallbackQueryHandler(cancel_question, pattern="^cancel_question_"))
-    application.add_handler(CallbackQueryHandler(cancel_answer, pattern="^cancel_answer_"))
-    application.add_handler(CallbackQueryHandler(today_schedule, pattern="^today_schedule_"))
-    application.add_handler(CallbackQueryHandler(students_menu, pattern="^students_menu_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(students_import_start, pattern="^students_import_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(students_list, pattern="^students_list_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(students_delete_menu, pattern="^students_delete_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(students_delete_confirm, pattern="^students_delete_pick_"))
-    application.add_handler(CallbackQueryHandler(students_delete_do, pattern="^students_delete_do_"))
-    application.add_handler(CallbackQueryHandler(students_edit_menu, pattern="^students_edit_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(students_edit_ask, pattern="^students_edit_pick_"))
+    application.add_handler(CommandHandler("export", export_cmd))
+    
+    # Добавляем обработчики callback'ов: один CallbackQueryHandler, маршрут по префиксному дереву
+    callback_router = CallbackRouter()
+    callback_router.add("join", handle_group_selection)
+    callback_router.add("schedule", handle_schedule)
+    callback_router.add("announce", handle_announcement)
+    callback_router.add("stats", show_stats)
+    callback_router.add("change_group", change_group, nargs=0)
+    callback_router.add("back_to_menu", back_to_menu)
+    callback_router.add("webapp", handle_webapp)
+    callback_router.add("view_schedule", view_schedule)
+    callback_router.add("view_announce", view_announcements)
+    callback_router.add("ask_question", ask_question)
+    callback_router.add("view_questions", view_questions)
+    callback_router.add("answer_question", answer_question_menu)
+    callback_router.add("select_question", select_question_for_answer)
+    callback_router.add("cancel_question", cancel_question)
+    callback_router.add("cancel_answer", cancel_answer)
+    callback_router.add("today_schedule", today_schedule)
+    callback_router.add("students_menu", students_menu, nargs=1)
+    callback_router.add("students_import", students_import_start, nargs=1)
+    callback_router.add("students_list", students_list, nargs=1)
+    callback_router.add("students_delete", students_delete_menu, nargs=1)
+    callback_router.add("students_delete_pick", students_delete_confirm)
+    callback_router.add("students_delete_do", students_delete_do)
+    callback_router.add("students_edit", students_edit_menu, nargs=1)
+    callback_router.add("students_edit_pick", students_edit_ask)
     
     # Polls handlers
-    application.add_handler(CallbackQueryHandler(polls_menu, pattern="^polls_menu_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(polls_create_start, pattern="^polls_create_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(polls_results_menu, pattern="^polls_results_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(poll_view_details, pattern="^poll_view_"))
-    application.add_handler(CallbackQueryHandler(poll_export_csv, pattern="^poll_export_"))
-    application.add_handler(CallbackQueryHandler(student_polls_menu, pattern="^student_polls_[^_]+$"))
-    application.add_handler(CallbackQueryHandler(poll_response, pattern="^poll_(present|absent)_"))
+    callback_router.add("polls_menu", polls_menu, nargs=1)
+    callback_router.add("polls_create", polls_create_start, nargs=1)
+    callback_router.add("polls_results", polls_results_menu, nargs=1)
+    callback_router.add("polls_attendance", polls_attendance, nargs=1)
+    callback_router.add("polls_export", polls_export, nargs=1)
+    callback_router.add("poll_view", poll_view_details)
+    callback_router.add("poll_export", poll_export_csv)
+    callback_router.add("student_polls", student_polls_menu, nargs=1)
+    callback_router.add("poll_present", poll_response)
+    callback_router.add("poll_absent", poll_response)
     
     # Admin handlers
-    application.add_handler(CallbackQueryHandler(show_admin_panel, pattern="^admin_panel$"))
-    application.add_handler(CallbackQueryHandler(admin_faculties, pattern="^admin_faculties$"))
-    application.add_handler(CallbackQueryHandler(admin_groups, pattern="^admin_groups$"))
-    application.add_handler(CallbackQueryHandler(admin_curators, pattern="^admin_curators$"))
-    application.add_handler(CallbackQueryHandler(admin_change_student_group, pattern="^admin_change_student_group$"))
-    application.add_handler(CallbackQueryHandler(admin_change_group_select, pattern="^admin_change_group_select_"))
-    application.add_handler(CallbackQueryHandler(admin_change_group_confirm, pattern="^admin_change_group_confirm_"))
-    application.add_handler(CallbackQueryHandler(admin_stats, pattern="^admin_stats$"))
-    application.add_handler(CallbackQueryHandler(admin_users, pattern="^admin_users$"))
-    application.add_handler(CallbackQueryHandler(admin_questions, pattern="^admin_questions$"))
-    application.add_handler(CallbackQueryHandler(admin_messages, pattern="^admin_messages$"))
-    application.add_handler(CallbackQueryHandler(admin_clear_announcements, pattern="^admin_clear_announcements$"))
-    application.add_handler(CallbackQueryHandler(admin_clear_all_announcements, pattern="^admin_clear_all_announcements$"))
-    application.add_handler(CallbackQueryHandler(admin_clear_announcements_by_group, pattern="^admin_clear_announcements_by_group$"))
-    application.add_handler(CallbackQueryHandler(admin_clear_group_announcements, pattern="^admin_clear_group_"))
-    application.add_handler(CallbackQueryHandler(admin_main_menu, pattern="^admin_main_menu$"))
+    callback_router.add("admin_panel", show_admin_panel, nargs=0)
+    callback_router.add("admin_faculties", admin_faculties, nargs=0)
+    callback_router.add("admin_groups", admin_groups, nargs=0)
+    callback_router.add("admin_curators", admin_curators, nargs=0)
+    callback_router.add("admin_change_student_group", admin_change_student_group, nargs=0)
+    callback_router.add("admin_change_group_select", admin_change_group_select)
+    callback_router.add("admin_change_group_confirm", admin_change_group_confirm)
+    callback_router.add("admin_stats", admin_stats, nargs=0)
+    callback_router.add("admin_metrics", admin_metrics, nargs=0)
+    callback_router.add("admin_users", admin_users, nargs=0)
+    callback_router.add("admin_questions", admin_questions, nargs=0)
+    callback_router.add("admin_messages", admin_messages, nargs=0)
+    callback_router.add("admin_clear_announcements", admin_clear_announcements, nargs=0)
+    callback_router.add("admin_clear_all_announcements", admin_clear_all_announcements, nargs=0)
+    callback_router.add("admin_clear_announcements_by_group", admin_clear_announcements_by_group, nargs=0)
+    callback_router.add("admin_clear_group", admin_clear_group_announcements)
+    callback_router.add("admin_main_menu", admin_main_menu, nargs=0)
+    application.add_handler(CallbackQueryHandler(callback_router.dispatch))
     
     application.add_handler(MessageHandler((filters.PHOTO | filters.Document.ALL) & ~filters.COMMAND, handle_message))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_router))
     
+    # Замеры: каждый обработчик (кнопки — по своему маршруту, а не общий dispatch) и записи на диск
+    callback_router.wrap_handlers(metrics.instrument)
+    metrics.instrument_application(application, skip=[callback_router.dispatch])
+    db.meter_writes(metrics.observe_disk_write)
+    
     # Запускаем бота
     print("Бот запущен! Нажмите Ctrl+C для остановки.")
-    # Планируем keepalive пинги каждые 10 минут
+    # Планируем keepalive пинги каждые 10 минут и обход неотвеченных вопросов
     if application.job_queue:
         application.job_queue.run_repeating(keepalive_job, interval=600, first=30)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+        application.job_queue.run_repeating(remind_pending_questions, interval=QUESTION_REMINDER_SWEEP, first=60)
+    if BOT_MODE == "webhook":
+        # Обновления, проверка живости и служебные маршруты — один сервер в одном цикле событий
+        from webserver import create_web_app, run_webhook, metrics_route
+        web_app = create_web_app(application, WEBHOOK_PATH, WEBHOOK_SECRET, extra_routes=[metrics_route(metrics)])
+        url = WEBHOOK_URL if WEBHOOK_URL.startswith('http') else f"https://{WEBHOOK_URL}"
+        asyncio.run(run_webhook(application, web_app, url.rstrip('/') + WEBHOOK_PATH, PORT, WEBHOOK_SECRET,
+                                allowed_updates=Update.ALL_TYPES))
+    else:
+        start_health_server(PORT)
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    db.close()
 
-if __name__ == '__main__':
-    # Для Render Web Service - открываем порт
-    import os
-    port = int(os.environ.get('PORT', 8080))
-    
-    # Запускаем бота в фоне
-    import asyncio
+def start_health_server(port: int):
+    """Для Render Web Service в режиме polling: порт с ответом "Bot is running" и /metrics в отдельном потоке"""
     import threading
     from http.server import HTTPServer, BaseHTTPRequestHandler
     
     class Handler(BaseHTTPRequestHandler):
         def do_GET(self):
+            if self.path == '/metrics':
+                body = metrics.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                body = b'Bot is running'
+                content_type = 'text/plain'
             self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
+            self.send_header('Content-type', content_type)
             self.end_headers()
-            self.wfile.write(b'Bot is running')
+            self.wfile.write(body)
         
         def log_message(self, format, *args):
             pass  # Отключаем логи HTTP сервера
@@ -2607,6 +2808,6 @@ if __name__ == '__main__':
     
     server_thread = threading.Thread(target=run_server, daemon=True)
     server_thread.start()
-    
-    # Запускаем бота
+
+if __name__ == '__main__':
     main()
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Отправка одному получателю и колбэк прогресса (отправлено всего, успешно, из скольких)
+SendFunc = Callable[[int], Awaitable[object]]
+ProgressFunc = Callable[[int, int, int], Awaitable[None]]
+
+
+class TokenBucket:
+    """Глобальный ограничитель частоты: rate отправок в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу на время (после RetryAfter от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastEngine:
+    """Рассылка множеству получателей с учётом лимитов Telegram.
+
+    Одновременно выполняется не больше concurrency отправок, общий поток
+    ограничен корзиной токенов (около 30 сообщений в секунду на бота),
+    а сообщения в один чат идут не чаще раза в per_chat_interval секунд.
+    На RetryAfter вся рассылка ставится на паузу и отправка повторяется;
+    сетевые ошибки повторяются, ошибки получателя (бот заблокирован,
+    чат не найден) — нет. Один движок общий для всех рассылок бота.
+    """
+
+    def __init__(self, rate: float = 30.0, concurrency: int = 8, per_chat_interval: float = 1.0, max_retries: int = 3):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self._chat_ready: Dict[int, float] = {}
+
+    async def _wait_chat(self, chat_id: int) -> None:
+        now = time.monotonic()
+        ready = self._chat_ready.get(chat_id, 0.0)
+        self._chat_ready[chat_id] = max(now, ready) + self.per_chat_interval
+        if ready > now:
+            await asyncio.sleep(ready - now)
+        if len(self._chat_ready) > 10000:
+            self._chat_ready = {chat: t for chat, t in self._chat_ready.items() if t > now}
+
+    async def send_one(self, chat_id: int, send: SendFunc) -> bool:
+        """Отправляет одному получателю с повторами. Возвращает успех"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+                return True
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                logger.warning(f"Лимит Telegram при рассылке, пауза {delay} с")
+                self.bucket.pause(delay)
+            except (Forbidden, BadRequest) as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                return False
+            except NetworkError as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                    return False
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                return False
+        logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: превышено число повторов")
+        return False
+
+    async def broadcast(self, chat_ids: Iterable[int], send: SendFunc,
+                        progress: Optional[ProgressFunc] = None,
+                        on_result: Optional[Callable[[int, bool], None]] = None) -> int:
+        """Рассылает всем получателям. Возвращает число успешных отправок.
+
+        on_result(chat_id, ok) вызывается сразу после окончательного результата по получателю.
+        """
+        queue = list(dict.fromkeys(chat_ids))
+        total = len(queue)
+        state = {"done": 0, "sent": 0}
+        position = iter(queue)
+
+        async def worker():
+            for chat_id in position:
+                ok = await self.send_one(chat_id, send)
+                if ok:
+                    state["sent"] += 1
+                if on_result:
+                    on_result(chat_id, ok)
+                state["done"] += 1
+                if progress:
+                    try:
+                        await progress(state["done"], state["sent"], total)
+                    except Exception as e:
+                        logger.error(f"Ошибка отображения прогресса рассылки: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, total))))
+        return state["sent"]
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления одного пользователя (состояние диалога в context.user_data)
+    обрабатываются строго по очереди, разных пользователей — одновременно,
+    не больше concurrency обработчиков сразу. Ожидающие своей очереди
+    обновления не занимают слоты обработчиков: медленная рассылка или
+    выгрузка у одного пользователя не задерживает остальных.
+
+    max_pending — сколько обновлений может быть принято в работу всего
+    (включая ждущие очереди своего пользователя).
+    """
+
+    def __init__(self, concurrency: int, max_pending: Optional[int] = None):
+        super().__init__(max_pending or concurrency * 16)
+        self.concurrency = concurrency
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._queued: Dict[int, int] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._queued[key] = self._queued.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            # Блокировка нужна, пока у пользователя есть обновления в работе
+            self._queued[key] -= 1
+            if not self._queued[key]:
+                del self._queued[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
+        self._queued.clear()
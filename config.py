@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +17,50 @@ FACULTIES_FILE = "faculties.json"
 GROUPS_FILE = "groups.json"
 CURATORS_FILE = "curators.json"
 
+# Режим хранения данных бота:
+# "journal" - изменения дописываются в журнал, снимки JSON уплотняются в фоне
+# "json" - каждое изменение перезаписывает файл коллекции целиком
+# "sqlite" - построчные записи в базу SQLite (umc.sqlite3), общую для бота и веб-приложения
+STORAGE_MODE = os.getenv('STORAGE_MODE', "journal")
+# Размер журнала, после которого он уплотняется в снимки
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', 1024 * 1024))
+# Отложенная запись: изменения копятся в памяти и пишутся пачкой раз в FLUSH_INTERVAL секунд
+# или сразу, когда накопилось FLUSH_MAX_DIRTY изменений
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', 2.0))
+FLUSH_MAX_DIRTY = int(os.getenv('FLUSH_MAX_DIRTY', 200))
+# Голоса записываются на диск не позже чем через VOTE_FLUSH_DELAY секунд (одной пачкой на всю волну голосов)
+VOTE_FLUSH_DELAY = float(os.getenv('VOTE_FLUSH_DELAY', 0.3))
+
+# Рассылки: сообщений в секунду на весь бот (лимит Telegram около 30) и число одновременных отправок
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 30))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+# Каталог очереди рассылок (переживает перезапуски бота)
+OUTBOX_DIR = os.getenv('OUTBOX_DIR', "outbox")
+# Файл отложенных задач (закрытие голосований, напоминания о вопросах)
+SCHEDULER_FILE = os.getenv('SCHEDULER_FILE', "scheduled_jobs.json")
+# Размер сегмента архива голосований (archive/<группа>/NNNN.jsonl.gz), после которого начинается новый
+ARCHIVE_SEGMENT_BYTES = int(os.getenv('ARCHIVE_SEGMENT_BYTES', 256 * 1024))
+# Напоминания кураторам о неотвеченных вопросах: пороги возраста вопроса (часы) и интервал обхода (секунды)
+QUESTION_REMINDER_HOURS = (2, 6, 24)
+QUESTION_REMINDER_SWEEP = int(os.getenv('QUESTION_REMINDER_SWEEP', 600))
+
+# Сколько секунд бот ждёт ввода в начатом действии (объявление, ответ, импорт...) и ФИО при регистрации
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', 1800))
+REGISTRATION_TTL = int(os.getenv('REGISTRATION_TTL', 24 * 3600))
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя — всегда по очереди)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 32))
+# Режим получения обновлений: "webhook" — Telegram присылает обновления на WEBHOOK_URL
+# (тот же порт и цикл событий, что и проверка живости); "polling" — long polling для локальной разработки
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL', "")
+BOT_MODE = os.getenv('BOT_MODE') or ("webhook" if WEBHOOK_URL else "polling")
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', "/telegram")
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена бота
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+PORT = int(os.getenv('PORT', 8080))
+# Сторож цикла событий: как часто проверять задержку и с какой задержки (сек) записывать стек блокирующего кода
+LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', 0.1))
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.25))
+
 # Инициализация базовых данных
 def init_default_data():
     """Инициализирует базовые данные если файлы не существуют"""
@@ -55,41 +101,152 @@ def init_default_data():
 # Инициализируем данные при импорте
 init_default_data()
 
+# Реестры конфигурации: файлы читаются один раз и перечитываются только при изменении
+class JsonRegistry:
+    """Кэш JSON-файла конфигурации с производными таблицами поиска.
+
+    Файл перечитывается, только если изменилось его время модификации
+    (проверяется не чаще раза в check_interval секунд), а после save()
+    кэш обновляется сразу. Подклассы строят свои таблицы в build().
+    Возвращаемые данные общие для всех — изменять их можно только через save().
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._data = {}
+        self._version = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = 0
+        if mtime != self._mtime:
+            data = {}
+            if mtime:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            self.update(data, mtime)
+
+    def update(self, data, mtime=None):
+        """Заменяет данные и перестраивает производные таблицы"""
+        self._data = data
+        self._version += 1
+        self.build(data)
+        if mtime is not None:
+            self._mtime = mtime
+
+    def build(self, data):
+        pass
+
+    def save(self, data):
+        """Сохраняет данные в файл и сразу обновляет кэш"""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        self.update(data, os.stat(self.path).st_mtime_ns)
+
+    @property
+    def data(self):
+        self._refresh()
+        return self._data
+
+    @property
+    def version(self) -> int:
+        """Номер версии данных: растёт при каждом перечитывании и сохранении (ключ кэшей)"""
+        self._refresh()
+        return self._version
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.data
+
+
+class GroupRegistry(JsonRegistry):
+    """Группы: id → название и факультет → список групп"""
+
+    def build(self, groups):
+        self.names = {group_id: group.get("name", group_id) for group_id, group in groups.items()}
+        self.by_faculty = {}
+        for group_id, group in groups.items():
+            self.by_faculty.setdefault(group.get("faculty"), []).append(group_id)
+
+    def name(self, group_id: str) -> str:
+        self._refresh()
+        return self.names.get(group_id, group_id)
+
+    def of_faculty(self, faculty_id: str):
+        """Группы факультета {id: данные}"""
+        groups = self.data
+        return {group_id: groups[group_id] for group_id in self.by_faculty.get(faculty_id, ())}
+
+
+class CuratorRegistry(JsonRegistry):
+    """Права кураторов: группа → кураторы и пользователь → группы; все проверки — поиск в словаре"""
+
+    def build(self, curators):
+        by_group, by_user, pairs = {}, {}, set()
+        for group, curator_ids in curators.items():
+            ids = tuple(int(curator_id) for curator_id in curator_ids)
+            by_group[group] = ids
+            for curator_id in ids:
+                by_user.setdefault(curator_id, []).append(group)
+                pairs.add((curator_id, group))
+        self.by_group, self.by_user, self._pairs = by_group, by_user, pairs
+
+    def is_curator(self, user_id: int, group: str) -> bool:
+        self._refresh()
+        return (int(user_id), group) in self._pairs
+
+    def groups_of(self, user_id: int):
+        """Группы, которые курирует пользователь"""
+        self._refresh()
+        return list(self.by_user.get(int(user_id), ()))
+
+    def curators_of(self, group: str):
+        """Кураторы группы"""
+        self._refresh()
+        return list(self.by_group.get(group, ()))
+
+    def all(self):
+        """Копия всех назначений {группа: [id кураторов]}"""
+        self._refresh()
+        return {group: list(ids) for group, ids in self.by_group.items()}
+
+
+faculty_registry = JsonRegistry(FACULTIES_FILE)
+group_registry = GroupRegistry(GROUPS_FILE)
+curator_registry = CuratorRegistry(CURATORS_FILE)
+
 # Функции для работы с данными
 def load_faculties():
-    """Загружает факультеты из файла"""
-    with open(FACULTIES_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Загружает факультеты (из кэша, перечитывая изменившийся файл)"""
+    return faculty_registry.data
 
 def save_faculties(faculties):
     """Сохраняет факультеты в файл"""
-    with open(FACULTIES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(faculties, f, ensure_ascii=False, indent=2)
+    faculty_registry.save(faculties)
 
 def load_groups():
-    """Загружает группы из файла"""
-    with open(GROUPS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Загружает группы (из кэша, перечитывая изменившийся файл)"""
+    return group_registry.data
 
 def save_groups(groups):
     """Сохраняет группы в файл"""
-    with open(GROUPS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(groups, f, ensure_ascii=False, indent=2)
+    group_registry.save(groups)
 
 def load_curators():
-    """Загружает кураторов из файла"""
-    with open(CURATORS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Загружает кураторов (из кэша, перечитывая изменившийся файл)"""
+    return curator_registry.all()
 
 def save_curators(curators):
     """Сохраняет кураторов в файл"""
-    with open(CURATORS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(curators, f, ensure_ascii=False, indent=2)
-
-# Загружаем текущие данные
-FACULTIES = load_faculties()
-GROUPS = load_groups()
-CURATORS = load_curators()
-
-# Обратная совместимость - создаем старые структуры для существующего кода
-GROUPS_LEGACY = {k: v["name"] for k, v in GROUPS.items()}
\ No newline at end of file
+    curator_registry.save(curators)
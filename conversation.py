@@ -0,0 +1,93 @@
+import json
+import time
+from typing import Any, Dict, MutableMapping, Optional, Set, Tuple
+
+# Ключ состояния в context.user_data: (состояние, срок действия, данные)
+STATE_KEY = "state"
+
+# Ожидаемый от пользователя ввод
+FULL_NAME = "full_name"              # ФИО при регистрации: group, username
+INPUT = "input"                      # расписание, объявление, вопрос или ответ: waiting_for, target_group, target_question
+IMPORT_STUDENTS = "import_students"  # список студентов: group
+EDIT_STUDENT = "edit_student"        # новое ФИО студента: group, old_name
+POLL_DURATION = "poll_duration"      # длительность голосования: group, curator_id
+ABSENCE_REASON = "absence_reason"    # причина отсутствия: poll_id, user_id
+# Состояние истекло — один раз сообщается пользователю
+EXPIRED = "expired"
+
+
+def set_state(user_data: MutableMapping, state: str, ttl: float, **data: Any) -> None:
+    """Переводит пользователя в состояние на ttl секунд; прежнее состояние заменяется"""
+    user_data[STATE_KEY] = (state, time.time() + ttl, data)
+
+
+def get_state(user_data: MutableMapping, now: Optional[float] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Текущее состояние и его данные; (None, {}) — ввода не ждём, (EXPIRED, {}) — ожидание истекло"""
+    entry = user_data.get(STATE_KEY)
+    if entry is None:
+        return None, {}
+    state, expires_at, data = entry
+    if (now or time.time()) >= expires_at:
+        del user_data[STATE_KEY]
+        return EXPIRED, {}
+    return state, data
+
+
+def clear_state(user_data: MutableMapping) -> None:
+    user_data.pop(STATE_KEY, None)
+
+
+class ConversationStore:
+    """Сохраняет состояния диалога между перезапусками бота.
+
+    Хранится только кортеж состояния пользователя (не весь user_data) —
+    компактной JSON-строкой в HotStateStore, который записывается на диск
+    пачкой вместе с остальными данными. После перезапуска состояние
+    переносится в user_data при первом обновлении от пользователя, а
+    истёкшие состояния отбрасываются.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._restored: Set[int] = set()
+        # Последний сохранённый кортеж пользователя: неизменное состояние не кодируется заново
+        self._saved: Dict[int, Optional[tuple]] = {}
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Удаляет истёкшие состояния (при запуске бота). Возвращает их число"""
+        now = now or time.time()
+        expired = [key for key, raw in self.store.values.items() if json.loads(raw)[1] <= now]
+        for key in expired:
+            self.store.set(key, None)
+        return len(expired)
+
+    def restore(self, user_id: int, user_data: MutableMapping) -> None:
+        if user_id in self._restored:
+            return
+        self._restored.add(user_id)
+        raw = self.store.get(str(user_id))
+        if not raw or STATE_KEY in user_data:
+            return
+        state, expires_at, data = json.loads(raw)
+        if expires_at <= time.time():
+            self.store.set(str(user_id), None)
+            return
+        entry = user_data[STATE_KEY] = (state, expires_at, data)
+        self._saved[user_id] = entry
+
+    def save(self, user_id: int, user_data: MutableMapping) -> None:
+        entry = user_data.get(STATE_KEY)
+        if entry is self._saved.get(user_id):
+            return
+        self._saved[user_id] = entry
+        self.store.set(str(user_id), json.dumps(entry, ensure_ascii=False, separators=(',', ':')) if entry else None)
+
+    async def restore_handler(self, update, context) -> None:
+        """TypeHandler до основных обработчиков"""
+        if update.effective_user is not None:
+            self.restore(update.effective_user.id, context.user_data)
+
+    async def save_handler(self, update, context) -> None:
+        """TypeHandler после основных обработчиков"""
+        if update.effective_user is not None:
+            self.save(update.effective_user.id, context.user_data)
@@ -1,78 +1,303 @@
-import json
-import os
-from typing import Dict, List, Optional
-from datetime import datetime
+import asyncio
+import functools
+from array import array
+from typing import Any, Callable, Dict, List, Optional
+from datetime import datetime, timedelta
+
+from timetable import WEEKDAYS, parse_timetable, build_week, next_lesson
+
+# Короткие коды экранов для хранилища навигации
+SCREEN_CODES = {
+    "menu": "m",
+    "today": "t",
+    "view_schedule": "s",
+    "view_announce": "a",
+    "ask_question": "q",
+    "view_questions": "v",
+    "answer_question": "r",
+}
+SCREEN_NAMES = {code: screen for screen, code in SCREEN_CODES.items()}
+
+
+def encode_screen(last_screen: Optional[str]) -> str:
+    """Сжимает "view_schedule_<группа>" до "s:<группа>"; пустая строка означает отсутствие экрана"""
+    if not last_screen:
+        return ""
+    for screen, code in SCREEN_CODES.items():
+        if last_screen.startswith(screen + "_"):
+            return f"{code}:{last_screen[len(screen) + 1:]}"
+    return last_screen
+
+
+def decode_screen(value: str) -> Optional[str]:
+    """Восстанавливает полное имя экрана из короткого кода"""
+    if not value:
+        return None
+    code, sep, rest = value.partition(":")
+    if sep and code in SCREEN_NAMES:
+        return f"{SCREEN_NAMES[code]}_{rest}"
+    return value
+
+
+def index_students(students: List[Dict]) -> Dict[str, Dict]:
+    """Индекс студентов группы: id и username аккаунта → запись студента"""
+    index = {}
+    for student in students:
+        if student.get("username"):
+            index.setdefault(f"@{student['username']}", student)
+        if student.get("user_id") is not None:
+            index[str(student["user_id"])] = student
+    return index
+
 
 class Database:
+    """Данные бота в памяти с записью через выбранное хранилище.
+
+    Обработчики обновлений выполняются параллельно (разные пользователи),
+    но все в одном цикле событий, поэтому отдельных блокировок у коллекций
+    нет: методы изменяют данные синхронно, без await внутри, и каждый вызов
+    атомарен относительно других обработчиков. Проверку и изменение нужно
+    делать одним вызовом (record_vote, а не has_voted + add_poll_response
+    через await). Живые коллекции другим потокам не передаются: фоновая
+    запись получает подготовленную пачку, а расчёты посещаемости —
+    копии данных группы (attendance_snapshot), снятые в цикле событий;
+    сами потоки читают с диска только архив голосований.
+    """
+
+    # Уплотнять журнал может только один процесс (бот); веб-приложение лишь дописывает
+    compact_journal = True
+
     def __init__(self):
         self.users_file = "users.json"
         self.messages_file = "messages.json"
         self.students_file = "students.json"
         self.polls_file = "polls.json"
+        self.questions_file = "questions.json"
+        self.journal_file = "journal.log"
+        self.sqlite_file = "umc.sqlite3"
+        self.navigation_file = "navigation.json"
+        self.conversations_file = "conversations.json"
+        self.archive_dir = "archive"
         self.load_data()
     
     def load_data(self):
         """Загружает данные из файлов"""
-        if not os.path.exists(self.users_file):
-            self.users = {}
-            self.save_users()
-        else:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                self.users = json.load(f)
-        
-        if not os.path.exists(self.messages_file):
-            self.messages = {}
-            self.save_messages()
-        else:
-            with open(self.messages_file, 'r', encoding='utf-8') as f:
-                self.messages = json.load(f)
-
-        if not os.path.exists(self.students_file):
-            self.students = {}
-            self.save_students()
-        else:
-            with open(self.students_file, 'r', encoding='utf-8') as f:
-                self.students = json.load(f)
-
-        if not os.path.exists(self.polls_file):
-            self.polls = {}
-            self.save_polls()
-        else:
-            with open(self.polls_file, 'r', encoding='utf-8') as f:
-                self.polls = json.load(f)
-        
-        # Загружаем вопросы
-        self.load_questions()
+        from config import STORAGE_MODE, JOURNAL_COMPACT_BYTES, ARCHIVE_SEGMENT_BYTES
+        from storage import create_storage
+        from hotstate import HotStateStore
+        from archive import PollArchive
+        files = {
+            "users": self.users_file,
+            "messages": self.messages_file,
+            "students": self.students_file,
+            "polls": self.polls_file,
+            "questions": self.questions_file,
+        }
+        # Хранилище создаётся один раз; повторный load_data перечитывает данные (веб-приложение)
+        if getattr(self, "_storage", None) is None:
+            self._storage = create_storage(STORAGE_MODE, files, self.journal_file, self.sqlite_file,
+                                           JOURNAL_COMPACT_BYTES, self.compact_journal)
+            # Навигация (последний экран) часто меняется и хранится отдельно от users.json
+            self.navigation = HotStateStore(self.navigation_file)
+            # Незавершённые диалоги (ожидание ввода) — тоже отдельно и компактно
+            self.conversations = HotStateStore(self.conversations_file)
+            # Закрытые голосования прошлых занятий уходят в сжатый архив
+            self.archive = PollArchive(self.archive_dir, ARCHIVE_SEGMENT_BYTES)
+        collections = self._storage.load()
+        self.navigation.load()
+        self.conversations.load()
+        # Счётчики изменений коллекций — ключи кэшей производных данных; перечитывание тоже изменение
+        versions = getattr(self, "versions", {})
+        self.versions: Dict[str, int] = {name: versions.get(name, 0) + 1 for name in files}
+        # Счётчики изменений по ключу верхнего уровня (группе) внутри коллекции; поколение — номер перечитывания
+        self.generation = getattr(self, "generation", 0) + 1
+        self.key_versions: Dict[tuple, int] = {}
+        self.users = collections["users"]
+        self.messages = collections["messages"]
+        self.students = collections["students"]
+        self.polls = collections["polls"]
+        self.questions = collections["questions"]
+        self._build_group_index()
+        self._build_question_index()
+        self._build_poll_index()
+        self.student_index: Dict[str, Dict[str, Dict]] = {}
+        for group in self.students:
+            self._index_students(group)
+        # Расписание по дням недели: разбирается один раз, дальше только поиск
+        self.timetable = {group: self._build_week(group) for group in self.messages}
+        # Переносим последние экраны, сохранённые ещё в users.json
+        for user_key, user in self.users.items():
+            if user.get("last_screen") and user_key not in self.navigation:
+                self.navigation.set(user_key, encode_screen(user["last_screen"]))
+
+    def _build_group_index(self):
+        """Строит индекс группа → id участников (компактные массивы int64)"""
+        self.group_members: Dict[str, array] = {}
+        for uid, user in self.users.items():
+            self.group_members.setdefault(user.get("group"), array('q')).append(int(uid))
+
+    def _index_user(self, user_id: int, old_group: Optional[str], new_group: Optional[str]):
+        """Переносит пользователя между группами в индексе"""
+        if old_group == new_group:
+            return
+        if old_group is not None:
+            members = self.group_members.get(old_group)
+            if members is not None and user_id in members:
+                members.remove(user_id)
+                if not members:
+                    del self.group_members[old_group]
+        if new_group is not None:
+            self.group_members.setdefault(new_group, array('q')).append(user_id)
+
+    def _build_question_index(self):
+        """Строит индексы вопросов: позиция по (группа, id) и неотвеченные по возрасту"""
+        self._question_pos: Dict[str, Dict[int, int]] = {}
+        pending = []
+        for group, questions in self.questions.items():
+            positions = self._question_pos[group] = {}
+            for i, question in enumerate(questions):
+                positions[question["id"]] = i
+                if question.get("status") == "pending":
+                    pending.append((self._question_time(question), group, question["id"]))
+        pending.sort()
+        # (группа, id) → время создания; порядок словаря — от старых к новым
+        self.pending_questions: Dict[tuple, float] = {(group, qid): created for created, group, qid in pending}
+
+    def _build_poll_index(self):
+        """Строит голосования группы по времени создания и счётчики ответов"""
+        self._group_polls: Dict[str, List[str]] = {}
+        self.poll_tallies: Dict[str, Dict[str, int]] = {}
+        # (голосование, id пользователя) уже проголосовавших — для защиты от повторного голоса
+        self._votes_cast = set()
+        for poll_id, poll in sorted(self.polls.items(), key=lambda item: item[1].get("created_at", "")):
+            self._group_polls.setdefault(poll.get("group"), []).append(poll_id)
+            tally = self.poll_tallies[poll_id] = {"present": 0, "absent": 0}
+            self._votes_cast.update((poll_id, user_key) for user_key in poll.get("responses", {}))
+            for response in poll.get("responses", {}).values():
+                status = response.get("status")
+                tally[status] = tally.get(status, 0) + 1
+
+    def _index_students(self, group: str):
+        """Перестраивает индекс студентов группы: id и username аккаунта → запись студента"""
+        self.student_index[group] = index_students(self.students.get(group, []))
+
+    def find_student(self, group: str, user_id, username: Optional[str] = None) -> Optional[Dict]:
+        """Находит запись студента группы по id аккаунта, затем по username"""
+        index = self.student_index.get(group, {})
+        student = index.get(str(user_id))
+        if student is None and username:
+            student = index.get(f"@{username}")
+        return student
+
+    @staticmethod
+    def _question_time(question: Dict) -> float:
+        try:
+            return datetime.fromisoformat(question["timestamp"]).timestamp()
+        except (KeyError, ValueError):
+            return 0.0
+
+    def _user_group(self, user_key: str) -> Optional[str]:
+        user = self.users.get(user_key)
+        return user.get("group") if user else None
+
+    def _touch(self, collection: str, *path):
+        """Фиксирует изменение значения по пути внутри коллекции (ключи словарей, индексы списков)"""
+        self.versions[collection] += 1
+        if path:
+            key = (collection, path[0])
+            self.key_versions[key] = self.key_versions.get(key, 0) + 1
+        self._storage.touch(collection, path)
+
+    def version(self, collection: str, key: Optional[str] = None) -> tuple:
+        """Версия коллекции или её части (например, сообщений одной группы) для ключей кэшей"""
+        if key is None:
+            return (self.generation, self.versions[collection])
+        return (self.generation, self.key_versions.get((collection, key), 0))
+
+    def start_write_behind(self, interval: float, max_dirty: int):
+        """Включает отложенную пакетную запись (вызывается из работающего цикла событий)"""
+        from storage import FlushScheduler
+        self._flusher = FlushScheduler(list(self.storages.values()), interval, max_dirty)
+        self._flusher.start()
+
+    @property
+    def storages(self) -> Dict[str, Any]:
+        """Хранилища по названию: основное и оперативные"""
+        return {"database": self._storage, "navigation": self.navigation, "conversations": self.conversations}
+
+    def meter_writes(self, record: Callable[[str, int], None]):
+        """Подключает учёт записей на диск: record(хранилище, байты) после каждой записанной пачки"""
+        for name, storage in self.storages.items():
+            storage.on_write = functools.partial(record, name)
+
+    async def stop_write_behind(self):
+        """Останавливает отложенную запись, сохранив всё накопленное"""
+        flusher = getattr(self, "_flusher", None)
+        if flusher is not None:
+            await flusher.stop()
+            self._flusher = None
+
+    async def persist(self):
+        """Дожидается записи накопленных изменений на диск (при отложенной записи — внеочередной пачкой)"""
+        flusher = getattr(self, "_flusher", None)
+        if flusher is not None:
+            await flusher.flush()
+
+    def flush(self):
+        """Синхронно записывает все накопленные изменения"""
+        self._storage.flush()
+        self.navigation.flush()
+        self.conversations.flush()
+
+    def close(self):
+        """Завершает работу хранилища: записывает накопленное и дожидается фонового уплотнения"""
+        self.navigation.close()
+        self.conversations.close()
+        self._storage.close()
     
     def save_users(self):
         """Сохраняет пользователей в файл"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=2)
+        self._storage.save("users")
     
     def save_messages(self):
         """Сохраняет сообщения в файл"""
-        with open(self.messages_file, 'w', encoding='utf-8') as f:
-            json.dump(self.messages, f, ensure_ascii=False, indent=2)
+        self._storage.save("messages")
 
     def save_students(self):
         """Сохраняет список студентов в файл"""
-        with open(self.students_file, 'w', encoding='utf-8') as f:
-            json.dump(self.students, f, ensure_ascii=False, indent=2)
+        self._storage.save("students")
 
     def save_polls(self):
         """Сохраняет голосования в файл"""
-        with open(self.polls_file, 'w', encoding='utf-8') as f:
-            json.dump(self.polls, f, ensure_ascii=False, indent=2)
+        self._storage.save("polls")
     
     def add_user(self, user_id: int, username: str, group: str):
         """Добавляет пользователя в группу"""
+        self._index_user(int(user_id), self._user_group(str(user_id)), group)
         self.users[str(user_id)] = {
             "username": username,
             "group": group,
-            "is_curator": False,
-            "last_screen": None
+            "is_curator": False
         }
-        self.save_users()
+        self._touch("users", str(user_id))
+
+    def remove_user(self, user_id: int) -> bool:
+        """Удаляет регистрацию пользователя"""
+        user_key = str(user_id)
+        if user_key not in self.users:
+            return False
+        self._index_user(int(user_id), self._user_group(user_key), None)
+        del self.users[user_key]
+        self._touch("users", user_key)
+        self.navigation.set(user_key, None)
+        return True
+
+    def set_user_full_name(self, user_id: int, full_name: str):
+        """Сохраняет ФИО пользователя"""
+        user_key = str(user_id)
+        if user_key in self.users:
+            self.users[user_key]["full_name"] = full_name
+            self._touch("users", user_key, "full_name")
     
     def get_user_group(self, user_id: int) -> Optional[str]:
         """Получает группу пользователя"""
@@ -81,24 +306,23 @@ class Database:
     
     def get_last_screen(self, user_id: int) -> Optional[str]:
         """Получает последний экран пользователя"""
-        user = self.users.get(str(user_id))
+        user_key = str(user_id)
+        user = self.users.get(user_key)
         if not user:
             return None
-        return user.get("last_screen")
+        return decode_screen(self.navigation.get(user_key) or "")
     
     def set_last_screen(self, user_id: int, last_screen: Optional[str]):
-        """Устанавливает последний экран пользователя"""
+        """Устанавливает последний экран пользователя (без перезаписи users.json)"""
         user_key = str(user_id)
         if user_key not in self.users:
             return
-        self.users[user_key]["last_screen"] = last_screen
-        self.save_users()
+        self.navigation.set(user_key, encode_screen(last_screen))
     
     def is_curator(self, user_id: int, group: str) -> bool:
         """Проверяет, является ли пользователь куратором группы"""
-        from config import load_curators, ADMIN_ID
-        curators = load_curators()
-        return user_id in curators.get(group, []) or user_id == ADMIN_ID
+        from config import curator_registry, ADMIN_ID
+        return user_id == ADMIN_ID or curator_registry.is_curator(user_id, group)
     
     def is_admin(self, user_id: int) -> bool:
         """Проверяет, является ли пользователь главным администратором"""
@@ -106,9 +330,9 @@ class Database:
         return user_id == ADMIN_ID
     
     def get_group_users(self, group: str) -> List[int]:
-        """Получает всех пользователей группы"""
-        return [int(uid) for uid, user in self.users.items() 
-                if user["group"] == group]
+        """Получает всех пользователей группы (по индексу, без обхода всех пользователей)"""
+        members = self.group_members.get(group)
+        return members.tolist() if members is not None else []
     
     def add_message(self, group: str, message_type: str, content: str, sender_id: int, file_id: str = None, media_type: str = None):
         """Добавляет сообщение в группу"""
@@ -127,18 +351,53 @@ class Database:
             message_data["file_id"] = file_id
             message_data["media_type"] = media_type
         
+        if message_type == "schedule":
+            lessons = parse_timetable(content)
+            if lessons:
+                message_data["lessons"] = lessons
+                days = {}
+                for lesson in lessons:
+                    days.setdefault(lesson["weekday"], []).append(lesson)
+                self.timetable.setdefault(group, {}).update(days)
+            else:
+                # Новое расписание не разбирается по дням — прежняя разобранная неделя устарела
+                self.timetable.pop(group, None)
+
         self.messages[group].append(message_data)
-        self.save_messages()
+        self._touch("messages", group, len(self.messages[group]) - 1)
     
     def update_user_rights(self, user_id: int, username: str, group: str, is_curator: bool):
         """Обновляет права пользователя"""
+        self._index_user(int(user_id), self._user_group(str(user_id)), group)
         self.users[str(user_id)] = {
             "username": username,
             "group": group,
-            "is_curator": is_curator,
-            "last_screen": self.users.get(str(user_id), {}).get("last_screen")
+            "is_curator": is_curator
         }
-        self.save_users()
+        self._touch("users", str(user_id))
+
+    def change_user_group(self, user_id: int, new_group: str) -> bool:
+        """Переводит пользователя в другую группу вместе с записью в списке студентов"""
+        user_key = str(user_id)
+        user = self.users.get(user_key)
+        if not user:
+            return False
+        old_group = user.get("group", "")
+        self._index_user(int(user_id), user.get("group"), new_group)
+        user["group"] = new_group
+        self._touch("users", user_key, "group")
+
+        students = self.students.get(old_group, [])
+        for i, student in enumerate(students):
+            if str(student.get("user_id")) == user_key:
+                del students[i]
+                self._touch("students", old_group)
+                self.students.setdefault(new_group, []).append(student)
+                self._touch("students", new_group, len(self.students[new_group]) - 1)
+                self._index_students(old_group)
+                self._index_students(new_group)
+                break
+        return True
 
     # --- Students ---
     def import_students_text(self, group: str, text: str) -> int:
@@ -167,7 +426,8 @@ class Database:
                 "username": None
             })
             added += 1
-        self.save_students()
+        self._touch("students", group)
+        self._index_students(group)
         return added
 
     def get_students(self, group: str) -> List[Dict]:
@@ -176,11 +436,12 @@ class Database:
     def link_student_account(self, group: str, full_name: str, user_id: int, username: Optional[str]):
         """Связывает студента с его TG-аккаунтом по ФИО"""
         students = self.students.get(group, [])
-        for s in students:
+        for i, s in enumerate(students):
             if s.get('full_name') == full_name:
                 s['user_id'] = user_id
                 s['username'] = username
-                self.save_students()
+                self._touch("students", group, i)
+                self._index_students(group)
                 return True
         return False
     
@@ -191,17 +452,18 @@ class Database:
             if s.get('full_name') == full_name:
                 del students[i]
                 self.students[group] = students
-                self.save_students()
+                self._touch("students", group)
+                self._index_students(group)
                 return True
         return False
 
     def update_student_name(self, group: str, old_full_name: str, new_full_name: str) -> bool:
         """Обновляет ФИО студента в группе"""
         students = self.students.get(group, [])
-        for s in students:
+        for i, s in enumerate(students):
             if s.get('full_name') == old_full_name:
                 s['full_name'] = new_full_name
-                self.save_students()
+                self._touch("students", group, i)
                 return True
         return False
 
@@ -211,12 +473,13 @@ class Database:
             self.students[group] = []
         
         # Проверяем, есть ли уже такой студент
-        for student in self.students[group]:
+        for i, student in enumerate(self.students[group]):
             if student.get('user_id') == user_id:
                 # Обновляем существующего студента
                 student['username'] = username
                 student['full_name'] = full_name
-                self.save_students()
+                self._touch("students", group, i)
+                self._index_students(group)
                 return
         
         # Добавляем нового студента
@@ -225,7 +488,8 @@ class Database:
             "username": username,
             "full_name": full_name
         })
-        self.save_students()
+        self._touch("students", group, len(self.students[group]) - 1)
+        self._index_students(group)
 
     def get_group_students_data(self, group: str) -> List[Dict]:
         """Получает данные студентов группы"""
@@ -235,6 +499,11 @@ class Database:
     def create_poll(self, group: str, curator_id: int, duration_minutes: int = 10) -> str:
         """Создает голосование для группы. Возвращает poll_id"""
         poll_id = f"{group}_{int(datetime.now().timestamp())}"
+        # Два куратора группы могут создать голосования в одну секунду
+        suffix = 1
+        while poll_id in self.polls:
+            suffix += 1
+            poll_id = f"{group}_{int(datetime.now().timestamp())}_{suffix}"
         self.polls[poll_id] = {
             "group": group,
             "curator_id": curator_id,
@@ -243,7 +512,9 @@ class Database:
             "status": "active",  # active, closed
             "responses": {}  # user_id -> {"status": "present"/"absent", "reason": str, "timestamp": str}
         }
-        self.save_polls()
+        self._touch("polls", poll_id)
+        self._group_polls.setdefault(group, []).append(poll_id)
+        self.poll_tallies[poll_id] = {"present": 0, "absent": 0}
         return poll_id
 
     def get_poll(self, poll_id: str):
@@ -254,29 +525,124 @@ class Database:
         """Добавляет ответ студента в голосование"""
         if poll_id not in self.polls:
             return False
-        self.polls[poll_id]["responses"][str(user_id)] = {
+        responses = self.polls[poll_id]["responses"]
+        tally = self.poll_tallies.setdefault(poll_id, {"present": 0, "absent": 0})
+        previous = responses.get(str(user_id))
+        if previous is not None:
+            tally[previous.get("status")] = tally.get(previous.get("status"), 1) - 1
+        responses[str(user_id)] = {
             "status": status,
             "reason": reason,
             "timestamp": str(datetime.now())
         }
-        self.save_polls()
+        tally[status] = tally.get(status, 0) + 1
+        self._touch("polls", poll_id, "responses", str(user_id))
+        return True
+
+    def record_vote(self, poll_id: str, user_id: int, status: str, reason: str = "") -> bool:
+        """Принимает голос один раз: учитывает его в памяти сразу, а на диск он уходит
+        ближайшей пачкой (не позже VOTE_FLUSH_DELAY). Возвращает False, если голос уже был"""
+        from config import VOTE_FLUSH_DELAY
+        key = (poll_id, str(user_id))
+        if key in self._votes_cast or poll_id not in self.polls:
+            return False
+        self._votes_cast.add(key)
+        self.add_poll_response(poll_id, user_id, status, reason)
+        flusher = getattr(self, "_flusher", None)
+        if flusher is not None:
+            flusher.request_flush(VOTE_FLUSH_DELAY)
         return True
 
+    def has_voted(self, poll_id: str, user_id: int) -> bool:
+        return (poll_id, str(user_id)) in self._votes_cast
+
+    def get_poll_tally(self, poll_id: str) -> Dict[str, int]:
+        """Счётчики ответов голосования: present, absent и total"""
+        tally = self.poll_tallies.get(poll_id, {})
+        present, absent = tally.get("present", 0), tally.get("absent", 0)
+        return {"present": present, "absent": absent, "total": len(self.polls.get(poll_id, {}).get("responses", {}))}
+
     def close_poll(self, poll_id: str):
         """Закрывает голосование"""
         if poll_id in self.polls:
             self.polls[poll_id]["status"] = "closed"
-            self.save_polls()
+            self._touch("polls", poll_id, "status")
+
+    def delete_poll(self, poll_id: str) -> bool:
+        """Удаляет голосование"""
+        if poll_id not in self.polls:
+            return False
+        group_polls = self._group_polls.get(self.polls[poll_id].get("group"), [])
+        if poll_id in group_polls:
+            group_polls.remove(poll_id)
+        self.poll_tallies.pop(poll_id, None)
+        self._votes_cast.difference_update((poll_id, user_key) for user_key in self.polls[poll_id].get("responses", {}))
+        del self.polls[poll_id]
+        self._touch("polls", poll_id)
+        return True
+
+    async def archive_group_polls(self, group: str) -> List[str]:
+        """Переносит все голосования группы в архив (активные предварительно закрываются). Возвращает их id.
+
+        Архив (сжатие и fsync) пишется в рабочем потоке по копиям голосований.
+        Ответы, пришедшие во время записи, дописываются следующим членом
+        архива — при чтении последняя запись голосования заменяет прежние.
+        """
+        poll_ids = list(self._group_polls.get(group, []))
+        for poll_id in poll_ids:
+            if self.polls[poll_id].get("status") == "active":
+                self.close_poll(poll_id)
+        # Сначала архив на диске, потом удаление из рабочих данных
+        pending = [(poll_id, poll) for poll_id, poll in self.get_live_polls(group, copy=True) if poll_id in poll_ids]
+        while pending:
+            await asyncio.to_thread(self.archive.append, group, pending)
+            written = dict(pending)
+            pending = [
+                (poll_id, {**poll, "responses": dict(poll.get("responses", {}))})
+                for poll_id, poll in ((poll_id, self.polls.get(poll_id)) for poll_id in written)
+                if poll is not None and poll.get("responses", {}) != written[poll_id].get("responses", {})
+            ]
+        for poll_id in poll_ids:
+            self.delete_poll(poll_id)
+        return poll_ids
+
+    def get_live_polls(self, group: str, since: Optional[datetime] = None, until: Optional[datetime] = None, copy: bool = False):
+        """Текущие (неархивные) голосования группы за период; copy=True — копии для чтения из другого потока"""
+        since_key = str(since) if since else None
+        until_key = str(until) if until else None
+        polls = []
+        for poll_id in self._group_polls.get(group, []):
+            poll = self.polls[poll_id]
+            created = poll.get("created_at", "")
+            if (since_key and created < since_key) or (until_key and created >= until_key):
+                continue
+            polls.append((poll_id, {**poll, "responses": dict(poll.get("responses", {}))} if copy else poll))
+        return polls
+
+    def attendance_snapshot(self, group: str, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, Any]:
+        """Копии данных группы для расчёта посещаемости в рабочем потоке (снимается в цикле событий):
+        текущие голосования, студенты и их индекс, пользователи группы и ответившие в текущих голосованиях"""
+        live = self.get_live_polls(group, since, until, copy=True)
+        students = [dict(student) for student in self.students.get(group, [])]
+        keys = {str(user_id) for user_id in self.get_group_users(group)}
+        for _, poll in live:
+            keys.update(poll["responses"])
+        users = {key: dict(self.users[key]) for key in keys if key in self.users}
+        return {"live": live, "students": students, "index": index_students(students), "users": users}
+
+    def get_poll_history(self, group: str, since: Optional[datetime] = None, until: Optional[datetime] = None, live=None):
+        """Все голосования группы за период (архив и текущие) по времени создания.
+
+        live — заранее снятые get_live_polls(copy=True), если история собирается вне цикла событий.
+        """
+        history = dict(self.archive.iter_polls(group, str(since) if since else None, str(until) if until else None))
+        history.update(self.get_live_polls(group, since, until) if live is None else live)
+        return sorted(history.items(), key=lambda item: item[1].get("created_at", ""))
 
     def get_group_polls(self, group: str, limit: int = 10):
-        """Получает последние голосования группы"""
-        group_polls = []
-        for poll_id, poll in self.polls.items():
-            if poll.get("group") == group:
-                group_polls.append((poll_id, poll))
-        # Сортируем по времени создания (новые первые)
-        group_polls.sort(key=lambda x: x[1].get("created_at", ""), reverse=True)
-        return group_polls[:limit]
+        """Получает последние голосования группы (новые первые)"""
+        poll_ids = self._group_polls.get(group, [])
+        return [(poll_id, self.polls[poll_id]) for poll_id in reversed(poll_ids[-limit:])]
 
     # --- Questions ---
     def add_question(self, user_id: int, group: str, question: str):
@@ -288,6 +654,7 @@ class Database:
             self.questions[group] = []
         
         question_id = len(self.questions[group]) + 1
+        now = datetime.now()
         
         self.questions[group].append({
             "id": question_id,
@@ -295,11 +662,13 @@ class Database:
             "question": question,
             "answer": None,
             "answered_by": None,
-            "timestamp": str(datetime.now()),
+            "timestamp": str(now),
             "status": "pending"  # pending, answered
         })
         
-        self.save_questions()
+        self._touch("questions", group, len(self.questions[group]) - 1)
+        self._question_pos.setdefault(group, {})[question_id] = len(self.questions[group]) - 1
+        self.pending_questions[(group, question_id)] = now.timestamp()
         return question_id
     
     def get_pending_questions(self, group: str):
@@ -318,113 +687,96 @@ class Database:
         """Получает вопрос по id"""
         if "questions" not in self.__dict__:
             return None
-        for question in self.questions.get(group, []):
-            if question["id"] == question_id:
-                return question
-        return None
+        i = self._question_pos.get(group, {}).get(question_id)
+        return self.questions[group][i] if i is not None else None
     
     def answer_question(self, group: str, question_id: int, answer: str, curator_id: int):
         """Отвечает на вопрос"""
         if "questions" not in self.__dict__:
             return False
         
-        for question in self.questions.get(group, []):
-            if question["id"] == question_id:
-                question["answer"] = answer
-                question["answered_by"] = curator_id
-                question["status"] = "answered"
-                question["answer_timestamp"] = str(datetime.now())
-                self.save_questions()
-                return True
-        return False
+        i = self._question_pos.get(group, {}).get(question_id)
+        if i is None:
+            return False
+        question = self.questions[group][i]
+        question["answer"] = answer
+        question["answered_by"] = curator_id
+        question["status"] = "answered"
+        question["answer_timestamp"] = str(datetime.now())
+        self._touch("questions", group, i)
+        self.pending_questions.pop((group, question_id), None)
+        return True
+
+    def collect_due_reminders(self, thresholds: List[float], now: float = None) -> List[tuple]:
+        """Неотвеченные вопросы, для которых наступил очередной порог напоминания (секунды от создания).
+
+        Обходит индекс от старых вопросов и останавливается на первом моложе
+        минимального порога. Номер отправленного напоминания сохраняется в
+        вопросе (reminder_stage), поэтому повторный обход его не вернёт.
+        Возвращает [(группа, вопрос, возраст в секундах)].
+        """
+        now = now or datetime.now().timestamp()
+        due = []
+        for (group, question_id), created in self.pending_questions.items():
+            age = now - created
+            if age < thresholds[0]:
+                break
+            stage = sum(1 for threshold in thresholds if age >= threshold)
+            i = self._question_pos[group][question_id]
+            question = self.questions[group][i]
+            if stage > question.get("reminder_stage", 0):
+                question["reminder_stage"] = stage
+                self._touch("questions", group, i, "reminder_stage")
+                due.append((group, question, age))
+        return due
     
     def save_questions(self):
         """Сохраняет вопросы в файл"""
-        questions_file = "questions.json"
-        with open(questions_file, 'w', encoding='utf-8') as f:
-            json.dump(self.questions, f, ensure_ascii=False, indent=2)
+        self._storage.save("questions")
     
+    def _build_week(self, group: str):
+        """Собирает неделю группы из её сообщений с расписанием"""
+        return build_week([m for m in self.messages.get(group, []) if m.get('type') == 'schedule'])
+
+    def get_day_lessons(self, group: str, weekday: int) -> List[Dict]:
+        """Занятия группы в день недели (0 - понедельник)"""
+        return self.timetable.get(group, {}).get(weekday, [])
+
+    def get_today_lessons(self, group: str, now: datetime = None) -> List[Dict]:
+        """Занятия группы на сегодня"""
+        return self.get_day_lessons(group, (now or datetime.now()).weekday())
+
+    def get_tomorrow_lessons(self, group: str, now: datetime = None) -> List[Dict]:
+        """Занятия группы на завтра"""
+        return self.get_day_lessons(group, ((now or datetime.now()) + timedelta(days=1)).weekday())
+
+    def get_next_lesson(self, group: str, now: datetime = None) -> Optional[Dict]:
+        """Ближайшее занятие группы"""
+        return next_lesson(self.timetable.get(group, {}), now)
+
     def get_group_schedule(self, group: str):
-        """Получает расписание группы из сообщений"""
-        if "messages" not in self.__dict__:
+        """Получает расписание группы на неделю"""
+        if "timetable" not in self.__dict__:
             return []
-        
-        group_messages = self.messages.get(group, [])
-        schedule_messages = [m for m in group_messages if m.get('type') == 'schedule']
-        
-        # Преобразуем в формат расписания
         schedule = []
-        for msg in schedule_messages:
-            # Парсим расписание из текста сообщения
-            content = msg.get('content', '')
-            if content:
-                # Простой парсинг расписания
-                lines = content.split('\n')
-                for line in lines:
-                    if ':' in line and ('-' in line or '—' in line):
-                        parts = line.split(':', 1)
-                        if len(parts) == 2:
-                            time_part = parts[0].strip()
-                            subject_part = parts[1].strip()
-                            
-                            # Извлекаем время
-                            if '-' in time_part:
-                                time_parts = time_part.split('-')
-                                start_time = time_parts[0].strip()
-                                end_time = time_parts[1].strip()
-                            else:
-                                start_time = time_part
-                                end_time = ""
-                            
-                            schedule.append({
-                                'start_time': start_time,
-                                'end_time': end_time,
-                                'subject': subject_part,
-                                'teacher': 'Преподаватель не указан',
-                                'room': '',
-                                'day': 'Понедельник'
-                            })
-        
+        for weekday, lessons in sorted(self.timetable.get(group, {}).items()):
+            for lesson in lessons:
+                schedule.append({
+                    'start_time': lesson.get('start', ''),
+                    'end_time': lesson.get('end', ''),
+                    'subject': lesson.get('subject', ''),
+                    'kind': lesson.get('kind', ''),
+                    'teacher': lesson.get('teacher', 'Преподаватель не указан'),
+                    'room': lesson.get('room', ''),
+                    'day': WEEKDAYS[weekday]
+                })
         return schedule
     
-    def vote_poll(self, poll_id: int, user_id: int, vote: str):
-        """Голосование в опросе"""
-        try:
-            # Находим опрос по ID
-            for group_id, polls in self.polls.items():
-                if poll_id in polls:
-                    poll = polls[poll_id]
-                    
-                    # Инициализируем голоса если их нет
-                    if "votes" not in poll:
-                        poll["votes"] = {}
-                    
-                    # Сохраняем голос пользователя
-                    poll["votes"][str(user_id)] = vote
-                    
-                    # Обновляем счетчики
-                    if vote == "present":
-                        poll["present"] = poll.get("present", 0) + 1
-                    elif vote == "absent":
-                        poll["absent"] = poll.get("absent", 0) + 1
-                    
-                    # Сохраняем изменения
-                    self.save_polls()
-                    return True
-            
-            return False
-        except Exception as e:
-            print(f"Ошибка голосования: {e}")
+    def vote_poll(self, poll_id, user_id: int, vote: str):
+        """Голосование в опросе (из веб-приложения)"""
+        if vote not in ("present", "absent"):
             return False
-    
-    def load_questions(self):
-        """Загружает вопросы из файла"""
-        questions_file = "questions.json"
-        if os.path.exists(questions_file):
-            with open(questions_file, 'r', encoding='utf-8') as f:
-                self.questions = json.load(f)
-        else:
-            self.questions = {}
+        return self.record_vote(str(poll_id), int(user_id), vote)
     
     # --- Faculty and Group Management ---
     def get_all_faculties(self):
@@ -439,8 +791,8 @@ class Database:
     
     def get_groups_by_faculty(self, faculty_id: str):
         """Получает все группы факультета"""
-        groups = self.get_all_groups()
-        return {k: v for k, v in groups.items() if v.get("faculty") == faculty_id}
+        from config import group_registry
+        return group_registry.of_faculty(faculty_id)
     
     def get_all_curators(self):
         """Получает всех кураторов"""
@@ -481,7 +833,7 @@ class Database:
         self.messages[group] = [m for m in self.messages[group] if m.get('type') != 'announcement']
         
         # Сохраняем изменения
-        self.save_messages()
+        self._touch("messages", group)
         
         return announcements_count
     
@@ -0,0 +1,69 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Any, Any], Awaitable[Any]]
+
+
+class _Node:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # (обработчик, число аргументов или None — любое)
+        self.routes: List[Tuple[Handler, Optional[int]]] = []
+
+
+class CallbackRouter:
+    """Маршрутизация callback_data по префиксному дереву токенов.
+
+    callback_data разбивается по "_" один раз; маршрут — последовательность
+    токенов-действия ("students_delete_pick") и число аргументов после неё
+    (nargs=0 — точное совпадение, None — любое). Выбирается самый длинный
+    подходящий маршрут, поэтому "students_delete_<группа>" и
+    "students_delete_pick_<...>" не зависят от порядка регистрации.
+    Аргументы передаются обработчику в context.args.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, action: str, handler: Handler, nargs: Optional[int] = None) -> None:
+        node = self._root
+        for token in action.split("_"):
+            node = node.children.setdefault(token, _Node())
+        node.routes.append((handler, nargs))
+
+    def wrap_handlers(self, wrapper: Callable[[Handler], Handler]) -> None:
+        """Заменяет каждый зарегистрированный обработчик на wrapper(обработчик) (например, для замеров)"""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            node.routes = [(wrapper(handler), nargs) for handler, nargs in node.routes]
+            stack.extend(node.children.values())
+
+    def resolve(self, data: str) -> Optional[Tuple[Handler, List[str]]]:
+        """Находит обработчик для callback_data; возвращает (обработчик, аргументы)"""
+        tokens = data.split("_")
+        node = self._root
+        found = None
+        for i, token in enumerate(tokens):
+            node = node.children.get(token)
+            if node is None:
+                break
+            for handler, nargs in node.routes:
+                if nargs is None or nargs == len(tokens) - i - 1:
+                    found = (handler, tokens[i + 1:])
+                    break
+        return found
+
+    async def dispatch(self, update, context) -> None:
+        """Обработчик CallbackQueryHandler: один на все кнопки"""
+        data = update.callback_query.data or ""
+        found = self.resolve(data)
+        if found is None:
+            logger.warning(f"Нет обработчика для кнопки: {data}")
+            return
+        handler, context.args = found
+        await handler(update, context)
@@ -0,0 +1,89 @@
+import csv
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from analytics import build_attendance, PRESENT, ABSENT
+
+# Отметки в ячейках выгрузки: как в бумажном журнале
+CELL_MARKS = {PRESENT: "+", ABSENT: "н"}
+
+
+def _label(created_at: str) -> str:
+    try:
+        return datetime.fromisoformat(created_at).strftime("%d.%m.%Y %H:%M")
+    except ValueError:
+        return created_at[:16]
+
+
+def _columns(polls: List[Dict]) -> List[Tuple[str, int]]:
+    """Столбцы голосований группы: (минута создания, номер голосования группы в эту минуту).
+
+    Занятия разных групп в одну минуту попадают в общий столбец, а два
+    голосования одной группы в одну минуту — в разные.
+    """
+    seen: Dict[str, int] = {}
+    columns = []
+    for poll in polls:
+        label = _label(poll.get("created_at", ""))
+        columns.append((label, seen.get(label, 0)))
+        seen[label] = seen.get(label, 0) + 1
+    return columns
+
+
+def write_attendance_csv(path: str, db, groups: List[str], since: Optional[datetime] = None,
+                         until: Optional[datetime] = None, snapshots: Optional[Dict[str, Dict]] = None) -> int:
+    """Пишет посещаемость групп за период в CSV: строка на студента, столбец на занятие.
+
+    Рассчитана на запуск в рабочем потоке: архив читается и разжимается
+    здесь же, а голосования, студенты и пользователи берутся из snapshots
+    (db.attendance_snapshot() по группам, снятые в цикле событий). Строки
+    пишутся в файл по мере формирования. Возвращает число строк студентов.
+    """
+    matrices = [(group, build_attendance(db, group, since, until, (snapshots or {}).get(group))) for group in groups]
+    # Общие столбцы для всех групп факультета: занятия по времени голосования
+    first_seen: Dict[Tuple[str, int], str] = {}
+    for _, matrix in matrices:
+        for column, poll in zip(_columns(matrix.polls), matrix.polls):
+            first_seen.setdefault(column, poll.get("created_at", ""))
+    columns = sorted(first_seen, key=lambda column: (first_seen[column], column))
+    position = {column: i for i, column in enumerate(columns)}
+    headers = [label if not n else f"{label} ({n + 1})" for label, n in columns]
+
+    rows = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Группа", "ФИО", "Username", *headers, "Присутствий", "Занятий", "Посещаемость"])
+        for group, matrix in matrices:
+            slots = [position[column] for column in _columns(matrix.polls)]
+            rates = matrix.attendance_rate()
+            present = (matrix.codes == PRESENT).sum(axis=1)
+            for i, student in enumerate(matrix.students):
+                cells = [""] * len(columns)
+                for slot, code in zip(slots, matrix.codes[i].tolist()):
+                    cells[slot] = CELL_MARKS.get(code, "")
+                username = student.get("username") or ""
+                writer.writerow([group, student.get("full_name", ""), f"@{username}" if username else "", *cells,
+                                 int(present[i]), len(matrix.polls), f"{rates[i]:.0%}"])
+                rows += 1
+    return rows
+
+
+class ExportCache:
+    """file_id уже отправленных выгрузок по ключу (группы, период, версия данных); старые вытесняются"""
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, str]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        file_id = self._items.get(key)
+        if file_id is not None:
+            self._items.move_to_end(key)
+        return file_id
+
+    def put(self, key: Hashable, file_id: str) -> None:
+        self._items[key] = file_id
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
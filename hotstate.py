@@ -0,0 +1,83 @@
+import json
+import logging
+from typing import Dict, List, Optional
+
+from storage import Change, read_json, write_bytes_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class HotStateStore:
+    """Хранилище часто меняющегося и неважного состояния (навигация и т.п.).
+
+    Значения живут в памяти как словарь ключ → короткая строка и
+    сохраняются в отдельный компактный файл, не затрагивая основные
+    коллекции. Интерфейс записи совпадает с хранилищами из storage.py,
+    поэтому FlushScheduler сбрасывает его той же пачкой; без
+    планировщика файл перезаписывается сразу.
+    """
+
+    name = "hotstate"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.values: Dict[str, str] = {}
+        self.write_behind = False
+        self.max_dirty = 0
+        self.on_backlog = None
+        self.on_write = None
+        self._dirty = 0
+
+    def load(self) -> Dict[str, str]:
+        self.values = read_json(self.path, {})
+        return self.values
+
+    def get(self, key: str) -> Optional[str]:
+        return self.values.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.values
+
+    def set(self, key: str, value: Optional[str]) -> None:
+        """Устанавливает значение; None удаляет ключ"""
+        if value is None:
+            if self.values.pop(key, None) is None:
+                return
+        elif self.values.get(key) == value:
+            return
+        else:
+            self.values[key] = value
+        self._dirty += 1
+        if not self.write_behind:
+            self.flush()
+        elif self.max_dirty and self._dirty >= self.max_dirty and self.on_backlog:
+            self.on_backlog()
+
+    @property
+    def dirty_count(self) -> int:
+        return self._dirty
+
+    def take_dirty(self) -> List[Change]:
+        if not self._dirty:
+            return []
+        self._dirty = 0
+        return [(self.name, ())]
+
+    def requeue(self, changes: List[Change]) -> None:
+        self._dirty += len(changes)
+
+    def prepare(self, changes: List[Change]) -> bytes:
+        return json.dumps(self.values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def write(self, batch: bytes) -> None:
+        size = write_bytes_atomic(self.path, batch)
+        if self.on_write:
+            self.on_write(size)
+
+    def flush(self) -> None:
+        changes = self.take_dirty()
+        if changes:
+            self.write(self.prepare(changes))
+
+    def close(self) -> None:
+        self.flush()
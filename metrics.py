@@ -0,0 +1,231 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+# Границы корзин гистограммы времени обработчика, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Обработчик, в котором выполняется текущий код; вызовы Bot API и записи на диск относятся к нему
+_current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("handler", default="-")
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как histogram в Prometheus)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Последняя корзина — всё, что больше верхней границы (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины (как histogram_quantile)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Замеры бота по обработчикам: время и ошибки, вызовы Bot API, записи на диск.
+
+    Обработчики оборачиваются через instrument(); имя обработчика хранится
+    в contextvar, поэтому вызовы Bot API (MeteredRequest) и синхронные
+    записи на диск внутри него учитываются под тем же именем. Фоновая
+    запись идёт вне обработчиков и учитывается под именем "-".
+    Отдаётся в текстовом формате Prometheus (render) и сводкой для
+    администратора (summary). Изменения и чтение — под блокировкой:
+    /metrics в режиме polling отдаётся из отдельного потока.
+    """
+
+    def __init__(self, prefix: str = "umc"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.latency: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        # (обработчик, метод) → [число вызовов, суммарное время]
+        self.api_calls: Dict[Tuple[str, str], List[float]] = {}
+        # (обработчик, хранилище) → [число записей, байты]
+        self.disk_writes: Dict[Tuple[str, str], List[int]] = {}
+        # Задержка цикла событий и блокировки по месту в коде (watchdog.LoopWatchdog)
+        self.loop_lag = Histogram()
+        self.stalls: Dict[str, int] = {}
+
+    def observe_handler(self, name: str, seconds: float, failed: bool = False) -> None:
+        with self._lock:
+            histogram = self.latency.get(name)
+            if histogram is None:
+                histogram = self.latency[name] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def observe_api_call(self, method: str, seconds: float) -> None:
+        key = (_current_handler.get(), method)
+        with self._lock:
+            entry = self.api_calls.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def observe_disk_write(self, storage: str, size: int) -> None:
+        key = (_current_handler.get(), storage)
+        with self._lock:
+            entry = self.disk_writes.setdefault(key, [0, 0])
+            entry[0] += 1
+            entry[1] += size
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        with self._lock:
+            self.loop_lag.observe(seconds)
+
+    def record_stall(self, site: str) -> None:
+        with self._lock:
+            self.stalls[site] = self.stalls.get(site, 0) + 1
+
+    def instrument(self, callback: Callable, name: Optional[str] = None) -> Callable:
+        """Оборачивает асинхронный обработчик замером времени и ошибок"""
+        name = name or getattr(callback, "__qualname__", None) or repr(callback)
+
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            token = _current_handler.set(name)
+            started = time.perf_counter()
+            failed = False
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self.observe_handler(name, time.perf_counter() - started, failed)
+                _current_handler.reset(token)
+
+        return wrapper
+
+    def instrument_application(self, application, skip: Iterable[Callable] = ()) -> None:
+        """Оборачивает все зарегистрированные обработчики приложения (кроме skip)"""
+        skip = list(skip)
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if handler.callback not in skip:
+                    handler.callback = self.instrument(handler.callback)
+
+    def render(self) -> str:
+        """Все замеры в текстовом формате Prometheus"""
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_handler_latency_seconds Время выполнения обработчика",
+            f"# TYPE {p}_handler_latency_seconds histogram",
+        ]
+        with self._lock:
+            for name, h in sorted(self.latency.items()):
+                label = f'handler="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip([repr(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f'{p}_handler_latency_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{p}_handler_latency_seconds_sum{{{label}}} {h.sum:.6f}")
+                lines.append(f"{p}_handler_latency_seconds_count{{{label}}} {h.count}")
+            lines += [
+                f"# HELP {p}_handler_errors_total Необработанные исключения в обработчике",
+                f"# TYPE {p}_handler_errors_total counter",
+            ]
+            for name, count in sorted(self.errors.items()):
+                lines.append(f'{p}_handler_errors_total{{handler="{_escape(name)}"}} {count}')
+            for metric, help_text, rows in (
+                ("bot_api_calls_total", "Вызовы Bot API",
+                 [(f'handler="{_escape(n)}",method="{_escape(m)}"', c) for (n, m), (c, _) in sorted(self.api_calls.items())]),
+                ("bot_api_seconds_total", "Суммарное время вызовов Bot API",
+                 [(f'handler="{_escape(n)}",method="{_escape(m)}"', f"{t:.6f}") for (n, m), (_, t) in sorted(self.api_calls.items())]),
+                ("disk_writes_total", "Записи пачек на диск",
+                 [(f'handler="{_escape(n)}",storage="{_escape(st)}"', c) for (n, st), (c, _) in sorted(self.disk_writes.items())]),
+                ("disk_write_bytes_total", "Записано байт",
+                 [(f'handler="{_escape(n)}",storage="{_escape(st)}"', b) for (n, st), (_, b) in sorted(self.disk_writes.items())]),
+            ):
+                lines.append(f"# HELP {p}_{metric} {help_text}")
+                lines.append(f"# TYPE {p}_{metric} counter")
+                lines += [f"{p}_{metric}{{{label}}} {value}" for label, value in rows]
+            lines += [
+                f"# HELP {p}_event_loop_lag_seconds Задержка цикла событий",
+                f"# TYPE {p}_event_loop_lag_seconds histogram",
+            ]
+            cumulative = 0
+            for bound, count in zip([repr(b) for b in self.loop_lag.buckets] + ["+Inf"], self.loop_lag.counts):
+                cumulative += count
+                lines.append(f'{p}_event_loop_lag_seconds_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{p}_event_loop_lag_seconds_sum {self.loop_lag.sum:.6f}")
+            lines.append(f"{p}_event_loop_lag_seconds_count {self.loop_lag.count}")
+            lines += [
+                f"# HELP {p}_event_loop_stalls_total Блокировки цикла событий дольше порога по месту в коде",
+                f"# TYPE {p}_event_loop_stalls_total counter",
+            ]
+            for site, count in sorted(self.stalls.items()):
+                lines.append(f'{p}_event_loop_stalls_total{{site="{_escape(site)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self, limit: int = 15) -> List[Dict[str, Any]]:
+        """Сводка по обработчикам (самые медленные по p95 первыми): вызовы, ошибки, p50/p95/p99 в мс"""
+        with self._lock:
+            rows = [
+                {
+                    "handler": name,
+                    "count": h.count,
+                    "errors": self.errors.get(name, 0),
+                    "p50": h.quantile(0.50) * 1000,
+                    "p95": h.quantile(0.95) * 1000,
+                    "p99": h.quantile(0.99) * 1000,
+                }
+                for name, h in self.latency.items()
+            ]
+        rows.sort(key=lambda row: row["p95"], reverse=True)
+        return rows[:limit]
+
+    def totals(self) -> Dict[str, float]:
+        """Итоги по вызовам Bot API, записям на диск и задержке цикла событий"""
+        with self._lock:
+            return {
+                "api_calls": sum(count for count, _ in self.api_calls.values()),
+                "api_seconds": sum(seconds for _, seconds in self.api_calls.values()),
+                "disk_writes": sum(count for count, _ in self.disk_writes.values()),
+                "disk_bytes": sum(size for _, size in self.disk_writes.values()),
+                "loop_lag_p99": self.loop_lag.quantile(0.99) * 1000,
+                "stalls": sum(self.stalls.values()),
+            }
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest, учитывающий число и время вызовов Bot API по методам"""
+
+    def __init__(self, metrics: Metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            self.metrics.observe_api_call(url.rsplit("/", 1)[-1], time.perf_counter() - started)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
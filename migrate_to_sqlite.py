@@ -0,0 +1,41 @@
+"""Однократный перенос данных бота из JSON-файлов в SQLite.
+
+Использование:
+    python migrate_to_sqlite.py [--force]
+
+Импортирует users.json, messages.json, students.json, polls.json и
+questions.json (вместе с непримёненным journal.log) в umc.sqlite3.
+После переноса запускайте бота с STORAGE_MODE=sqlite.
+"""
+import os
+import sys
+
+from storage import SqliteStorage
+
+FILES = {
+    "users": "users.json",
+    "messages": "messages.json",
+    "students": "students.json",
+    "polls": "polls.json",
+    "questions": "questions.json",
+}
+SQLITE_FILE = "umc.sqlite3"
+JOURNAL_FILE = "journal.log"
+
+
+def main():
+    force = "--force" in sys.argv[1:]
+    if os.path.exists(SQLITE_FILE) and not force:
+        print(f"{SQLITE_FILE} уже существует. Используйте --force, чтобы импортировать данные заново.")
+        return 1
+    storage = SqliteStorage(FILES, SQLITE_FILE, JOURNAL_FILE)
+    storage.migrate_from_json()
+    for name in FILES:
+        print(f"{name}: {len(storage.collections[name])}")
+    storage.close()
+    print(f"Готово. Запустите бота с STORAGE_MODE=sqlite")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from storage import write_json_atomic, read_json
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Устойчивая к перезапускам очередь рассылок на локальном диске.
+
+    Каждая рассылка — файл <id>.json со содержимым и списком получателей
+    (пишется атомарно) и файл <id>.ack, куда после каждой доставки
+    дописывается id получателя ("!id" — получателю отправить невозможно).
+    После перезапуска рассылка продолжается только по получателям без
+    отметки. Отметка пишется сразу после ответа Telegram, поэтому
+    сообщение может повториться лишь у тех получателей, отправка которым
+    шла в момент падения процесса. Когда все отмечены, файлы удаляются.
+
+    Ставить рассылки в очередь может любой процесс (бот, веб-приложение);
+    доставляет их только бот — фоновый воркер периодически проверяет
+    каталог и при старте дорассылает незавершённое.
+    """
+
+    def __init__(self, directory: str, poll_interval: float = 5.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._active: Set[str] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.engine = None
+        self.make_sender: Optional[Callable[[Dict[str, Any]], Callable]] = None
+
+    def _path(self, broadcast_id: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{broadcast_id}.{ext}")
+
+    def enqueue(self, group: str, recipients: Iterable[int], kind: str, text: str = "",
+                file_id: Optional[str] = None, parse_mode: Optional[str] = None,
+                reply_markup: Optional[Dict] = None) -> str:
+        """Ставит рассылку в очередь. Возвращает её id"""
+        os.makedirs(self.directory, exist_ok=True)
+        broadcast_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        record = {
+            "id": broadcast_id,
+            "group": group,
+            "kind": kind,
+            "text": text,
+            "file_id": file_id,
+            "parse_mode": parse_mode,
+            "reply_markup": reply_markup,
+            "recipients": list(dict.fromkeys(int(r) for r in recipients)),
+            "created_at": datetime.now().isoformat(),
+        }
+        write_json_atomic(self._path(broadcast_id, "json"), record, indent=None)
+        if self._wake is not None:
+            self._wake.set()
+        return broadcast_id
+
+    def pending_ids(self) -> List[str]:
+        """Незавершённые рассылки в порядке постановки"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def _acked(self, broadcast_id: str) -> Set[int]:
+        acked = set()
+        path = self._path(broadcast_id, "ack")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip().lstrip("!")
+                    if line.lstrip("-").isdigit():
+                        acked.add(int(line))
+        return acked
+
+    def remaining(self, broadcast_id: str) -> List[int]:
+        record = read_json(self._path(broadcast_id, "json"))
+        if not record:
+            return []
+        acked = self._acked(broadcast_id)
+        return [r for r in record["recipients"] if r not in acked]
+
+    async def deliver(self, broadcast_id: str, progress=None) -> int:
+        """Доставляет рассылку оставшимся получателям. Возвращает число успешных отправок"""
+        if broadcast_id in self._active:
+            return 0
+        record = read_json(self._path(broadcast_id, "json"))
+        if not record:
+            return 0
+        self._active.add(broadcast_id)
+        try:
+            acked = self._acked(broadcast_id)
+            recipients = [r for r in record["recipients"] if r not in acked]
+            if recipients:
+                if acked:
+                    logger.info(f"Продолжаем рассылку {broadcast_id}: осталось {len(recipients)} из {len(record['recipients'])}")
+                with open(self._path(broadcast_id, "ack"), 'a', encoding='utf-8') as ack:
+                    def on_result(chat_id: int, ok: bool):
+                        ack.write(f"{chat_id}\n" if ok else f"!{chat_id}\n")
+                        ack.flush()
+                    sent = await self.engine.broadcast(recipients, self.make_sender(record), progress, on_result)
+            else:
+                sent = 0
+            for ext in ("json", "ack"):
+                try:
+                    os.remove(self._path(broadcast_id, ext))
+                except FileNotFoundError:
+                    pass
+            return sent
+        finally:
+            self._active.discard(broadcast_id)
+
+    def start(self, engine, make_sender: Callable[[Dict[str, Any]], Callable]) -> None:
+        """Запускает фоновый воркер доставки (вызывается из работающего цикла событий)"""
+        self.engine = engine
+        self.make_sender = make_sender
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            for broadcast_id in self.pending_ids():
+                if self._stopping:
+                    break
+                if broadcast_id in self._active:
+                    continue
+                try:
+                    await self.deliver(broadcast_id)
+                except Exception as e:
+                    logger.error(f"Ошибка доставки рассылки {broadcast_id}: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def stop(self) -> None:
+        """Останавливает воркер; незавершённые рассылки продолжатся при следующем запуске"""
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,113 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage import write_json_atomic, read_json
+
+logger = logging.getLogger(__name__)
+
+# Обработчик задачи: (контекст, данные задачи)
+JobHandler = Callable[[Any, Dict[str, Any]], Awaitable[None]]
+
+
+class PersistentScheduler:
+    """Отложенные задачи, переживающие перезапуск.
+
+    Задачи хранятся в JSON-файле {id: {"kind", "due", "data"}} (due — unix
+    время), в памяти — в куче по времени срабатывания. Один таймер спит
+    до ближайшей задачи; новая более ранняя задача его будит. При старте
+    всё, что просрочилось, пока бот был выключен, выполняется сразу.
+    Задача удаляется из файла после выполнения обработчика, поэтому
+    падение во время выполнения приведёт к повтору — обработчики должны
+    быть идемпотентными (закрыть закрытое голосование, не напоминать об
+    отвеченном вопросе).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.handlers: Dict[str, JobHandler] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.context: Any = None
+
+    def load(self) -> None:
+        self.jobs = read_json(self.path, {})
+        self._heap = [(job["due"], job_id) for job_id, job in self.jobs.items()]
+        heapq.heapify(self._heap)
+
+    def _save(self) -> None:
+        write_json_atomic(self.path, self.jobs, indent=None)
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self.handlers[kind] = handler
+
+    def schedule(self, kind: str, delay: float, data: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        """Планирует задачу через delay секунд. Задача с тем же id заменяется"""
+        job_id = job_id or f"{kind}:{time.time_ns()}"
+        due = time.time() + delay
+        self.jobs[job_id] = {"kind": kind, "due": due, "data": data}
+        heapq.heappush(self._heap, (due, job_id))
+        self._save()
+        if self._wake is not None and self._heap[0][1] == job_id:
+            self._wake.set()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """Отменяет задачу (запись в куче пропустится при срабатывании)"""
+        if self.jobs.pop(job_id, None) is None:
+            return False
+        self._save()
+        return True
+
+    def has_job(self, job_id: str) -> bool:
+        return job_id in self.jobs
+
+    def start(self, context: Any) -> None:
+        """Запускает таймер (вызывается из работающего цикла событий)"""
+        self.context = context
+        self._wake = asyncio.Event()
+        overdue = sum(1 for due, _ in self._heap if due <= time.time())
+        if overdue:
+            logger.info(f"Просроченных за время простоя задач: {overdue}, выполняем")
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            while self._heap and self._heap[0][0] <= time.time():
+                due, job_id = heapq.heappop(self._heap)
+                job = self.jobs.get(job_id)
+                # Отменённая или перепланированная задача
+                if job is None or job["due"] != due:
+                    continue
+                await self._fire(job_id, job)
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, job_id: str, job: Dict[str, Any]) -> None:
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            logger.error(f"Нет обработчика для задачи {job_id} ({job['kind']})")
+        else:
+            try:
+                await handler(self.context, job["data"])
+            except Exception as e:
+                logger.error(f"Ошибка выполнения задачи {job_id}: {e}")
+        if self.jobs.get(job_id) is job:
+            del self.jobs[job_id]
+            self._save()
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,29 @@
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class ScreenCache:
+    """Готовые экраны бота (текст и клавиатура) по ключу (экран, группа, роль).
+
+    Вместе с экраном хранится версия данных, из которых он собран
+    (счётчики изменений коллекций и реестров). Пока версия та же, экран
+    отдаётся из кэша без пересборки; изменилась — собирается заново и
+    заменяет прежний. Явно сбрасывать кэш не нужно.
+    """
+
+    def __init__(self):
+        self._items: Dict[Hashable, Tuple[Hashable, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: Hashable, render: Callable[[], Any]) -> Any:
+        item = self._items.get(key)
+        if item is not None and item[0] == version:
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        value = render()
+        self._items[key] = (version, value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,756 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Коллекции, которыми управляет Database
+COLLECTIONS = ("users", "messages", "students", "polls", "questions")
+
+_MISSING = object()
+
+# Изменение: (коллекция, путь внутри коллекции)
+Change = Tuple[str, tuple]
+
+
+def write_bytes_atomic(path: str, payload: bytes) -> int:
+    """Атомарно записывает файл: сначала во временный файл, затем os.replace. Возвращает размер в байтах"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(payload)
+
+
+def write_json_atomic(path: str, data: Any, indent: Optional[int] = 2) -> int:
+    """Атомарно записывает JSON. Возвращает размер в байтах"""
+    return write_bytes_atomic(path, json.dumps(data, ensure_ascii=False, indent=indent).encode('utf-8'))
+
+
+def read_json(path: str, default: Any = None) -> Any:
+    """Читает JSON-файл, если он существует"""
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_path(root: Any, path: Sequence) -> Any:
+    """Возвращает значение по пути (ключи словарей / индексы списков) или _MISSING"""
+    node = root
+    for key in path:
+        if isinstance(node, dict):
+            if key not in node:
+                return _MISSING
+            node = node[key]
+        elif isinstance(node, list) and isinstance(key, int):
+            if key >= len(node):
+                return _MISSING
+            node = node[key]
+        else:
+            return _MISSING
+    return node
+
+
+def apply_change(root: Dict, path: Sequence, value: Any = None, delete: bool = False) -> None:
+    """Применяет одно изменение журнала к коллекции.
+
+    Запись в индекс списка, равный его длине, означает добавление в конец.
+    Удаление поддерживается только для ключей словаря — так повторное
+    применение журнала остаётся идемпотентным.
+    """
+    node = root
+    for i, key in enumerate(path[:-1]):
+        if isinstance(node, dict):
+            if key not in node:
+                node[key] = [] if isinstance(path[i + 1], int) else {}
+            node = node[key]
+        elif isinstance(node, list) and isinstance(key, int) and key < len(node):
+            node = node[key]
+        else:
+            logger.warning(f"Пропущена запись журнала с некорректным путём: {list(path)}")
+            return
+    last = path[-1]
+    if isinstance(node, dict):
+        if delete:
+            node.pop(last, None)
+        else:
+            node[last] = value
+    elif isinstance(node, list) and isinstance(last, int) and not delete:
+        if last < len(node):
+            node[last] = value
+        elif last == len(node):
+            node.append(value)
+        else:
+            logger.warning(f"Пропущена запись журнала за концом списка: {list(path)}")
+    else:
+        logger.warning(f"Пропущена запись журнала с некорректным путём: {list(path)}")
+
+
+class JsonStorage:
+    """Классический режим: каждое изменение перезаписывает файл коллекции целиком.
+
+    Запись любого хранилища разделена на два шага: prepare() снимает
+    значения из памяти (в потоке цикла событий), write() пишет готовую
+    пачку на диск (можно в рабочем потоке). Без планировщика оба шага
+    выполняются сразу при каждом изменении; с FlushScheduler изменения
+    копятся как «грязные» пути и записываются пачками.
+    """
+
+    def __init__(self, files: Dict[str, str]):
+        self.files = files
+        self.collections: Dict[str, Any] = {}
+        # Отложенная запись включается FlushScheduler
+        self.write_behind = False
+        self.max_dirty = 0
+        self.on_backlog: Optional[Callable[[], None]] = None
+        # Учёт записей на диск: вызывается с размером каждой записанной пачки
+        self.on_write: Optional[Callable[[int], None]] = None
+        self._dirty: Dict[Change, None] = {}
+
+    def load(self) -> Dict[str, Any]:
+        """Загружает все коллекции из снимков"""
+        self.collections = {}
+        for name in COLLECTIONS:
+            data = read_json(self.files[name])
+            self.collections[name] = {} if data is None else data
+            if data is None:
+                self.save(name)
+        return self.collections
+
+    def touch(self, name: str, path: Sequence) -> None:
+        """Сообщает об изменении значения по пути внутри коллекции"""
+        change = (name, tuple(path))
+        if not self.write_behind:
+            self.write(self.prepare([change]))
+            return
+        self._mark_dirty(change)
+        if self.max_dirty and len(self._dirty) >= self.max_dirty and self.on_backlog:
+            self.on_backlog()
+
+    def save(self, name: str) -> None:
+        """Сохраняет коллекцию целиком"""
+        self.touch(name, ())
+
+    def _mark_dirty(self, change: Change) -> None:
+        name, path = change
+        # Если уже помечен родительский путь, он и так запишет это изменение
+        for i in range(len(path)):
+            if (name, path[:i]) in self._dirty:
+                return
+        self._dirty[change] = None
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def take_dirty(self) -> List[Change]:
+        """Забирает накопленные изменения, отбрасывая перекрытые родительскими путями"""
+        dirty = self._dirty
+        self._dirty = {}
+        return [
+            (name, path) for name, path in dirty
+            if not any((name, path[:i]) in dirty for i in range(len(path)))
+        ]
+
+    def requeue(self, changes: List[Change]) -> None:
+        """Возвращает изменения в очередь после неудачной записи"""
+        for change in changes:
+            self._mark_dirty(change)
+
+    def prepare(self, changes: List[Change]) -> Any:
+        """Снимает данные для записи пачки изменений"""
+        names = dict.fromkeys(name for name, _ in changes)
+        return [
+            (self.files[name], json.dumps(self.collections[name], ensure_ascii=False, indent=2).encode('utf-8'))
+            for name in names
+        ]
+
+    def write(self, batch: Any) -> None:
+        """Записывает подготовленную пачку на диск"""
+        size = sum(write_bytes_atomic(path, payload) for path, payload in batch)
+        if self.on_write:
+            self.on_write(size)
+
+    def flush(self) -> None:
+        """Синхронно записывает все накопленные изменения"""
+        changes = self.take_dirty()
+        if changes:
+            self.write(self.prepare(changes))
+
+    def close(self) -> None:
+        self.flush()
+
+
+class JournalStorage(JsonStorage):
+    """Журналируемый режим (write-ahead log).
+
+    Каждое изменение дописывается в журнал одной короткой строкой
+    {"c": коллекция, "p": путь, "v": значение} или {"c", "p", "d": 1} для удаления,
+    поэтому стоимость записи зависит от размера изменения, а не всей базы.
+    При старте снимки (обычные JSON-файлы) загружаются и поверх них
+    воспроизводится журнал. Когда журнал вырастает больше порога, он
+    переименовывается, и фоновый поток строит из старых снимков и этого
+    сегмента новые снимки — не трогая данные в памяти процесса.
+    Неудачное уплотнение повторяется не чаще, чем с растущей паузой, а
+    после COMPACT_MAX_FAILURES неудач подряд отключается до перезапуска.
+    """
+
+    # Пауза перед повтором неудачного уплотнения (удваивается с каждой неудачей) и предел неудач подряд
+    COMPACT_RETRY_DELAY = 30.0
+    COMPACT_MAX_FAILURES = 5
+
+    def __init__(self, files: Dict[str, str], journal_file: str, compact_bytes: int = 1024 * 1024, compact: bool = True):
+        super().__init__(files)
+        self.journal_file = journal_file
+        self.compacting_file = f"{journal_file}.1"
+        self.compact_bytes = compact_bytes
+        self.compact_enabled = compact
+        self.journal_size = 0
+        self._compactor: Optional[threading.Thread] = None
+        self.compact_failures = 0
+        self.compact_error: Optional[Exception] = None
+        self._compact_retry_at = 0.0
+
+    def load(self) -> Dict[str, Any]:
+        self.collections = {name: read_json(self.files[name], {}) for name in COLLECTIONS}
+        # Сегмент от прерванного уплотнения воспроизводится раньше текущего журнала
+        self._replay(self.compacting_file, self.collections)
+        self.journal_size = self._replay(self.journal_file, self.collections)
+        return self.collections
+
+    @staticmethod
+    def _replay(journal_file: str, collections: Dict[str, Any]) -> int:
+        """Применяет журнал к коллекциям. Возвращает размер журнала в байтах"""
+        if not os.path.exists(journal_file):
+            return 0
+        applied = 0
+        with open(journal_file, 'rb') as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    # Недописанная последняя строка после аварийной остановки
+                    logger.warning(f"Пропущена повреждённая запись журнала {journal_file}")
+                    continue
+                name = record.get("c")
+                if name not in collections:
+                    continue
+                path = record.get("p", [])
+                if not path:
+                    collections[name] = record.get("v") or {}
+                else:
+                    apply_change(collections[name], path, record.get("v"), bool(record.get("d")))
+                applied += 1
+            size = f.tell()
+        if applied:
+            logger.info(f"Из журнала {journal_file} воспроизведено записей: {applied}")
+        return size
+
+    def prepare(self, changes: List[Change]) -> bytes:
+        lines = []
+        for name, path in changes:
+            value = resolve_path(self.collections[name], path)
+            record = {"c": name, "p": list(path)}
+            if value is _MISSING:
+                record["d"] = 1
+            else:
+                record["v"] = value
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        return "".join(lines).encode('utf-8')
+
+    def write(self, batch: bytes) -> None:
+        # Файл открывается на каждую запись: после ротации журнала (в том числе
+        # другим процессом) новые записи сразу попадают в новый файл
+        with open(self.journal_file, 'ab') as f:
+            f.write(batch)
+        self.journal_size += len(batch)
+        if self.on_write:
+            self.on_write(len(batch))
+        if (self.compact_enabled and self.journal_size >= self.compact_bytes
+                and time.monotonic() >= self._compact_retry_at):
+            self.compact()
+
+    def compact(self, wait: bool = False) -> None:
+        """Запускает фоновое уплотнение журнала в снимки; с wait=True дожидается его и пробрасывает ошибку"""
+        if self._compactor and self._compactor.is_alive():
+            return
+        # Если сегмент от прошлого уплотнения ещё не обработан, сначала доделываем его
+        if not os.path.exists(self.compacting_file):
+            if not os.path.exists(self.journal_file):
+                return
+            os.replace(self.journal_file, self.compacting_file)
+            self.journal_size = 0
+        self._compactor = threading.Thread(target=self._compact_segment, daemon=True)
+        self._compactor.start()
+        if wait:
+            self._compactor.join()
+            if self.compact_error is not None:
+                raise self.compact_error
+
+    def _compact_segment(self) -> None:
+        """Строит новые снимки из старых снимков и сегмента журнала"""
+        try:
+            snapshot = {name: read_json(self.files[name], {}) for name in COLLECTIONS}
+            self._replay(self.compacting_file, snapshot)
+            for name in COLLECTIONS:
+                write_json_atomic(self.files[name], snapshot[name])
+            os.remove(self.compacting_file)
+            self.compact_failures = 0
+            self.compact_error = None
+            logger.info("Журнал уплотнён в снимки")
+        except Exception as e:
+            self.compact_failures += 1
+            self.compact_error = e
+            delay = self.COMPACT_RETRY_DELAY * 2 ** (self.compact_failures - 1)
+            self._compact_retry_at = time.monotonic() + delay
+            if self.compact_failures >= self.COMPACT_MAX_FAILURES:
+                # Журнал продолжает работать, но растёт без уплотнения — нужен разбор причины
+                self.compact_enabled = False
+                logger.error(f"Уплотнение журнала отключено до перезапуска после {self.compact_failures} "
+                             f"неудач подряд, сегмент {self.compacting_file} не обработан: {e}")
+            else:
+                logger.error(f"Ошибка уплотнения журнала (неудача {self.compact_failures}), "
+                             f"повтор не раньше чем через {delay:.0f} с: {e}")
+
+    def close(self) -> None:
+        self.flush()
+        if self._compactor and self._compactor.is_alive():
+            self._compactor.join()
+
+
+class SqliteStorage(JsonStorage):
+    """Хранилище в SQLite.
+
+    Данные по-прежнему читаются из словарей в памяти (загружаются при
+    старте), а каждое изменение превращается в запись одной строки таблицы
+    (пользователь, сообщение, студент, голосование, ответ, вопрос). Строки
+    списков (сообщения, студенты, вопросы) имеют постоянный row_id, поэтому
+    процесс обновляет и удаляет только строки, которые он сам загрузил или
+    добавил: строки, добавленные в тот же файл другим процессом (веб-
+    приложением), не перезаписываются и не удаляются. Увидит их процесс
+    только после перечитывания (веб-приложение перечитывает базу на
+    запросах, бот — при перезапуске). Одновременную запись обеспечивают
+    режим WAL и busy_timeout.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY, grp TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_users_grp ON users (grp);
+        CREATE TABLE IF NOT EXISTS messages (
+            row_id TEXT PRIMARY KEY, grp TEXT NOT NULL, seq INTEGER NOT NULL, type TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_messages_grp_type ON messages (grp, type);
+        CREATE TABLE IF NOT EXISTS students (
+            row_id TEXT PRIMARY KEY, grp TEXT NOT NULL, seq INTEGER NOT NULL, user_id INTEGER, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_students_user ON students (user_id);
+        CREATE TABLE IF NOT EXISTS polls (
+            poll_id TEXT PRIMARY KEY, grp TEXT, status TEXT, created_at TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_polls_grp ON polls (grp, created_at);
+        CREATE TABLE IF NOT EXISTS poll_responses (
+            poll_id TEXT NOT NULL, user_id TEXT NOT NULL, status TEXT, data TEXT NOT NULL,
+            PRIMARY KEY (poll_id, user_id));
+        CREATE INDEX IF NOT EXISTS idx_poll_responses_user ON poll_responses (user_id);
+        CREATE TABLE IF NOT EXISTS questions (
+            row_id TEXT PRIMARY KEY, grp TEXT NOT NULL, seq INTEGER NOT NULL, id INTEGER, user_id INTEGER,
+            status TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_questions_status ON questions (status, grp);
+        CREATE INDEX IF NOT EXISTS idx_questions_user ON questions (user_id);
+    """
+
+    # Коллекции вида {группа: [элементы]} и их таблицы
+    LIST_TABLES = {"messages": "messages", "students": "students", "questions": "questions"}
+
+    def __init__(self, files: Dict[str, str], db_file: str, journal_file: str):
+        super().__init__(files)
+        self.db_file = db_file
+        self.journal_file = journal_file
+        self._statements: List[Tuple[str, tuple]] = []
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._upgrade_schema()
+        # Строки, известные этому процессу (загруженные или записанные им):
+        # (коллекция, группа) → {id(элемент): (элемент, row_id)}; ключи пользователей, голосований и ответов
+        self._rows: Dict[Tuple[str, str], Dict[int, Tuple[Any, str]]] = {}
+        self._known_users: set = set()
+        self._known_polls: set = set()
+        self._known_responses: Dict[str, set] = {}
+        # Прежние значения учёта, изменённые prepare(): возвращаются, если пачка не записалась
+        self._undo: Dict[str, Dict[Any, Any]] = {}
+
+    def _upgrade_schema(self) -> None:
+        """Переводит таблицы списков прежней схемы (ключ grp, seq) на постоянный row_id"""
+        for table in self.LIST_TABLES.values():
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if not columns or "row_id" in columns:
+                continue
+            # Индексы переезжают вместе с таблицей — удаляем их, чтобы SCHEMA создала их на новой
+            indexes = self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,)
+            ).fetchall()
+            for (index,) in indexes:
+                self.conn.execute(f"DROP INDEX {index}")
+            self.conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        self.conn.executescript(self.SCHEMA)
+        for table in self.LIST_TABLES.values():
+            if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"{table}_old",)).fetchone():
+                columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table}_old)")]
+                names = ", ".join(columns)
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.execute(f"INSERT INTO {table} (row_id, {names}) "
+                                      f"SELECT lower(hex(randomblob(16))), {names} FROM {table}_old")
+                    self.conn.execute(f"DROP TABLE {table}_old")
+                logger.info(f"Таблица {table} переведена на постоянные row_id")
+
+    def load(self) -> Dict[str, Any]:
+        if not self._is_migrated():
+            self.migrate_from_json()
+        conn = self.conn
+        users = {uid: json.loads(data) for uid, data in conn.execute("SELECT user_id, data FROM users")}
+        polls = {}
+        for poll_id, data in conn.execute("SELECT poll_id, data FROM polls ORDER BY created_at"):
+            poll = json.loads(data)
+            poll["responses"] = {}
+            polls[poll_id] = poll
+        self._known_responses = {}
+        for poll_id, user_id, data in conn.execute("SELECT poll_id, user_id, data FROM poll_responses"):
+            if poll_id in polls:
+                polls[poll_id]["responses"][user_id] = json.loads(data)
+                self._known_responses.setdefault(poll_id, set()).add(user_id)
+        self.collections = {"users": users, "polls": polls}
+        self._known_users = set(users)
+        self._known_polls = set(polls)
+        self._rows = {}
+        for name, table in self.LIST_TABLES.items():
+            groups: Dict[str, list] = {}
+            # Строки с одинаковым seq (добавленные разными процессами) — в порядке вставки
+            for row_id, grp, data in conn.execute(f"SELECT row_id, grp, data FROM {table} ORDER BY grp, seq, rowid"):
+                item = json.loads(data)
+                groups.setdefault(grp, []).append(item)
+                self._rows.setdefault((name, grp), {})[id(item)] = (item, row_id)
+            self.collections[name] = groups
+        return self.collections
+
+    def _is_migrated(self) -> bool:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        return row is not None
+
+    def migrate_from_json(self) -> None:
+        """Однократный импорт users/messages/students/polls/questions.json (и журнала, если он есть)"""
+        source = JournalStorage(self.files, self.journal_file, compact=False)
+        self.collections = source.load()
+        # Импорт заменяет содержимое базы целиком (в том числе при повторном запуске с --force)
+        tables = ("users", "polls", "poll_responses", *self.LIST_TABLES.values())
+        batch = [(f"DELETE FROM {table}", ()) for table in tables]
+        batch += self.prepare([(name, ()) for name in COLLECTIONS])
+        batch.append((
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+            (json.dumps({name: len(self.collections[name]) for name in COLLECTIONS}),)
+        ))
+        self.write(batch)
+        logger.info(f"Данные из JSON импортированы в {self.db_file}")
+
+    def prepare(self, changes: List[Change]) -> List[Tuple[str, tuple]]:
+        self._statements = []
+        self._undo = {"rows": {}, "users": {}, "polls": {}, "responses": {}}
+        for name, path in changes:
+            self._write_path(name, path)
+        statements, self._statements = self._statements, []
+        return statements
+
+    def write(self, batch: List[Tuple[str, tuple]]) -> None:
+        """Выполняет пачку в одной транзакции; при ошибке учёт строк возвращается к записанному"""
+        undo, self._undo = self._undo, {}
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                for sql, params in batch:
+                    self.conn.execute(sql, params)
+        except Exception:
+            self._rollback(undo)
+            raise
+        if self.on_write:
+            # Размер пачки — по сериализованным строкам; точный объём страниц SQLite не известен
+            self.on_write(sum(len(p.encode('utf-8')) for _, params in batch for p in params if isinstance(p, str)))
+
+    def _emit(self, sql: str, params: tuple = ()) -> None:
+        self._statements.append((sql, params))
+
+    def _remember(self, kind: str, key: Any, value: Any) -> None:
+        """Запоминает значение учёта до первого изменения в текущей пачке"""
+        self._undo[kind].setdefault(key, value)
+
+    def _rollback(self, undo: Dict[str, Dict[Any, Any]]) -> None:
+        """Возвращает учёт известных строк к состоянию до неудачной пачки"""
+        for key, rows in undo.get("rows", {}).items():
+            if rows is None:
+                self._rows.pop(key, None)
+            else:
+                self._rows[key] = rows
+        for known, kind in ((self._known_users, "users"), (self._known_polls, "polls")):
+            for key, present in undo.get(kind, {}).items():
+                if present:
+                    known.add(key)
+                else:
+                    known.discard(key)
+        for poll_id, users in undo.get("responses", {}).items():
+            if users is None:
+                self._known_responses.pop(poll_id, None)
+            else:
+                self._known_responses[poll_id] = users
+
+    def _write_path(self, name: str, path: Sequence) -> None:
+        """Формирует запись минимальной строки таблицы, затронутой изменением по пути"""
+        if not path:
+            self._write_collection(name)
+        elif name == "users":
+            self._write_user(path[0])
+        elif name == "polls":
+            if len(path) >= 3 and path[1] == "responses":
+                self._write_response(path[0], path[2])
+            else:
+                self._write_poll(path[0], with_responses=(len(path) == 1))
+        elif len(path) == 1 or not isinstance(path[1], int):
+            self._write_group(name, path[0])
+        else:
+            self._write_item(name, path[0], path[1])
+
+    def _write_collection(self, name: str) -> None:
+        """Записывает коллекцию целиком; удаляются только известные процессу строки, которых больше нет"""
+        data = self.collections[name]
+        if name == "users":
+            for user_id in self._known_users - data.keys():
+                self._write_user(user_id)
+            for user_id in data:
+                self._write_user(user_id)
+        elif name == "polls":
+            for poll_id in self._known_polls - data.keys():
+                self._write_poll(poll_id, with_responses=True)
+            for poll_id in data:
+                self._write_poll(poll_id, with_responses=True)
+        else:
+            groups = set(data) | {grp for table, grp in self._rows if table == name}
+            for grp in groups:
+                self._write_group(name, grp)
+
+    def _write_user(self, user_id: str) -> None:
+        user = self.collections["users"].get(user_id)
+        self._remember("users", user_id, user_id in self._known_users)
+        if user is None:
+            self._emit("DELETE FROM users WHERE user_id = ?", (user_id,))
+            self._known_users.discard(user_id)
+            return
+        self._emit(
+            "INSERT OR REPLACE INTO users (user_id, grp, data) VALUES (?, ?, ?)",
+            (user_id, user.get("group"), _dumps(user))
+        )
+        self._known_users.add(user_id)
+
+    def _write_poll(self, poll_id: str, with_responses: bool) -> None:
+        poll = self.collections["polls"].get(poll_id)
+        self._remember("polls", poll_id, poll_id in self._known_polls)
+        if poll is None:
+            self._emit("DELETE FROM polls WHERE poll_id = ?", (poll_id,))
+            self._emit("DELETE FROM poll_responses WHERE poll_id = ?", (poll_id,))
+            self._known_polls.discard(poll_id)
+            self._remember_responses(poll_id)
+            self._known_responses.pop(poll_id, None)
+            return
+        row = {k: v for k, v in poll.items() if k != "responses"}
+        self._emit(
+            "INSERT OR REPLACE INTO polls (poll_id, grp, status, created_at, data) VALUES (?, ?, ?, ?, ?)",
+            (poll_id, poll.get("group"), poll.get("status"), poll.get("created_at"), _dumps(row))
+        )
+        self._known_polls.add(poll_id)
+        if with_responses:
+            responses = poll.get("responses", {})
+            for user_id in self._known_responses.get(poll_id, set()) - responses.keys():
+                self._write_response(poll_id, user_id)
+            for user_id in responses:
+                self._write_response(poll_id, user_id)
+
+    def _write_response(self, poll_id: str, user_id: str) -> None:
+        response = resolve_path(self.collections["polls"], (poll_id, "responses", user_id))
+        self._remember_responses(poll_id)
+        if response is _MISSING:
+            self._emit("DELETE FROM poll_responses WHERE poll_id = ? AND user_id = ?", (poll_id, user_id))
+            self._known_responses.get(poll_id, set()).discard(user_id)
+            return
+        self._emit(
+            "INSERT OR REPLACE INTO poll_responses (poll_id, user_id, status, data) VALUES (?, ?, ?, ?)",
+            (poll_id, user_id, response.get("status"), _dumps(response))
+        )
+        self._known_responses.setdefault(poll_id, set()).add(user_id)
+
+    def _remember_responses(self, poll_id: str) -> None:
+        users = self._known_responses.get(poll_id)
+        self._remember("responses", poll_id, None if users is None else set(users))
+
+    def _write_group(self, name: str, grp: str) -> None:
+        """Записывает строки группы по их row_id; удаляет известные строки, которых больше нет в списке"""
+        table = self.LIST_TABLES[name]
+        known = self._rows.pop((name, grp), None)
+        self._remember("rows", (name, grp), known)
+        known = dict(known or {})
+        rows = {}
+        for seq, item in enumerate(self.collections[name].get(grp, [])):
+            entry = known.pop(id(item), None)
+            row_id = entry[1] if entry else uuid.uuid4().hex
+            rows[id(item)] = (item, row_id)
+            self._upsert_item(name, grp, seq, row_id, item)
+        for _, row_id in known.values():
+            self._emit(f"DELETE FROM {table} WHERE row_id = ?", (row_id,))
+        if rows:
+            self._rows[(name, grp)] = rows
+
+    def _write_item(self, name: str, grp: str, seq: int) -> None:
+        items = self.collections[name].get(grp, [])
+        rows = self._rows.get((name, grp), {})
+        item = items[seq] if seq < len(items) else _MISSING
+        entry = rows.get(id(item)) if item is not _MISSING else None
+        if entry is not None:
+            self._upsert_item(name, grp, seq, entry[1], item)
+        elif item is not _MISSING and seq == len(items) - 1 == len(rows):
+            # Добавление в конец списка — одна новая строка
+            row_id = uuid.uuid4().hex
+            self._remember("rows", (name, grp), self._rows.get((name, grp)))
+            self._rows[(name, grp)] = {**rows, id(item): (item, row_id)}
+            self._upsert_item(name, grp, seq, row_id, item)
+        else:
+            # Элемент заменён или удалён — сверяем группу целиком
+            self._write_group(name, grp)
+
+    def _upsert_item(self, name: str, grp: str, seq: int, row_id: str, item: Any) -> None:
+        if name == "messages":
+            self._emit(
+                "INSERT OR REPLACE INTO messages (row_id, grp, seq, type, data) VALUES (?, ?, ?, ?, ?)",
+                (row_id, grp, seq, item.get("type"), _dumps(item))
+            )
+        elif name == "students":
+            self._emit(
+                "INSERT OR REPLACE INTO students (row_id, grp, seq, user_id, data) VALUES (?, ?, ?, ?, ?)",
+                (row_id, grp, seq, item.get("user_id"), _dumps(item))
+            )
+        else:
+            self._emit(
+                "INSERT OR REPLACE INTO questions (row_id, grp, seq, id, user_id, status, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row_id, grp, seq, item.get("id"), item.get("user_id"), item.get("status"), _dumps(item))
+            )
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+
+class FlushScheduler:
+    """Фоновая пакетная запись изменений (write-behind).
+
+    Пока планировщик работает, хранилища лишь помечают изменённые пути.
+    Раз в interval секунд, либо сразу после накопления max_dirty изменений
+    в одном из них, все они записываются пачками: значения снимаются в
+    цикле событий, а запись на диск выполняется в рабочем потоке.
+    request_flush() приближает ближайшую запись (например, для голосов),
+    при этом все запросы до срока попадают в одну пачку. При остановке
+    выполняется принудительная запись всего накопленного.
+    """
+
+    def __init__(self, storages: Sequence[Any], interval: float = 2.0, max_dirty: int = 200):
+        self.storages = list(storages)
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._stopping = False
+        self._flush_now = False
+        self._deadline: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        for storage in self.storages:
+            storage.write_behind = True
+            storage.max_dirty = self.max_dirty
+            storage.on_backlog = self._on_backlog
+        self._task = asyncio.create_task(self._run())
+
+    def _on_backlog(self) -> None:
+        self._flush_now = True
+        self._wake.set()
+
+    def request_flush(self, delay: float) -> None:
+        """Просит записать накопленное не позже чем через delay секунд"""
+        deadline = time.monotonic() + delay
+        if self._deadline is None or deadline < self._deadline:
+            self._deadline = deadline
+            self._wake.set()
+
+    async def _run(self) -> None:
+        next_flush = time.monotonic() + self.interval
+        while not self._stopping:
+            due = next_flush if self._deadline is None else min(next_flush, self._deadline)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, due - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            # Пробуждение из-за нового срока request_flush — просто пересчитываем ожидание
+            if self._flush_now or time.monotonic() >= due:
+                self._flush_now = False
+                self._deadline = None
+                await self.flush()
+                next_flush = time.monotonic() + self.interval
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения: по одной пачке на хранилище"""
+        async with self._lock:
+            for storage in self.storages:
+                changes = storage.take_dirty()
+                if not changes:
+                    continue
+                batch = storage.prepare(changes)
+                try:
+                    await asyncio.to_thread(storage.write, batch)
+                except Exception as e:
+                    logger.error(f"Ошибка фоновой записи ({len(changes)} изменений), повторим позже: {e}")
+                    storage.requeue(changes)
+
+    async def stop(self) -> None:
+        """Останавливает планировщик и записывает всё накопленное"""
+        self._stopping = True
+        self._wake.set()
+        if self._task:
+            await self._task
+        await self.flush()
+        for storage in self.storages:
+            storage.write_behind = False
+            storage.on_backlog = None
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def create_storage(mode: str, files: Dict[str, str], journal_file: str, sqlite_file: str,
+                   compact_bytes: int, compact: bool = True) -> JsonStorage:
+    """Создаёт хранилище по названию режима из config.STORAGE_MODE"""
+    if mode == "json":
+        return JsonStorage(files)
+    if mode == "journal":
+        return JournalStorage(files, journal_file, compact_bytes, compact)
+    if mode == "sqlite":
+        return SqliteStorage(files, sqlite_file, journal_file)
+    raise ValueError(f"Неизвестный режим хранения: {mode}")
@@ -0,0 +1,178 @@
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+WEEKDAY_ALIASES = {
+    "понедельник": 0, "пн": 0,
+    "вторник": 1, "вт": 1,
+    "среда": 2, "ср": 2,
+    "четверг": 3, "чт": 3,
+    "пятница": 4, "пт": 4,
+    "суббота": 5, "сб": 5,
+    "воскресенье": 6, "вс": 6,
+}
+LESSON_KINDS = {"л", "пр", "лаб", "сем", "лр", "пз", "к", "конс"}
+CONTROL_FORMS = {"з", "зо", "э", "экз", "кр", "кп"}
+
+TIME_RANGE = re.compile(r'^(\d{1,2})[.:](\d{2})\s*[-–—]\s*(\d{1,2})[.:](\d{2})$')
+NUMBERED = re.compile(r'^(\d{1,2})[).]\s*(.*)$')
+TEACHER = re.compile(r'^(доц|проф|преп|ст\.\s*преп|асс|зав)\.?', re.IGNORECASE)
+ROOM = re.compile(r'^(ауд\.?\s*)?\d{1,4}[а-яa-z]?(/\d{1,4}[а-яa-z]?)*$', re.IGNORECASE)
+LABELED = re.compile(r'^(Время|Предмет|Преподаватель|Аудитория):\s*(.*)$')
+COLUMNS = re.compile(r'\s{2,}|\t')
+# Эмодзи, маркеры списков и разметка в начале строки
+LEADING_MARKS = re.compile(r'^[^\w(]+')
+
+
+def _weekday(token: str) -> Optional[int]:
+    return WEEKDAY_ALIASES.get(token.strip().rstrip(':.,').lower())
+
+
+def _time(hours: str, minutes: str) -> str:
+    return f"{int(hours):02d}:{minutes}"
+
+
+def _fill(lesson: Dict, tokens: List[str]) -> None:
+    """Раскладывает колонки строки по полям занятия"""
+    for token in tokens:
+        lowered = token.lower().rstrip('.')
+        if not lesson.get("kind") and lowered in LESSON_KINDS:
+            lesson["kind"] = token
+        elif not lesson.get("control") and lowered in CONTROL_FORMS:
+            lesson["control"] = token
+        elif not lesson.get("teacher") and TEACHER.match(token):
+            lesson["teacher"] = token
+        elif not lesson.get("room") and ROOM.match(token):
+            lesson["room"] = token
+        elif not lesson.get("subject"):
+            lesson["subject"] = token
+        elif token.startswith("("):
+            lesson["note"] = token
+        else:
+            lesson["subject"] = f"{lesson['subject']} {token}"
+
+
+def parse_timetable(text: str) -> List[Dict]:
+    """Разбирает текст расписания в список занятий.
+
+    Понимает таблицу, скопированную из расписания вуза (колонки через
+    несколько пробелов: день, время, дисциплина, вид, контроль,
+    преподаватель, аудитория; перенос названия на следующую строку),
+    нумерованные списки под днём недели ("ПН\\n1) История") и карточки
+    веб-приложения ("Время: ...", "Предмет: ..."). Занятия без дня недели
+    и пустые строки сетки пропускаются.
+    """
+    lessons: List[Dict] = []
+    weekday: Optional[int] = None
+    current: Optional[Dict] = None
+
+    def push(lesson: Dict) -> Dict:
+        lesson["weekday"] = weekday
+        lessons.append(lesson)
+        return lesson
+
+    for raw_line in (text or "").splitlines():
+        line = LEADING_MARKS.sub('', raw_line.replace('*', '')).strip()
+        if not line:
+            continue
+        tokens = [t.strip() for t in COLUMNS.split(line) if t.strip()]
+
+        day = _weekday(tokens[0])
+        if day is None:
+            # "Вторник 09.00-10.20" может быть разделён одним пробелом
+            head, _, rest = tokens[0].partition(' ')
+            if rest and _weekday(head) is not None:
+                day = _weekday(head)
+                tokens[0:1] = [rest]
+        else:
+            tokens = tokens[1:]
+        if day is not None:
+            weekday = day
+            current = None
+            if not tokens:
+                continue
+
+        labeled = LABELED.match(" ".join(tokens))
+        if labeled:
+            label, value = labeled.group(1), labeled.group(2).strip()
+            if label == "Время":
+                span = TIME_RANGE.match(value.replace(' ', ''))
+                current = push({"start": _time(*span.group(1, 2)), "end": _time(*span.group(3, 4))} if span else {"start": value, "end": ""})
+            elif current is not None and value:
+                current[{"Предмет": "subject", "Преподаватель": "teacher", "Аудитория": "room"}[label]] = value
+            continue
+
+        span = TIME_RANGE.match(tokens[0])
+        if span:
+            current = None
+            if len(tokens) > 1:
+                current = push({"start": _time(*span.group(1, 2)), "end": _time(*span.group(3, 4))})
+                _fill(current, tokens[1:])
+            continue
+
+        numbered = NUMBERED.match(line)
+        if numbered and weekday is not None:
+            current = None
+            rest = COLUMNS.split(numbered.group(2).strip())
+            if rest and rest[0]:
+                current = push({"num": int(numbered.group(1))})
+                _fill(current, rest)
+            continue
+
+        if current is not None:
+            # Продолжение предыдущей строки таблицы
+            _fill(current, tokens)
+
+    return [lesson for lesson in lessons if lesson["weekday"] is not None and lesson.get("subject")]
+
+
+def build_week(schedule_messages: List[Dict]) -> Dict[int, List[Dict]]:
+    """Собирает неделю из сообщений расписания по порядку: более позднее сообщение заменяет упомянутые в нём дни.
+
+    Сообщение, из которого занятия не разобрались (фото, документ, текст
+    в другом формате), сбрасывает неделю: актуально уже оно, а не прежнее
+    разобранное расписание.
+    """
+    week: Dict[int, List[Dict]] = {}
+    for message in schedule_messages:
+        lessons = message.get("lessons")
+        if lessons is None:
+            lessons = parse_timetable(message.get("content", ""))
+        if not lessons:
+            week = {}
+            continue
+        days: Dict[int, List[Dict]] = {}
+        for lesson in lessons:
+            days.setdefault(lesson["weekday"], []).append(lesson)
+        week.update(days)
+    return week
+
+
+def next_lesson(week: Dict[int, List[Dict]], now: Optional[datetime] = None) -> Optional[Dict]:
+    """Ближайшее занятие не раньше текущего момента (в пределах недели); возвращает занятие и дату"""
+    now = now or datetime.now()
+    current_time = now.strftime("%H:%M")
+    for offset in range(8):
+        day = now + timedelta(days=offset)
+        for lesson in week.get(day.weekday(), ()):
+            start = lesson.get("start")
+            if offset == 0 and (not start or start < current_time):
+                continue
+            return {"date": day.date().isoformat(), **lesson}
+    return None
+
+
+def format_lesson(lesson: Dict) -> str:
+    """Строка занятия для сообщения бота"""
+    if lesson.get("start"):
+        head = f"🕐 {lesson['start']}–{lesson['end']}" if lesson.get("end") else f"🕐 {lesson['start']}"
+    else:
+        head = f"{lesson.get('num', '•')})"
+    text = f"{head} {lesson.get('subject', '')}"
+    if lesson.get("kind"):
+        text += f" ({lesson['kind']})"
+    details = [value for value in (lesson.get("teacher"), lesson.get("room") and f"ауд. {lesson['room']}") if value]
+    if details:
+        text += "\n      " + ", ".join(details)
+    return text
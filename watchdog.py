@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Код бота: место блокировки ищется в его файлах, а не в библиотеках
+_SELF = os.path.abspath(__file__)
+_ROOT = os.path.dirname(_SELF)
+
+
+class LoopWatchdog:
+    """Сторож цикла событий: непрерывно измеряет его задержку и ловит блокирующий код.
+
+    Задача в цикле просыпается каждые interval секунд; опоздание
+    пробуждения — задержка цикла (гистограмма в метриках). Отдельный поток
+    следит за последним пробуждением: если цикл не отвечает дольше
+    threshold, он снимает стек потока цикла через sys._current_frames() —
+    то, что блокирует его прямо сейчас, — и пишет его в лог, а место в
+    коде бота учитывает в метриках. Одна блокировка сообщается один раз.
+    """
+
+    def __init__(self, metrics=None, interval: float = 0.1, threshold: float = 0.25):
+        self.metrics = metrics
+        self.interval = interval
+        self.threshold = threshold
+        self._beat = 0.0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Запускает сторожа (вызывается из работающего цикла событий)"""
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - started - self.interval)
+            if self.metrics:
+                self.metrics.observe_loop_lag(lag)
+            if lag >= self.threshold:
+                logger.warning(f"Цикл событий был заблокирован на {lag:.3f} с")
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if beat == reported or time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            reported = beat
+            stack = traceback.extract_stack(frame)
+            del frame
+            site = _blocking_site(stack)
+            if self.metrics:
+                self.metrics.record_stall(site)
+            logger.warning(
+                f"Цикл событий не отвечает дольше {self.threshold:.2f} с, блокирует {site}:\n"
+                + "".join(traceback.format_list(stack[-15:]))
+            )
+
+
+def _blocking_site(stack: traceback.StackSummary) -> str:
+    """Самый вложенный кадр из кода бота — место, которое стоит исправлять"""
+    for entry in reversed(stack):
+        path = os.path.abspath(entry.filename)
+        if path.startswith(_ROOT) and path != _SELF:
+            return f"{os.path.relpath(path, _ROOT)}:{entry.lineno} {entry.name}"
+    entry = stack[-1]
+    return f"{os.path.basename(entry.filename)}:{entry.lineno} {entry.name}"
@@ -5,6 +5,7 @@ FastAPI сервер для Telegram Web App с Context7 оптимизация
 
 import os
 import json
+import asyncio
 import logging
 from pathlib import Path
 from typing import Dict, Any, Optional
@@ -90,10 +91,15 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database import Database
-from config import load_faculties, load_groups, load_curators
+from config import load_faculties, load_groups, load_curators, OUTBOX_DIR
+from outbox import Outbox
+from analytics import build_attendance
 
 # Инициализация базы данных с правильными путями
 class WebAppDatabase(Database):
+    # Журнал уплотняет процесс бота
+    compact_journal = False
+
     def __init__(self):
         # Устанавливаем пути к файлам в корне проекта
         self.users_file = "../users.json"
@@ -101,9 +107,16 @@ class WebAppDatabase(Database):
         self.students_file = "../students.json"
         self.polls_file = "../polls.json"
         self.questions_file = "../questions.json"
+        self.journal_file = "../journal.log"
+        self.sqlite_file = "../umc.sqlite3"
+        self.navigation_file = "../navigation.json"
+        self.conversations_file = "../conversations.json"
+        self.archive_dir = "../archive"
         self.load_data()
 
 db = WebAppDatabase()
+# Рассылки веб-приложения доставляет бот из общей очереди
+outbox = Outbox(os.path.join("..", OUTBOX_DIR))
 
 # Функции для работы с данными
 def load_personalized_data(user_id: str, group: str, username: str, full_name: str, is_curator: bool) -> Dict[str, Any]:
@@ -157,6 +170,7 @@ def load_personalized_data(user_id: str, group: str, username: str, full_name: s
                 "subject": schedule_item.get('subject', 'Предмет не указан'),
                 "teacher": schedule_item.get('teacher', 'Преподаватель не указан'),
                 "room": schedule_item.get('room', ''),
+                "kind": schedule_item.get('kind', ''),
                 "day": schedule_item.get('day', 'Понедельник')
             })
         
@@ -189,10 +203,9 @@ def load_personalized_data(user_id: str, group: str, username: str, full_name: s
         
         # Обрабатываем голосования (только для группы пользователя)
         for poll_id, poll in group_polls:
-            # Получаем голос пользователя
-            user_vote = None
-            if user_id and poll.get("votes"):
-                user_vote = poll.get("votes", {}).get(str(user_id))
+            # Получаем голос пользователя и счётчики ответов
+            user_vote = poll.get("responses", {}).get(str(user_id), {}).get("status") if user_id else None
+            tally = db.get_poll_tally(poll_id)
             
             polls_data.append({
                 "id": poll_id,
@@ -201,15 +214,17 @@ def load_personalized_data(user_id: str, group: str, username: str, full_name: s
                 "status": "active" if poll.get("status") == "active" else "ended",
                 "created_at": poll.get("created_at", "2024-09-28T09:00:00"),
                 "options": [
-                    {"id": "present", "text": "Присутствую", "votes": poll.get("present", 0)},
-                    {"id": "absent", "text": "Отсутствую", "votes": poll.get("absent", 0)}
+                    {"id": "present", "text": "Присутствую", "votes": tally["present"]},
+                    {"id": "absent", "text": "Отсутствую", "votes": tally["absent"]}
                 ],
-                "total_votes": poll.get("present", 0) + poll.get("absent", 0),
+                "total_votes": tally["total"],
                 "user_vote": user_vote
             })
         
         return {
             "schedule": schedule_data,
+            "today_schedule": db.get_today_lessons(group),
+            "next_lesson": db.get_next_lesson(group),
             "announcements": announcements_data,
             "polls": polls_data,
             "questions": questions_data,
@@ -293,6 +308,7 @@ def load_real_data() -> Dict[str, Any]:
         
         # Обрабатываем голосования
         for poll_id, poll in polls.items():
+            tally = db.get_poll_tally(poll_id)
             polls_data.append({
                 "id": poll_id,
                 "title": poll.get("title", "Голосование посещаемости"),
@@ -300,10 +316,10 @@ def load_real_data() -> Dict[str, Any]:
                 "status": "active" if poll.get("status") == "active" else "ended",
                 "created_at": poll.get("created_at", "2024-09-28T09:00:00"),
                 "options": [
-                    {"id": "present", "text": "Присутствую", "votes": poll.get("present", 0)},
-                    {"id": "absent", "text": "Отсутствую", "votes": poll.get("absent", 0)}
+                    {"id": "present", "text": "Присутствую", "votes": tally["present"]},
+                    {"id": "absent", "text": "Отсутствую", "votes": tally["absent"]}
                 ],
-                "total_votes": poll.get("present", 0) + poll.get("absent", 0),
+                "total_votes": tally["total"],
                 "user_vote": None
             })
         
@@ -675,18 +691,8 @@ async def internal_error_handler(request: Request, exc: HTTPException):
         status_code=500
     )
 
-@app.post("/api/announcements")
-async def create_announcement(request: Request):
-    """Создание нового объявления"""
-    try:
-        data = await request.json()
-        # Здесь можно добавить логику создания объявления в БД
-        return JSONResponse({"status": "success", "message": "Объявление создано"})
-    except Exception as e:
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
-
 @app.post("/api/polls/{poll_id}/vote")
-async def vote_poll(poll_id: int, request: Request):
+async def vote_poll(poll_id: str, request: Request):
     """Голосование в опросе"""
     try:
         data = await request.json()
@@ -720,6 +726,48 @@ async def vote_poll(poll_id: int, request: Request):
         logger.error(f"Ошибка голосования: {e}")
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
+@app.get("/api/attendance")
+async def get_attendance(request: Request):
+    """Посещаемость группы по всем голосованиям (только для кураторов)"""
+    try:
+        user_id = request.query_params.get("user_id")
+        group = request.query_params.get("group")
+        since = request.query_params.get("since")
+        until = request.query_params.get("until")
+        
+        if not user_id or not group:
+            return JSONResponse(
+                {"status": "error", "message": "Нужны user_id и group"}, 
+                status_code=400
+            )
+        
+        if not db.is_curator(int(user_id), group):
+            return JSONResponse(
+                {"status": "error", "message": "У вас нет прав для просмотра посещаемости"}, 
+                status_code=403
+            )
+        
+        try:
+            since_dt = datetime.fromisoformat(since) if since else None
+            until_dt = datetime.fromisoformat(until) if until else None
+        except ValueError:
+            return JSONResponse(
+                {"status": "error", "message": "Даты since/until должны быть в формате ISO (2024-09-01)"}, 
+                status_code=400
+            )
+        
+        db.load_data()
+        # Архив за семестр читается и считается в рабочем потоке по снимку группы, не блокируя остальные запросы
+        snapshot = db.attendance_snapshot(group, since_dt, until_dt)
+        summary = await asyncio.to_thread(
+            lambda: build_attendance(db, group, since_dt, until_dt, snapshot=snapshot).summary()
+        )
+        return JSONResponse({"status": "success", "group": group, **summary})
+            
+    except Exception as e:
+        logger.error(f"Ошибка расчёта посещаемости: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
 @app.post("/api/schedule")
 async def create_schedule(request: Request):
     """Создание расписания (только для кураторов)"""
@@ -840,12 +888,16 @@ async def create_announcement(request: Request):
         if important:
             announcement_text = f"🚨 **ВАЖНО!** 🚨\n\n{announcement_text}"
         
-        # Сохраняем в базе данных
+        # Сохраняем в базе данных и ставим рассылку в очередь — доставит бот
         db.add_message(group, "announcement", announcement_text, int(user_id))
+        recipients = db.get_group_users(group)
+        broadcast_id = outbox.enqueue(group, recipients, "text", announcement_text, parse_mode='Markdown')
         
         return JSONResponse({
             "status": "success", 
-            "message": "Объявление отправлено",
+            "message": "Объявление поставлено в очередь рассылки",
+            "broadcast_id": broadcast_id,
+            "recipients": len(recipients),
             "announcement": {
                 "title": title,
                 "content": content,
@@ -0,0 +1,82 @@
+import hmac
+import logging
+from typing import Iterable, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+
+def create_web_app(application: Application, webhook_path: str, secret_token: Optional[str] = None,
+                   extra_routes: Iterable[Route] = ()) -> Starlette:
+    """ASGI-приложение бота: вебхук Telegram, проверка живости и дополнительные маршруты.
+
+    Обновление только проверяется и кладётся в очередь приложения, ответ
+    Telegram уходит сразу — обработка идёт тем же циклом событий, что и
+    при long polling.
+    """
+
+    async def telegram_webhook(request: Request) -> Response:
+        if secret_token and not hmac.compare_digest(
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token):
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return Response(status_code=400)
+        await application.update_queue.put(update)
+        return Response()
+
+    async def health(request: Request) -> Response:
+        return PlainTextResponse("Bot is running")
+
+    routes = [
+        Route(webhook_path, telegram_webhook, methods=["POST"]),
+        Route("/", health, methods=["GET", "HEAD"]),
+        Route("/health", health, methods=["GET", "HEAD"]),
+        *extra_routes,
+    ]
+    return Starlette(routes=routes)
+
+
+def metrics_route(metrics, path: str = "/metrics") -> Route:
+    """Маршрут с замерами бота в текстовом формате Prometheus"""
+
+    async def endpoint(request: Request) -> Response:
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    return Route(path, endpoint, methods=["GET"])
+
+
+async def run_webhook(application: Application, web_app: Starlette, webhook_url: str,
+                      port: int, secret_token: Optional[str] = None, **webhook_kwargs) -> None:
+    """Запускает бота в режиме вебхука на одном ASGI-сервере с остальными маршрутами.
+
+    Повторяет жизненный цикл run_polling (post_init, запуск, остановка,
+    post_shutdown); сервер останавливается по SIGINT/SIGTERM.
+    """
+    server = uvicorn.Server(uvicorn.Config(web_app, host="0.0.0.0", port=port, log_level="warning"))
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(webhook_url, secret_token=secret_token, **webhook_kwargs)
+        await application.start()
+        logger.info(f"Вебхук установлен: {webhook_url}, порт {port}")
+        try:
+            await server.serve()
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)